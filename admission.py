@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Admission control for upstream calls.
+
+A request must hold a ticket while it talks to Ark. Tickets are limited
+globally and per tenant API key (requests on the server's own keys are
+only bound by the global limit); requests that cannot start wait in a bounded
+queue ordered by priority class, and are rejected with a retry hint once
+the queue is full or they have waited too long. An optional tokens-per-
+minute bucket is charged an input-token estimate at admission and
+settled against the real usage when the response completes.
+"""
+
+import asyncio
+import itertools
+import time
+from typing import Dict, List, Optional
+
+from rate_limit import SharedTokenBucket, TokenBucket
+
+PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+# key_id of requests served with the server's own key pool; only tenant-supplied keys get a per-key cap
+SERVER_KEY = "default"
+
+
+class Overloaded(Exception):
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+
+class Ticket:
+    def __init__(self, controller: "AdmissionController", key_id: str, estimate: float):
+        self._controller = controller
+        self.key_id = key_id
+        self.estimate = estimate
+        self.started = time.monotonic()
+        self._settled = False
+        self._released = False
+
+    def settle(self, actual_tokens: float):
+        """Correct the up-front token estimate once real usage is known."""
+        if self._settled:
+            return
+        self._settled = True
+        if self._controller.tokens:
+            self._controller.tokens.charge(actual_tokens - self.estimate)
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._controller._release(self)
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "key_id", "future")
+
+    def __init__(self, priority: int, seq: int, key_id: str):
+        self.priority = priority
+        self.seq = seq
+        self.key_id = key_id
+        self.future = asyncio.get_running_loop().create_future()
+
+
+class AdmissionController:
+    def __init__(self, max_concurrency: int = 256, per_key_concurrency: int = 64, max_queue: int = 512,
+                 queue_timeout: float = 30.0, tokens_per_minute: float = 0, shared=None):
+        """shared: a SharedState to draw the tokens-per-minute budget from across worker processes."""
+        self.max_concurrency = max_concurrency
+        self.per_key_concurrency = per_key_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.tokens = None
+        if tokens_per_minute and shared is not None:
+            self.tokens = SharedTokenBucket(shared, "admission:tpm", tokens_per_minute / 60.0, tokens_per_minute)
+        elif tokens_per_minute:
+            self.tokens = TokenBucket(tokens_per_minute / 60.0, tokens_per_minute)
+        self.active = 0
+        self._per_key: Dict[str, int] = {}
+        self._queue: List[_Waiter] = []
+        self._seq = itertools.count()
+        # Smoothed ticket hold time, used to size Retry-After hints
+        self._avg_hold = 1.0
+        self.admitted = 0
+        self.queued_total = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+        self.rejected_tokens = 0
+
+    def _can_run(self, key_id: str) -> bool:
+        if self.active >= self.max_concurrency:
+            return False
+        return key_id == SERVER_KEY or self._per_key.get(key_id, 0) < self.per_key_concurrency
+
+    def _grant(self, key_id: str) -> Ticket:
+        self.active += 1
+        self._per_key[key_id] = self._per_key.get(key_id, 0) + 1
+        self.admitted += 1
+        return Ticket(self, key_id, 0)
+
+    def _retry_after(self) -> float:
+        return max(1.0, self._avg_hold * (len(self._queue) + 1) / self.max_concurrency)
+
+    async def admit(self, key_id: str, estimate: float = 0, priority: str = "normal") -> Ticket:
+        """Wait for a slot; raises Overloaded instead of queueing without bound."""
+        if self.tokens and not await self.tokens.atry_acquire(estimate):
+            self.rejected_tokens += 1
+            raise Overloaded("Token rate limit exceeded", self.tokens.retry_after(estimate))
+        try:
+            # Only start straight away if nobody is already waiting
+            if not self._queue and self._can_run(key_id):
+                ticket = self._grant(key_id)
+            else:
+                ticket = await self._wait(key_id, PRIORITIES.get(priority, PRIORITIES["normal"]))
+        except BaseException:
+            if self.tokens:
+                self.tokens.charge(-estimate)
+            raise
+        ticket.estimate = estimate
+        return ticket
+
+    async def _wait(self, key_id: str, priority: int) -> Ticket:
+        if len(self._queue) >= self.max_queue:
+            self.rejected_queue_full += 1
+            raise Overloaded("Server busy, admission queue full", self._retry_after())
+        waiter = _Waiter(priority, next(self._seq), key_id)
+        self._queue.append(waiter)
+        self.queued_total += 1
+        # Waiters held back only by their own key's cap must not block other keys
+        self._dispatch()
+        try:
+            return await asyncio.wait_for(asyncio.shield(waiter.future), self.queue_timeout)
+        except BaseException as e:
+            if waiter in self._queue:
+                self._queue.remove(waiter)
+            elif waiter.future.done():
+                # Granted a slot just as we gave up on it
+                waiter.future.result().release()
+            if isinstance(e, asyncio.TimeoutError):
+                self.rejected_timeout += 1
+                raise Overloaded("Server busy, timed out waiting for a slot", self._retry_after()) from None
+            raise
+
+    def _release(self, ticket: Ticket):
+        self.active -= 1
+        remaining = self._per_key[ticket.key_id] - 1
+        if remaining:
+            self._per_key[ticket.key_id] = remaining
+        else:
+            del self._per_key[ticket.key_id]
+        self._avg_hold = 0.9 * self._avg_hold + 0.1 * (time.monotonic() - ticket.started)
+        self._dispatch()
+
+    def _dispatch(self):
+        for waiter in sorted(self._queue, key=lambda w: (w.priority, w.seq)):
+            if self.active >= self.max_concurrency:
+                break
+            if waiter.future.done() or not self._can_run(waiter.key_id):
+                continue
+            self._queue.remove(waiter)
+            waiter.future.set_result(self._grant(waiter.key_id))
+
+    def stats(self, tokens_available: Optional[float] = None) -> dict:
+        stats = {
+            "active": self.active,
+            "queued": len(self._queue),
+            "admitted": self.admitted,
+            "queued_total": self.queued_total,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_timeout": self.rejected_timeout,
+            "rejected_tokens": self.rejected_tokens,
+        }
+        if self.tokens:
+            stats["tokens_available"] = round(self.tokens.available() if tokens_available is None else tokens_available)
+        return stats
+
+    async def astats(self) -> dict:
+        """stats() for the event loop: reading a shared bucket's level runs on the shared file's threads."""
+        if isinstance(self.tokens, SharedTokenBucket):
+            return self.stats(await self.tokens.state.run(self.tokens.available))
+        return self.stats()
+
+
+def from_config(config, shared=None) -> Optional[AdmissionController]:
+    """Build the controller from the [ADMISSION] section, or None when disabled."""
+    if not config.getboolean("ADMISSION", "enabled", fallback=True):
+        return None
+    return AdmissionController(
+        max_concurrency=config.getint("ADMISSION", "max_concurrency", fallback=256),
+        per_key_concurrency=config.getint("ADMISSION", "per_key_concurrency", fallback=64),
+        max_queue=config.getint("ADMISSION", "max_queue", fallback=512),
+        queue_timeout=config.getfloat("ADMISSION", "queue_timeout", fallback=30.0),
+        tokens_per_minute=config.getfloat("ADMISSION", "tokens_per_minute", fallback=0),
+        shared=shared,
+    )
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Ark 批量调用工具：把 ark_demo.py 的单次调用扩展为 JSONL 批处理。
+
+输入文件每行一个请求，支持两种写法：
+    {"id": "a1", "prompt": "你看见了什么？", "image_url": "https://..."}
+    {"id": "a2", "messages": [{"role": "user", "content": "..."}], "model": "..."}
+
+结果按完成顺序逐行写入输出 JSONL。进度定期写入 <output>.ckpt，
+中断后重新运行同一命令即可从断点继续，已成功的行不会重复调用。
+可重试的失败（429 / 5xx / 网络错误）也写入输出并记录在断点文件中，重新运行时自动重试，
+重试结果追加在输出末尾，同一 line 以最后一条记录为准；格式错误的行与 400 等
+永久失败只记录一次，不再重试。
+输入按流读取、在途请求有上限，百万行文件内存占用也保持平稳。
+
+    python ark_batch.py requests.jsonl -o results.jsonl --workers 16 --rps 10 --tpm 200000
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+import httpx
+from volcenginesdkarkruntime import AsyncArk
+
+from rate_limit import TokenBucket
+from resilience import is_retryable
+from settings import MODEL_ID, api_key, base_url
+
+
+def build_messages(req: dict) -> list:
+    if "messages" in req:
+        return req["messages"]
+    content = [{"type": "text", "text": req["prompt"]}]
+    if req.get("image_url"):
+        content.append({"type": "image_url", "image_url": {"url": req["image_url"]}})
+    return [{"role": "user", "content": content}]
+
+
+def estimate_tokens(messages: list, expected_output: int) -> int:
+    """Rough upfront cost for the TPM limiter; settled against real usage afterwards."""
+    total = expected_output
+    for m in messages:
+        content = m.get("content")
+        if isinstance(content, str):
+            total += len(content) // 2 + 1
+            continue
+        for part in content or []:
+            if part.get("type") == "text":
+                total += len(part.get("text", "")) // 2 + 1
+            else:
+                total += 1000
+    return total
+
+
+class Checkpoint:
+    """
+    Lines below ``watermark`` are all finished and their results are in the
+    output file before ``offset``; ``done`` holds finished lines above it.
+    On resume the output is truncated to ``offset`` so nothing is duplicated.
+    ``failed`` holds finished lines whose call failed with a retryable error:
+    they still advance the watermark (so one failure does not stall the
+    window) but run again on resume. Permanent failures (a malformed line, a
+    400) are simply done.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.watermark = 0
+        self.done = set()
+        self.offset = 0
+        self.failed = set()
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                state = json.load(f)
+            self.watermark = state["watermark"]
+            self.done = set(state["done"])
+            self.offset = state["offset"]
+            self.failed = set(state.get("failed", []))
+
+    def is_done(self, line_no: int) -> bool:
+        if line_no in self.failed:
+            return False
+        return line_no < self.watermark or line_no in self.done
+
+    def mark(self, line_no: int, retry: bool = False):
+        if retry:
+            self.failed.add(line_no)
+        else:
+            self.failed.discard(line_no)
+        if line_no < self.watermark:
+            # A retried line from an earlier run
+            return
+        self.done.add(line_no)
+        while self.watermark in self.done:
+            self.done.remove(self.watermark)
+            self.watermark += 1
+
+    def save(self, offset: int, complete: bool = False):
+        self.offset = offset
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"watermark": self.watermark, "done": sorted(self.done), "failed": sorted(self.failed),
+                       "offset": offset, "complete": complete}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+
+class BatchRunner:
+    def __init__(self, args, client):
+        self.args = args
+        self.client = client
+        self.rps = TokenBucket(args.rps, max(1.0, args.rps)) if args.rps else None
+        self.tpm = TokenBucket(args.tpm / 60.0, args.tpm) if args.tpm else None
+        self.ckpt = Checkpoint(args.output + ".ckpt")
+        self.progress = asyncio.Event()
+        self.completed = 0
+        self.failed = 0
+        self.tokens = 0
+        self.since_save = 0
+        self.last_save = time.monotonic()
+
+    async def call(self, req: dict) -> dict:
+        messages = build_messages(req)
+        estimate = estimate_tokens(messages, self.args.expected_output)
+        if self.rps:
+            await self.rps.acquire()
+        if self.tpm:
+            await self.tpm.acquire(estimate)
+        kwargs = {"model": req.get("model") or self.args.model, "messages": messages}
+        if req.get("max_tokens"):
+            kwargs["max_tokens"] = req["max_tokens"]
+        try:
+            response = await self.client.chat.completions.create(**kwargs)
+        except Exception:
+            if self.tpm:
+                self.tpm.charge(-estimate)
+            raise
+        usage = {
+            "prompt_tokens": response.usage.prompt_tokens,
+            "completion_tokens": response.usage.completion_tokens,
+            "total_tokens": response.usage.total_tokens,
+        }
+        if self.tpm:
+            self.tpm.charge(usage["total_tokens"] - estimate)
+        return {
+            "ok": True,
+            "content": response.choices[0].message.content,
+            "model": response.model,
+            "response_id": response.id,
+            "usage": usage,
+        }
+
+    def finish(self, out, line_no: int, record: dict):
+        out.write((json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8"))
+        self.ckpt.mark(line_no, record.get("retryable", False))
+        self.completed += 1
+        self.since_save += 1
+        self.progress.set()
+        if self.since_save >= self.args.checkpoint_every or time.monotonic() - self.last_save > 5:
+            self.save(out)
+
+    def save(self, out, complete: bool = False):
+        out.flush()
+        os.fsync(out.fileno())
+        self.ckpt.save(out.tell(), complete)
+        self.since_save = 0
+        self.last_save = time.monotonic()
+
+    async def worker(self, queue: asyncio.Queue, out):
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            line_no, text = item
+            record = {"line": line_no}
+            try:
+                req = json.loads(text)
+                record["id"] = req.get("id")
+                record.update(await self.call(req))
+            except Exception as e:
+                self.failed += 1
+                record.update({"ok": False, "error": f"{type(e).__name__}: {e}", "retryable": is_retryable(e)})
+            self.tokens += record.get("usage", {}).get("total_tokens", 0)
+            self.finish(out, line_no, record)
+
+    async def produce(self, queue: asyncio.Queue, out):
+        with open(self.args.input, encoding="utf-8") as f:
+            for line_no, text in enumerate(f):
+                if self.ckpt.is_done(line_no):
+                    continue
+                if not text.strip():
+                    self.ckpt.mark(line_no)
+                    continue
+                # Bound how far ahead of the oldest unfinished line we go, so
+                # the checkpoint's done set stays small
+                while line_no - self.ckpt.watermark > self.args.window:
+                    self.progress.clear()
+                    await self.progress.wait()
+                await queue.put((line_no, text))
+        for _ in range(self.args.workers):
+            await queue.put(None)
+
+    async def report(self):
+        started = time.monotonic()
+        while True:
+            await asyncio.sleep(5)
+            elapsed = time.monotonic() - started
+            print(f"[{elapsed:6.0f}s] done={self.completed} failed={self.failed} "
+                  f"rate={self.completed / elapsed:.1f}/s tokens={self.tokens} watermark={self.ckpt.watermark}",
+                  file=sys.stderr)
+
+    async def run(self):
+        mode = "r+b" if os.path.exists(self.args.output) else "wb"
+        with open(self.args.output, mode) as out:
+            # Drop results written after the last checkpoint; those lines run again
+            out.truncate(self.ckpt.offset)
+            out.seek(self.ckpt.offset)
+            if self.ckpt.watermark or self.ckpt.done:
+                done = self.ckpt.watermark + len(self.ckpt.done) - len(self.ckpt.failed)
+                print(f"Resuming: {done} lines already done, retrying {len(self.ckpt.failed)} failed", file=sys.stderr)
+            queue = asyncio.Queue(maxsize=self.args.workers * 2)
+            reporter = asyncio.create_task(self.report())
+            finished = False
+            try:
+                await asyncio.gather(
+                    self.produce(queue, out),
+                    *(self.worker(queue, out) for _ in range(self.args.workers)),
+                )
+                finished = True
+            finally:
+                reporter.cancel()
+                # Progress is kept on a crash or Ctrl-C, but only a clean run with nothing left to retry is complete
+                self.save(out, complete=finished and not self.ckpt.failed)
+        print(f"Finished: {self.completed} lines this run, {self.failed} failed, {self.tokens} tokens", file=sys.stderr)
+        if self.ckpt.failed:
+            print(f"{len(self.ckpt.failed)} lines failed with retryable errors; run the same command again to retry them",
+                  file=sys.stderr)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="JSONL file of requests")
+    parser.add_argument("-o", "--output", help="results JSONL (default: <input>.results.jsonl)")
+    parser.add_argument("--model", default=MODEL_ID)
+    parser.add_argument("--workers", type=int, default=8, help="concurrent requests")
+    parser.add_argument("--rps", type=float, default=0, help="requests per second limit (0 = unlimited)")
+    parser.add_argument("--tpm", type=float, default=0, help="tokens per minute limit (0 = unlimited)")
+    parser.add_argument("--expected-output", type=int, default=500, help="output tokens assumed per request for --tpm")
+    parser.add_argument("--checkpoint-every", type=int, default=100, help="lines between checkpoints")
+    parser.add_argument("--window", type=int, default=10000, help="max lines in flight past the oldest unfinished one")
+    args = parser.parse_args()
+    args.output = args.output or os.path.splitext(args.input)[0] + ".results.jsonl"
+
+    if not api_key:
+        parser.error("Missing ARK_API_KEY or config.ini ARK.api_key")
+    http_client = httpx.AsyncClient(limits=httpx.Limits(max_connections=args.workers * 2, max_keepalive_connections=args.workers))
+    client = AsyncArk(base_url=base_url, api_key=api_key, http_client=http_client)
+    try:
+        await BatchRunner(args, client).run()
+    finally:
+        await client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Registry of ready Ark clients keyed by the API key a browser sends along.
+
+Each tenant key gets one client with its own warm connection pool. The
+registry is bounded: least recently used and idle clients are evicted and
+closed once no request is still using them. Keys are only ever stored as
+their SHA-256 fingerprint, and reported as its first 12 hex digits.
+"""
+
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict
+
+
+def fingerprint(api_key: str) -> str:
+    """
+    Stable, non-reversible id for an API key: the full digest, because it is the
+    identity of per-key state (clients, admission, chains, single-flight).
+    """
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+
+class _Entry:
+    __slots__ = ("client", "last_used", "leases", "evicted")
+
+    def __init__(self, client):
+        self.client = client
+        self.last_used = time.monotonic()
+        self.leases = 0
+        self.evicted = False
+
+
+class ClientLease:
+    """A client checked out of the registry. Call release() when the request ends."""
+
+    def __init__(self, registry: "ClientRegistry", entry: _Entry):
+        self._registry = registry
+        self._entry = entry
+        self.client = entry.client
+
+    async def release(self):
+        if self._entry is None:
+            return
+        entry, self._entry = self._entry, None
+        await self._registry._release(entry)
+
+
+class ClientRegistry:
+    def __init__(self, factory: Callable[[str], Any], max_size: int = 256, idle_ttl: float = 600.0):
+        self._factory = factory
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    async def acquire(self, api_key: str) -> ClientLease:
+        key_id = fingerprint(api_key)
+        now = time.monotonic()
+        await self._evict_idle(now)
+
+        entry = self._entries.get(key_id)
+        if entry is not None:
+            self.hits += 1
+            self._entries.move_to_end(key_id)
+        else:
+            self.misses += 1
+            entry = _Entry(self._factory(api_key))
+            self._entries[key_id] = entry
+            while len(self._entries) > self.max_size:
+                _, oldest = self._entries.popitem(last=False)
+                await self._evict(oldest)
+
+        entry.last_used = now
+        entry.leases += 1
+        return ClientLease(self, entry)
+
+    async def _release(self, entry: _Entry):
+        entry.leases -= 1
+        entry.last_used = time.monotonic()
+        if entry.evicted and entry.leases == 0:
+            await entry.client.close()
+
+    async def _evict_idle(self, now: float):
+        # Entries are in LRU order, so only the head can be past the idle TTL
+        while self._entries:
+            key_id, entry = next(iter(self._entries.items()))
+            if now - entry.last_used < self.idle_ttl or entry.leases:
+                break
+            del self._entries[key_id]
+            await self._evict(entry)
+
+    async def _evict(self, entry: _Entry):
+        self.evictions += 1
+        entry.evicted = True
+        # Clients still serving a stream are closed by the last release()
+        if entry.leases == 0:
+            await entry.client.close()
+
+    async def close_all(self):
+        entries = list(self._entries.values())
+        self._entries.clear()
+        for entry in entries:
+            await entry.client.close()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
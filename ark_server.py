@@ -1,28 +1,256 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
-import os
+import io
 import json
-import configparser
+import math
+import base64
+import hashlib
+import time
+import asyncio
+from contextlib import asynccontextmanager
 from typing import List, Literal, Optional, Union, Any, Dict
-from fastapi import FastAPI, HTTPException
+import httpx
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
+from starlette.formparsers import MultiPartException, MultiPartParser
+from ark_clients import ClientRegistry, fingerprint
+import fuzzy_cache
+import response_cache
+import resumable
+import stream_pipeline
+from response_cache import cache_key
+from stream_pipeline import usage_dict
+from image_store import ImageStore
+from conversation_chain import ChainStore
+import conversation_store
+from single_flight import SingleFlight
+import admission
+from admission import Overloaded
+import resilience
+from resilience import CircuitOpen
+import hedge
+import image_preprocess
+import warmup
+import shared_state
+import static_assets
+import key_pool
+import backend
+import sse
+import metrics
 
-config = configparser.ConfigParser()
-config.read("config.ini")
+from settings import config, api_key, base_url, MODEL_ID
 
-api_key = os.getenv("ARK_API_KEY") or config.get("ARK", "api_key", fallback=None)
+# resilience.py retries upstream calls itself; SDK retries on top would multiply attempts
+SDK_MAX_RETRIES = 0 if config.getboolean("RESILIENCE", "enabled", fallback=True) else 2
+
+# Merge content deltas arriving within this window into one SSE frame (0 disables)
+COALESCE_WINDOW = config.getfloat("STREAM", "coalesce_ms", fallback=30.0) / 1000
+COALESCE_BYTES = config.getint("STREAM", "coalesce_bytes", fallback=2048)
+
+# Limits for multipart chat requests (/api/chat/form)
+UPLOAD_MAX_BODY = config.getint("UPLOADS", "max_body_mb", fallback=32) * 1024 * 1024
+UPLOAD_MAX_FILES = config.getint("UPLOADS", "max_files", fallback=8)
+UPLOAD_SPOOL_BYTES = config.getint("UPLOADS", "spool_kb", fallback=1024) * 1024
+
+REGISTRY = metrics.Registry()
+REQUESTS = REGISTRY.counter("ark_requests_total", "Chat requests received", ("model", "stream"))
+UPSTREAM_LATENCY = REGISTRY.histogram("ark_upstream_latency_seconds", "Time until the upstream call returns (response headers for streams)", ("model",))
+TTFT = REGISTRY.histogram("ark_time_to_first_token_seconds", "Time from request start to the first content delta", ("model",))
+STREAM_DURATION = REGISTRY.histogram("ark_stream_duration_seconds", "Lifetime of SSE streams", ("model",))
+ACTIVE_STREAMS = REGISTRY.gauge("ark_active_streams", "SSE streams currently open", ("model",))
+INPUT_TOKENS = REGISTRY.counter("ark_input_tokens_total", "Upstream input tokens", ("model",))
+CACHED_TOKENS = REGISTRY.counter("ark_cached_input_tokens_total", "Upstream input tokens served from context cache", ("model",))
+OUTPUT_TOKENS = REGISTRY.counter("ark_output_tokens_total", "Upstream output tokens", ("model",))
+WEB_SEARCH_CALLS = REGISTRY.counter("ark_web_search_calls_total", "web_search tool calls", ("model",))
+CANCELLED_STREAMS = REGISTRY.counter("ark_cancelled_streams_total", "Streams cut short because the client disconnected", ("model",))
+CANCELLED_DELTAS = REGISTRY.counter("ark_cancelled_stream_deltas_total", "Text deltas generated before a client disconnect (roughly the output tokens billed)", ("model",))
+ERRORS = REGISTRY.counter("ark_errors_total", "Failed requests and streams by error class", ("model", "error"))
+
+# Models that get their own metric series; anything else a client asks for is counted as "other",
+# so arbitrary model names cannot create unbounded series
+KNOWN_MODELS = {MODEL_ID} | {
+    m.strip() for option in (("ARK", "models"), ("HEDGE", "models"))
+    for m in config.get(*option, fallback="").split(",") if m.strip()
+}
+
+def metric_model(model: str) -> str:
+    return model if model in KNOWN_MODELS else "other"
+
+def record_usage(model: str, usage: dict):
+    INPUT_TOKENS.inc(model, amount=usage["prompt_tokens"])
+    CACHED_TOKENS.inc(model, amount=usage["cached_tokens"])
+    OUTPUT_TOKENS.inc(model, amount=usage["completion_tokens"])
+
+def breaker_metrics(layer) -> List[str]:
+    if not layer:
+        return []
+    lines = ["# HELP ark_circuit_breaker_open Whether the model's circuit breaker is rejecting calls (0 closed, 0.5 half open, 1 open)",
+             "# TYPE ark_circuit_breaker_open gauge"]
+    # Unconfigured models already share the "other" breaker, so the series are bounded
+    values = {"closed": 0, "half_open": 0.5, "open": 1}
+    lines += [f'ark_circuit_breaker_open{{model="{model}"}} {values[breaker.state]}' for model, breaker in layer.breakers.items()]
+    return lines
+
+def pool_metrics(pool) -> List[str]:
+    if not pool:
+        return []
+    stats = pool.stats()
+    lines = []
+    for field, kind, help_text in (("share", "gauge", "Current routing share of the upstream, by call kind"),
+                                   ("latency", "gauge", "Smoothed upstream call latency in seconds, by call kind"),
+                                   ("error_rate", "gauge", "Smoothed upstream error rate"),
+                                   ("requests", "counter", "Calls routed to the upstream")):
+        lines += [f"# HELP ark_pool_{field} {help_text}", f"# TYPE ark_pool_{field} {kind}"]
+        for name, u in stats.items():
+            if isinstance(u[field], dict):
+                # stream: time to response headers; full: whole answer
+                lines += [f'ark_pool_{field}{{upstream="{name}",kind="{k}"}} {v}' for k, v in u[field].items()]
+            else:
+                lines.append(f'ark_pool_{field}{{upstream="{name}"}} {u[field]}')
+    return lines
+
+def stage_metrics(profiler) -> List[str]:
+    if not profiler:
+        return []
+    stats = profiler.stats()
+    lines = ["# HELP ark_stream_stage_calls_total Stream pipeline handler / transform calls",
+             "# TYPE ark_stream_stage_calls_total counter"]
+    lines += [f'ark_stream_stage_calls_total{{stage="{stage}"}} {s["calls"]}' for stage, s in stats.items()]
+    lines += ["# HELP ark_stream_stage_seconds_total Time spent in a stream pipeline stage",
+              "# TYPE ark_stream_stage_seconds_total counter"]
+    lines += [f'ark_stream_stage_seconds_total{{stage="{stage}"}} {s["seconds"]}' for stage, s in stats.items()]
+    return lines
+
+def build_http_client(max_connections: Optional[int] = None, max_keepalive_connections: Optional[int] = None) -> httpx.AsyncClient:
+    """Long-lived connection pool for an Ark client, sized from the [HTTP] config section."""
+    limits = httpx.Limits(
+        max_connections=max_connections or config.getint("HTTP", "max_connections", fallback=500),
+        max_keepalive_connections=max_keepalive_connections or config.getint("HTTP", "max_keepalive_connections", fallback=100),
+        keepalive_expiry=config.getfloat("HTTP", "keepalive_expiry", fallback=60.0),
+    )
+    timeout = httpx.Timeout(
+        config.getfloat("HTTP", "timeout", fallback=600.0),
+        connect=config.getfloat("HTTP", "connect_timeout", fallback=10.0),
+    )
+    return httpx.AsyncClient(limits=limits, timeout=timeout)
+
+def make_tenant_client(key: str):
+    """Ark client with its own, smaller pool for a request-supplied API key."""
+    from volcenginesdkarkruntime import AsyncArk
+    http_client = build_http_client(
+        max_connections=config.getint("CLIENTS", "max_connections_per_key", fallback=50),
+        max_keepalive_connections=config.getint("CLIENTS", "max_keepalive_per_key", fallback=10),
+    )
+    return AsyncArk(base_url=base_url, api_key=key, timeout=http_client.timeout, max_retries=SDK_MAX_RETRIES, http_client=http_client)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.warmup = warmup.from_config(config)
+    started = time.perf_counter()
+    from volcenginesdkarkruntime import AsyncArk
+    app.state.warmup.step("sdk_import", started)
+    started = time.perf_counter()
+    app.state.http_client = build_http_client()
+    app.state.clients = ClientRegistry(
+        make_tenant_client,
+        max_size=config.getint("CLIENTS", "max_size", fallback=256),
+        idle_ttl=config.getfloat("CLIENTS", "idle_ttl", fallback=600.0),
+    )
+    # With uvicorn --workers N, cache, images, chains and the token budget live in one SQLite file
+    app.state.shared = shared_state.from_config(config)
+    app.state.cache = response_cache.from_config(config, app.state.shared)
+    app.state.fuzzy = fuzzy_cache.from_config(config)
+    app.state.images = ImageStore(
+        max_bytes=config.getint("IMAGES", "max_mb", fallback=512) * 1024 * 1024,
+        max_image_bytes=config.getint("IMAGES", "max_image_mb", fallback=10) * 1024 * 1024,
+        shared=app.state.shared,
+        ttl=config.getfloat("IMAGES", "ttl", fallback=24 * 3600.0),
+    )
+    app.state.chains = ChainStore(
+        max_size=config.getint("CHAIN", "max_conversations", fallback=10000),
+        ttl=config.getfloat("CHAIN", "ttl", fallback=24 * 3600.0),
+        shared=app.state.shared,
+    ) if config.getboolean("CHAIN", "enabled", fallback=False) else None
+    app.state.admission = admission.from_config(config, app.state.shared)
+    app.state.conversations = conversation_store.from_config(config)
+    app.state.preprocessor = image_preprocess.from_config(config)
+    app.state.hedger = hedge.from_config(config, tracked=KNOWN_MODELS)
+    app.state.pipeline = stream_pipeline.from_config(config)
+    app.state.flights = SingleFlight() if config.getboolean("SINGLEFLIGHT", "enabled", fallback=True) else None
+    app.state.resume = resumable.from_config(config)
+    # Component counters are read at scrape time, so they cost nothing per request
+    if not getattr(app.state, "collectors_registered", False):
+        REGISTRY.add_collector(metrics.stats_collector("ark_client_registry", lambda: app.state.clients.stats(), "Tenant client registry"))
+        REGISTRY.add_collector(metrics.stats_collector("ark_response_cache", lambda: app.state.cache and app.state.cache.stats(), "Response cache"))
+        REGISTRY.add_collector(metrics.stats_collector("ark_fuzzy_cache", lambda: app.state.fuzzy and app.state.fuzzy.stats(), "Fuzzy prompt cache"))
+        REGISTRY.add_collector(metrics.stats_collector("ark_image_store", lambda: app.state.images.astats(), "Image store"))
+        REGISTRY.add_collector(metrics.stats_collector("ark_conversation_chain", lambda: app.state.chains and app.state.chains.astats(), "Conversation chaining"))
+        REGISTRY.add_collector(metrics.stats_collector("ark_singleflight", lambda: app.state.flights and app.state.flights.stats(), "Request coalescing"))
+        REGISTRY.add_collector(metrics.stats_collector("ark_resumable", lambda: app.state.resume and app.state.resume.stats(), "Resumable streams"))
+        REGISTRY.add_collector(metrics.stats_collector("ark_upstream", lambda: app.state.resilience and app.state.resilience.stats(), "Upstream retries"))
+        REGISTRY.add_collector(lambda: breaker_metrics(app.state.resilience))
+        REGISTRY.add_collector(lambda: pool_metrics(app.state.pool))
+        REGISTRY.add_collector(lambda: stage_metrics(app.state.pipeline.profiler))
+        REGISTRY.add_collector(metrics.stats_collector("ark_image_preprocess", lambda: app.state.preprocessor and app.state.preprocessor.stats(), "Image preprocessing"))
+        REGISTRY.add_collector(metrics.stats_collector("ark_hedge", lambda: app.state.hedger and app.state.hedger.stats(), "Hedged requests"))
+        REGISTRY.add_collector(metrics.stats_collector("ark_admission", lambda: app.state.admission and app.state.admission.astats(), "Admission control"))
+        REGISTRY.add_collector(metrics.stats_collector("ark_conversation_store", lambda: app.state.conversations and app.state.conversations.stats(), "Conversation history store"))
+        REGISTRY.add_collector(metrics.stats_collector("ark_static", lambda: app.state.assets and app.state.assets.stats(), "Static assets"))
+        REGISTRY.add_collector(metrics.stats_collector("ark_startup", lambda: app.state.warmup.stats(), "Startup warm-up"))
+        app.state.collectors_registered = True
+    # Server-side keys for requests that don't bring their own: [ARK] api_key or several [UPSTREAM:<name>] sections.
+    # All of them share the process-wide connection pool.
+    app.state.pool = key_pool.from_config(
+        config,
+        lambda key, url: AsyncArk(base_url=url, api_key=key, timeout=app.state.http_client.timeout,
+                                  max_retries=SDK_MAX_RETRIES, http_client=app.state.http_client),
+        api_key,
+        base_url,
+    )
+
+    def probe_for(model: str):
+        """Cheapest possible call, used to notice when an open breaker's upstream recovers."""
+        if app.state.pool is None:
+            return None
+        return lambda: app.state.pool.call(lambda client: client.responses.create(model=model, input="ping", max_output_tokens=1))
+
+    app.state.resilience = resilience.from_config(config, probe_factory=probe_for, models=KNOWN_MODELS)
+    app.state.warmup.step("clients", started)
+    started = time.perf_counter()
+    app.state.assets = static_assets.from_config(config)
+    app.state.warmup.step("assets", started)
+    # Connections (and the optional probe) are opened in the background; /ready waits for them
+    urls = sorted({u.base_url for u in app.state.pool.upstreams}) if app.state.pool else [base_url]
+    app.state.warmup.start(app.state.http_client, urls, probe_for(MODEL_ID))
+    yield
+    app.state.warmup.close()
+    if app.state.resilience:
+        app.state.resilience.close()
+    if app.state.preprocessor:
+        app.state.preprocessor.close()
+    await app.state.clients.close_all()
+    await app.state.http_client.aclose()
+    if app.state.shared:
+        app.state.shared.close()
+    if app.state.conversations:
+        app.state.conversations.close()
 
 app = FastAPI(
     title="Ark Chat API",
     description="Ark 文本对话 API",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
-# Mount static files
-app.mount("/static", StaticFiles(directory="static"), name="static")
+# Static files: fingerprinted and precompressed in memory (static_assets.py), or straight from disk
+if not config.getboolean("STATIC", "fingerprint", fallback=True):
+    app.mount("/static", StaticFiles(directory="static"), name="static")
+
+# Image analysis routes (Chat Completions), served by the same app and client layer
+app.include_router(backend.router)
 
 app.add_middleware(
     CORSMiddleware,
@@ -30,6 +258,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Stream-Id"],
 )
 
 class ChatMessage(BaseModel):
@@ -42,6 +271,8 @@ class ChatRequest(BaseModel):
     model: Optional[str] = None
     web_search: Optional[bool] = False
     api_key: Optional[str] = None
+    # Lets the server chain turns upstream via previous_response_id
+    conversation_id: Optional[str] = None
 
 class ChatResponse(BaseModel):
     content: str
@@ -51,56 +282,26 @@ class ChatResponse(BaseModel):
     usage: dict
 
 @app.get("/")
-def root():
-    return FileResponse("chat.html")
+def root(request: Request):
+    assets = request.app.state.assets
+    if assets is None:
+        return FileResponse("chat.html")
+    return assets.response(assets.page, False, request.headers)
 
-@app.post("/api/chat", response_model=ChatResponse)
-def chat(req: ChatRequest):
-    # Prioritize API key from request, fallback to env/config
-    current_api_key = req.api_key if req.api_key else api_key
-    
-    if not current_api_key:
-        raise HTTPException(status_code=500, detail="Missing ARK_API_KEY. Please set it in settings or environment variables.")
-    try:
-        from volcenginesdkarkruntime import Ark
-        client = Ark(
-            base_url="https://ark.cn-beijing.volces.com/api/v3",
-            api_key=current_api_key,
-        )
-        
-        # Use provided model or default from config
-        config_model = config.get("ARK", "model_id", fallback="doubao-seed-1-8-251228")
-        model_id = req.model if req.model else config_model
-        print(f"Using Model ID: {model_id}") # Debug log
+@app.get("/static/{path:path}")
+def static_file(path: str, request: Request):
+    """Hashed URLs are immutable; original paths revalidate with their ETag."""
+    found = request.app.state.assets.get(path)
+    if found is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return request.app.state.assets.response(*found, request.headers)
 
-        # Use Responses API for all requests
-        responses_input = []
-        for m in req.messages:
-            content_list = []
-            if isinstance(m.content, str):
-                content_list.append({"type": "input_text", "text": m.content})
-            else:
-                for item in m.content:
-                    if isinstance(item, dict):
-                        if item.get("type") == "text":
-                            content_list.append({"type": "input_text", "text": item.get("text")})
-                        elif item.get("type") == "image_url":
-                            url = item.get("image_url", {}).get("url")
-                            if url:
-                                content_list.append({"type": "input_image", "image_url": url})
-            
-            if content_list:
-                responses_input.append({
-                    "role": m.role,
-                    "content": content_list
-                })
-        
-        # Configure tools only if web_search is enabled
-        tools = [{"type": "web_search"}] if req.web_search else None
-        
-        # Inject System Prompt for Web Search Citations
-        if req.web_search:
-            search_prompt = """
+@app.get("/api/clients")
+async def client_stats(request: Request):
+    """Tenant client registry counters, for sizing CLIENTS.max_size."""
+    return request.app.state.clients.stats()
+
+WEB_SEARCH_PROMPT = """
 ## 联网搜索引用要求
 请在回答中引用搜索到的资料。
 引用格式：在正文中相关句子后使用 `[序号]` 标记，并在回答末尾列出参考资料。
@@ -109,102 +310,709 @@ def chat(req: ChatRequest):
 1. [标题](URL)
 2. [标题](URL)
 """
-            # Check if there is an existing system message
-            system_found = False
-            for item in responses_input:
-                if item.get("role") == "system":
-                    # Append to existing system message content
-                    # Content is a list of dicts: [{"type": "input_text", "text": "..."}]
-                    if isinstance(item["content"], list):
-                        item["content"].append({"type": "input_text", "text": "\n" + search_prompt})
-                    system_found = True
-                    break
-            
-            if not system_found:
-                # Prepend new system message
-                responses_input.insert(0, {
-                    "role": "system",
-                    "content": [{"type": "input_text", "text": search_prompt}]
-                })
 
-        if req.stream:
-            stream = client.responses.create(
-                model=model_id,
-                input=responses_input,
+def build_responses_input(req: ChatRequest):
+    """Convert chat messages to Responses API input items and tools."""
+    responses_input = []
+    for m in req.messages:
+        content_list = []
+        if isinstance(m.content, str):
+            content_list.append({"type": "input_text", "text": m.content})
+        else:
+            for item in m.content:
+                if isinstance(item, dict):
+                    if item.get("type") == "text":
+                        content_list.append({"type": "input_text", "text": item.get("text")})
+                    elif item.get("type") == "image_url":
+                        image_url = item.get("image_url", {})
+                        if not isinstance(image_url, dict) or not isinstance(image_url.get("url", ""), str):
+                            raise HTTPException(status_code=400, detail='image_url must be an object like {"url": "..."}')
+                        # Uploaded images are referenced by content hash and resolved later
+                        if image_url.get("image_id"):
+                            content_list.append({"type": "input_image", "image_id": image_url["image_id"]})
+                        elif image_url.get("url"):
+                            content_list.append({"type": "input_image", "image_url": image_url["url"]})
+        
+        if content_list:
+            responses_input.append({
+                "role": m.role,
+                "content": content_list
+            })
+    
+    # Configure tools only if web_search is enabled
+    tools = [{"type": "web_search"}] if req.web_search else None
+    
+    # Inject System Prompt for Web Search Citations
+    if req.web_search:
+        # Check if there is an existing system message
+        system_found = False
+        for item in responses_input:
+            if item.get("role") == "system":
+                # Append to existing system message content
+                # Content is a list of dicts: [{"type": "input_text", "text": "..."}]
+                if isinstance(item["content"], list):
+                    item["content"].append({"type": "input_text", "text": "\n" + WEB_SEARCH_PROMPT})
+                system_found = True
+                break
+        
+        if not system_found:
+            # Prepend new system message
+            responses_input.insert(0, {
+                "role": "system",
+                "content": [{"type": "input_text", "text": WEB_SEARCH_PROMPT}]
+            })
+    return responses_input, tools
+
+def spooled_data_url(mime: str, file) -> str:
+    """Base64-encode a spooled upload in chunks (multiples of 3 bytes, so the pieces join cleanly)."""
+    file.seek(0)
+    parts = [f"data:{mime};base64,"]
+    while chunk := file.read(3 * 64 * 1024):
+        parts.append(base64.b64encode(chunk).decode("ascii"))
+    return "".join(parts)
+
+# Stands in for an image from an earlier turn that is no longer stored
+EXPIRED_IMAGE_TEXT = "[此处的图片已过期，无法查看]"
+
+async def resolve_image_refs(responses_input: list, images: ImageStore, uploads: Optional[dict] = None) -> list:
+    """
+    Swap image_id references for data URLs just before the upstream call.
+    An expired image in the latest turn is a 410 (it was just uploaded and can be
+    sent again); in earlier turns it is replaced by a placeholder, since the user
+    has no way to re-upload history and the conversation would stay broken.
+    """
+    resolved = []
+    last = len(responses_input) - 1
+    for index, message in enumerate(responses_input):
+        if not any("image_id" in c for c in message["content"]):
+            resolved.append(message)
+            continue
+        content = []
+        for c in message["content"]:
+            if "image_id" in c:
+                # Multipart uploads stay in their temp files until this point
+                upload = uploads.get(c["image_id"]) if uploads else None
+                url = spooled_data_url(*upload) if upload else await images.adata_url(c["image_id"])
+                if url is None and index == last:
+                    raise HTTPException(status_code=410, detail=f"Image {c['image_id'][:12]} has expired, please upload it again.")
+                if url is None:
+                    c = {"type": "input_text", "text": EXPIRED_IMAGE_TEXT}
+                else:
+                    c = {"type": "input_image", "image_url": url}
+            content.append(c)
+        resolved.append({**message, "content": content})
+    return resolved
+
+async def shrink_inline_images(responses_input: list, preprocessor) -> list:
+    """Downscale base64 images pasted inline (uploads are handled at /api/images)."""
+    for message in responses_input:
+        for c in message["content"]:
+            url = c.get("image_url")
+            if url and url.startswith("data:"):
+                c["image_url"] = await preprocessor.process_data_url(url)
+    return responses_input
+
+def estimate_input_tokens(responses_input: list) -> int:
+    """Rough input token count for admission; settled against real usage later."""
+    total = 0
+    for message in responses_input:
+        for c in message["content"]:
+            total += len(c.get("text") or "") // 2 + 1 if c["type"] == "input_text" else 1000
+    return total
+
+def extract_output_text(resp) -> str:
+    content = ""
+    if hasattr(resp, "output"):
+        for item in resp.output:
+            if getattr(item, "type", "") == "message":
+                for c in getattr(item, "content", []):
+                    if getattr(c, "type", "") in ("output_text", "text"):
+                        content += getattr(c, "text", "")
+    return content
+
+def fuzzy_target(model_id: str, responses_input: list, tools) -> Optional[tuple]:
+    """(partition, text) for the fuzzy cache: the final user turn must be plain text, everything before it matches exactly."""
+    if not responses_input:
+        return None
+    last = responses_input[-1]
+    if last.get("role") != "user" or any(c.get("type") != "input_text" for c in last["content"]):
+        return None
+    text = "\n".join(c.get("text") or "" for c in last["content"])
+    return cache_key(model_id, responses_input[:-1], tools), text
+
+async def replay_cached(cached: dict):
+    """Replay a cached answer as the same events a live stream produces."""
+    yield {'content': cached['content']}
+    yield {'usage': cached['usage']}
+
+def sse_response(events, headers: dict) -> StreamingResponse:
+    return StreamingResponse(
+        sse.encode(events, window=COALESCE_WINDOW, max_bytes=COALESCE_BYTES),
+        media_type="text/event-stream",
+        headers=headers,
+    )
+
+def content_length(request: Request) -> Optional[int]:
+    """The declared Content-Length, or None when absent; 400 when it is not a number."""
+    length = request.headers.get("content-length")
+    if not length:
+        return None
+    try:
+        return int(length)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid Content-Length header")
+
+@app.post("/api/images")
+async def upload_image(request: Request):
+    """Store raw image bytes (Content-Type: image/*) under their SHA-256."""
+    images = request.app.state.images
+    mime = request.headers.get("content-type", "").split(";")[0].strip()
+    if not mime.startswith("image/"):
+        raise HTTPException(status_code=415, detail="Content-Type must be image/*")
+    length = content_length(request)
+    if length is not None and length > images.max_image_bytes:
+        raise HTTPException(status_code=413, detail="Image too large")
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > images.max_image_bytes:
+            raise HTTPException(status_code=413, detail="Image too large")
+    data = bytes(body)
+    preprocessor = request.app.state.preprocessor
+    if preprocessor:
+        data, mime = await preprocessor.process(data, mime)
+    image_id, existed = await images.aput(data, mime)
+    return {"id": image_id, "url": f"/api/images/{image_id}", "bytes": len(data), "original_bytes": len(body), "deduplicated": existed}
+
+@app.get("/api/images/{image_id}")
+def get_image(image_id: str, request: Request):
+    item = request.app.state.images.get(image_id)
+    if item is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    mime, data = item
+    return Response(content=data, media_type=mime, headers={"Cache-Control": "public, max-age=31536000, immutable"})
+
+@app.get("/ready")
+def ready(request: Request):
+    """Readiness probe: 503 until startup warm-up has finished."""
+    warm = request.app.state.warmup
+    body = {"ready": warm.ready, "startup_ms": {name: round(seconds * 1000) for name, seconds in warm.steps.items()}}
+    if warm.errors:
+        body["errors"] = warm.errors
+    return JSONResponse(body, status_code=200 if warm.ready else 503)
+
+# The stats endpoints are async so they snapshot state on the event loop that mutates it
+# (a threadpool handler could hit "dictionary changed size during iteration");
+# only reads of the shared SQLite file go to its threads.
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    return PlainTextResponse(await REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/cache")
+async def cache_stats(request: Request):
+    cache = request.app.state.cache
+    return cache.stats() if cache else {"enabled": False}
+
+@app.get("/api/fuzzy-cache")
+async def fuzzy_cache_stats(request: Request):
+    fuzzy = request.app.state.fuzzy
+    return fuzzy.stats() if fuzzy else {"enabled": False}
+
+@app.get("/api/chains")
+async def chain_stats(request: Request):
+    chains = request.app.state.chains
+    return await chains.astats() if chains else {"enabled": False}
+
+@app.get("/api/flights")
+async def flight_stats(request: Request):
+    flights = request.app.state.flights
+    return flights.stats() if flights else {"enabled": False}
+
+@app.get("/api/admission")
+async def admission_stats(request: Request):
+    admission_control = request.app.state.admission
+    return await admission_control.astats() if admission_control else {"enabled": False}
+
+@app.get("/api/upstream")
+async def upstream_stats(request: Request):
+    """Retry counters and per-model circuit breaker state."""
+    layer = request.app.state.resilience
+    return layer.stats() if layer else {"enabled": False}
+
+@app.get("/api/keys")
+async def key_stats(request: Request):
+    """Per-upstream traffic share, latency and error rate of the server key pool."""
+    pool = request.app.state.pool
+    return pool.stats() if pool else {"enabled": False}
+
+@app.get("/api/hedge")
+async def hedge_stats(request: Request):
+    hedger = request.app.state.hedger
+    return hedger.stats() if hedger else {"enabled": False}
+
+class ConversationCreate(BaseModel):
+    id: str
+    title: str = "新会话"
+    created: Optional[int] = None
+    # Importing history kept in the browser before the server store existed
+    messages: Optional[List[Dict[str, Any]]] = None
+
+class ConversationUpdate(BaseModel):
+    title: str
+
+class MessageCreate(BaseModel):
+    role: Literal["system", "user", "assistant"]
+    content: Union[str, List[Dict[str, Any]]]
+    statusText: Optional[str] = None
+    created: Optional[int] = None
+
+class MessageUpdate(BaseModel):
+    # Text received since the last save of a streaming answer
+    append: Optional[str] = None
+    statusText: Optional[str] = None
+
+def conversation_owner(request: Request):
+    """(store, owner) for the browser identified by X-Client-Id; 404 when the store is disabled."""
+    store = request.app.state.conversations
+    if store is None:
+        raise HTTPException(status_code=404, detail="Conversation store is disabled")
+    client_id = request.headers.get("x-client-id")
+    if not client_id:
+        raise HTTPException(status_code=400, detail="Missing X-Client-Id header")
+    return store, fingerprint(client_id)
+
+@app.get("/api/conversations")
+def list_conversations(request: Request, limit: int = 50, before: Optional[int] = None):
+    store, owner = conversation_owner(request)
+    items, cursor = store.list(owner, limit, before)
+    return {"items": items, "next": cursor}
+
+@app.post("/api/conversations", status_code=201)
+def create_conversation(body: ConversationCreate, request: Request):
+    store, owner = conversation_owner(request)
+    if not store.create(owner, body.id, body.title, body.created, body.messages):
+        raise HTTPException(status_code=409, detail="Conversation already exists")
+    return {"id": body.id}
+
+@app.patch("/api/conversations/{conv_id}")
+def rename_conversation(conv_id: str, body: ConversationUpdate, request: Request):
+    store, owner = conversation_owner(request)
+    if not store.rename(owner, conv_id, body.title):
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    return {"id": conv_id}
+
+@app.delete("/api/conversations/{conv_id}", status_code=204)
+def delete_conversation(conv_id: str, request: Request):
+    store, owner = conversation_owner(request)
+    if not store.delete(owner, conv_id):
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    return Response(status_code=204)
+
+@app.get("/api/conversations/{conv_id}/messages")
+def list_messages(conv_id: str, request: Request, limit: int = 50, before: Optional[int] = None):
+    """The latest messages (oldest first); pass the first returned id as `before` to page back."""
+    store, owner = conversation_owner(request)
+    page = store.messages(owner, conv_id, limit, before)
+    if page is None:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    items, has_more = page
+    return {"items": items, "has_more": has_more}
+
+@app.post("/api/conversations/{conv_id}/messages", status_code=201)
+def append_message(conv_id: str, body: MessageCreate, request: Request):
+    store, owner = conversation_owner(request)
+    message_id = store.append(owner, conv_id, body.role, body.content, body.statusText, body.created)
+    if message_id is None:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    return {"id": message_id}
+
+@app.patch("/api/conversations/{conv_id}/messages/{message_id}")
+def update_message(conv_id: str, message_id: int, body: MessageUpdate, request: Request):
+    store, owner = conversation_owner(request)
+    if not store.update(owner, conv_id, message_id, body.append, body.statusText):
+        raise HTTPException(status_code=404, detail="Message not found")
+    return {"id": message_id}
+
+@app.post("/api/chat", response_model=ChatResponse)
+async def chat(req: ChatRequest, request: Request, response: Response):
+    return await handle_chat(req, request, response)
+
+async def read_limited(request: Request, limit: int):
+    """Request body chunks, failing with 413 as soon as more than limit bytes have arrived."""
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > limit:
+            raise HTTPException(status_code=413, detail="Request body too large")
+        yield chunk
+
+@app.post("/api/chat/form", response_model=ChatResponse)
+async def chat_form(request: Request, response: Response):
+    """
+    Multipart variant of /api/chat for large images.
+
+    The "payload" field holds the usual JSON body; image parts are referenced
+    from it as {"type": "image_url", "image_url": {"part": "<field name>"}}.
+    Parts are spooled to temp files and only base64-encoded when the upstream
+    request is built.
+    """
+    if not request.headers.get("content-type", "").startswith("multipart/form-data"):
+        raise HTTPException(status_code=415, detail="Content-Type must be multipart/form-data")
+    length = content_length(request)
+    if length is not None and length > UPLOAD_MAX_BODY:
+        raise HTTPException(status_code=413, detail="Request body too large")
+    parser = MultiPartParser(request.headers, read_limited(request, UPLOAD_MAX_BODY),
+                             max_files=UPLOAD_MAX_FILES, max_fields=16, max_part_size=UPLOAD_MAX_BODY)
+    # Parts larger than this roll over from memory to disk
+    parser.spool_max_size = UPLOAD_SPOOL_BYTES
+    try:
+        form = await parser.parse()
+    except MultiPartException as e:
+        raise HTTPException(status_code=400, detail=e.message)
+    files = [v for _, v in form.multi_items() if not isinstance(v, str)]
+    try:
+        try:
+            req = ChatRequest(**json.loads(form.get("payload") or "{}"))
+        except (TypeError, ValueError) as e:
+            raise HTTPException(status_code=422, detail=f"Invalid payload field: {e}")
+        uploads = {}
+        for m in req.messages:
+            if isinstance(m.content, str):
+                continue
+            for item in m.content:
+                image_url = item.get("image_url") if isinstance(item, dict) else None
+                if not isinstance(image_url, dict) or "part" not in image_url:
+                    continue
+                part = form.get(image_url.pop("part"))
+                if part is None or isinstance(part, str):
+                    raise HTTPException(status_code=400, detail="image_url.part does not name a file part")
+                image_url["image_id"] = await spool_upload(part, request.app.state, uploads)
+        return await handle_chat(req, request, response, uploads)
+    finally:
+        # The upstream request has been sent by now (streams return once it is accepted)
+        for f in files:
+            await f.close()
+
+async def spool_upload(part, state, uploads: dict) -> str:
+    """Validate an image part and register it under its SHA-256, like /api/images does."""
+    mime = (part.content_type or "").split(";")[0].strip()
+    if not mime.startswith("image/"):
+        raise HTTPException(status_code=415, detail=f"Part {part.filename!r} is not an image")
+    if part.size > state.images.max_image_bytes:
+        raise HTTPException(status_code=413, detail="Image too large")
+    await part.seek(0)
+    if state.preprocessor and part.size >= state.preprocessor.min_bytes:
+        # Decoding needs the whole image in memory anyway; keep only the shrunk result
+        data, mime = await state.preprocessor.process(await part.read(), mime)
+        image_id = hashlib.sha256(data).hexdigest()
+        uploads[image_id] = (mime, io.BytesIO(data))
+        return image_id
+    digest = hashlib.sha256()
+    while chunk := await part.read(256 * 1024):
+        digest.update(chunk)
+    image_id = digest.hexdigest()
+    uploads[image_id] = (mime, part.file)
+    return image_id
+
+async def handle_chat(req: ChatRequest, request: Request, response: Response, uploads: Optional[dict] = None):
+    started = time.perf_counter()
+    # A reconnect after a dropped stream: replay the missed frames, no new upstream call
+    last_event_id = request.headers.get("last-event-id")
+    if req.stream and last_event_id and request.app.state.resume:
+        frames = request.app.state.resume.resume(last_event_id)
+        if frames is None:
+            raise HTTPException(status_code=410, detail="Stream can no longer be resumed; send the request again without Last-Event-ID")
+        return StreamingResponse(frames, media_type="text/event-stream", headers={"X-Resumed": "HIT"})
+    # Prioritize API key from request, fallback to the server's key pool
+    pool = request.app.state.pool
+    if not req.api_key and pool is None:
+        raise HTTPException(status_code=500, detail="Missing ARK_API_KEY. Please set it in settings or environment variables.")
+    key_id = fingerprint(req.api_key) if req.api_key else admission.SERVER_KEY
+
+    # Use provided model or default from config
+    config_model = config.get("ARK", "model_id", fallback="doubao-seed-1-8-251228")
+    model_id = req.model if req.model else config_model
+    print(f"Using Model ID: {model_id}") # Debug log
+    model_label = metric_model(model_id)
+    REQUESTS.inc(model_label, "true" if req.stream else "false")
+
+    # Use Responses API for all requests
+    responses_input, tools = build_responses_input(req)
+    if request.app.state.preprocessor:
+        try:
+            responses_input = await shrink_inline_images(responses_input, request.app.state.preprocessor)
+        except image_preprocess.InvalidImage as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    cache = request.app.state.cache
+    fuzzy = request.app.state.fuzzy
+    use_cache = "no-cache" not in request.headers.get("cache-control", "")
+    cache_status = "BYPASS"
+    key = None
+    if cache and use_cache:
+        key = cache_key(model_id, responses_input, tools, bool(req.web_search))
+        cached = await cache.aget(key)
+        if cached:
+            if req.stream:
+                return sse_response(replay_cached(cached), {"X-Cache": "HIT"})
+            response.headers["X-Cache"] = "HIT"
+            return ChatResponse(**cached)
+        cache_status = "MISS"
+    # Near-duplicate final turns (rewording, punctuation, spacing) reuse an earlier answer
+    fuzzy_entry = fuzzy_target(model_id, responses_input, tools) if fuzzy and use_cache else None
+    if fuzzy_entry:
+        found = fuzzy.get(*fuzzy_entry)
+        if found:
+            cached, similarity = found
+            hit_headers = {"X-Cache": "FUZZY", "X-Cache-Similarity": f"{similarity:.2f}"}
+            if req.stream:
+                return sse_response(replay_cached(cached), hit_headers)
+            response.headers.update(hit_headers)
+            return ChatResponse(**cached)
+        cache_status = "MISS"
+    headers = {"X-Cache": cache_status}
+
+    # Send only the new turn when history extends the remembered upstream chain
+    chains = request.app.state.chains
+    conv_key = None
+    previous_response_id = None
+    upstream_input = responses_input
+    if chains and req.conversation_id:
+        conv_key = f"{key_id}:{req.conversation_id}"
+        matched = await chains.amatch(conv_key, model_id, responses_input)
+        if matched:
+            previous_response_id, upstream_input = matched
+        headers["X-Chain"] = "HIT" if matched else "MISS"
+
+    images = request.app.state.images
+
+    async def create_response(client, stream: bool, model: Optional[str] = None):
+        nonlocal previous_response_id
+        if model and model != model_id:
+            # Hedge on a fallback model: chained responses belong to model_id, so send full history
+            return await client.responses.create(
+                model=model,
+                input=await resolve_image_refs(responses_input, images, uploads),
                 tools=tools,
-                stream=True
+                stream=stream,
             )
+        # store=True keeps the response upstream so the next turn can chain to it
+        extra = {"store": True} if conv_key else {}
+        if previous_response_id:
+            try:
+                return await client.responses.create(
+                    model=model_id,
+                    input=await resolve_image_refs(upstream_input, images, uploads),
+                    tools=tools,
+                    stream=stream,
+                    previous_response_id=previous_response_id,
+                    **extra
+                )
+            except Exception as e:
+                if getattr(e, "status_code", None) not in (400, 404):
+                    raise
+                print("Conversation chain expired upstream, replaying full history")
+                await chains.adrop(conv_key)
+                previous_response_id = None
+                headers["X-Chain"] = "EXPIRED"
+        return await client.responses.create(
+            model=model_id,
+            input=await resolve_image_refs(responses_input, images, uploads),
+            tools=tools,
+            stream=stream,
+            **extra
+        )
+
+    admission_control = request.app.state.admission
+    priority = request.headers.get("x-priority", "normal")
+
+    resilience_layer = request.app.state.resilience
+
+    async def attempt(client, stream: bool, model: Optional[str] = None):
+        if client is not None:
+            return await create_response(client, stream, model)
+        # Server keys: every attempt picks from the pool, so a retry can land on another key or region.
+        # Every turn of a chained conversation (the first one too) prefers the same upstream,
+        # so the next turn lands on the key that stored the previous response.
+        return await pool.call(lambda pooled: create_response(pooled, stream, model), affinity=conv_key,
+                               kind=key_pool.STREAM if stream else key_pool.FULL)
+
+    async def call_upstream(client, stream: bool, model: Optional[str] = None):
+        # Retried only here: nothing has reached the client before the upstream call returns
+        if resilience_layer:
+            return await resilience_layer.call(model or model_id, lambda: attempt(client, stream, model))
+        return await attempt(client, stream, model)
+
+    hedger = request.app.state.hedger
+
+    async def acquire_client():
+        # Queue for an admission slot before touching a client or the upstream
+        ticket = None
+        if admission_control:
+            ticket = await admission_control.admit(key_id, estimate_input_tokens(responses_input), priority)
+        if req.api_key:
+            try:
+                lease = await request.app.state.clients.acquire(req.api_key)
+            except BaseException:
+                if ticket:
+                    ticket.release()
+                raise
+            return lease.client, lease, ticket
+        # None: attempt() routes through the key pool
+        return None, None, ticket
 
-            def stream_generator():
-                try:
-                    print("Start streaming...")
-                    for chunk in stream:
-                        # print(f"Chunk received: {chunk}") # Debug logging
-                        if hasattr(chunk, "type"):
-                            # print(f"Chunk type: {chunk.type}")
-                            if chunk.type == "response.output_text.delta":
-                                yield f"data: {json.dumps({'content': chunk.delta})}\n\n"
-                            elif chunk.type == "response.web_search_call.searching":
-                                yield f"data: {json.dumps({'type': 'searching', 'status': 'start'})}\n\n"
-                            elif chunk.type == "response.web_search_call.completed":
-                                yield f"data: {json.dumps({'type': 'searching', 'status': 'end'})}\n\n"
-                            elif chunk.type == "response.output_item.added":
-                                # Capture search query if available in added item
-                                if hasattr(chunk, "item") and hasattr(chunk.item, "type") and chunk.item.type == "web_search_call":
-                                    if hasattr(chunk.item, "action") and chunk.item.action and hasattr(chunk.item.action, "query"):
-                                        query = chunk.item.action.query
-                                        yield f"data: {json.dumps({'type': 'searching', 'status': 'query', 'query': query})}\n\n"
-                            elif chunk.type == "response.failed":
-                                error_msg = "Unknown response failure"
-                                if hasattr(chunk, "response") and chunk.response and hasattr(chunk.response, "error") and chunk.response.error:
-                                        error_msg = chunk.response.error.message
-                                elif hasattr(chunk, "error") and chunk.error:
-                                    error_msg = chunk.error.message if hasattr(chunk.error, "message") else str(chunk.error)
-                                yield f"data: {json.dumps({'error': error_msg})}\n\n"
-                            elif chunk.type == "error":
-                                error_msg = chunk.message if hasattr(chunk, "message") else "Unknown stream error"
-                                yield f"data: {json.dumps({'error': error_msg})}\n\n"
-                            elif chunk.type == "response.completed":
-                                if hasattr(chunk.response, "usage") and chunk.response.usage:
-                                    # Map usage fields if necessary, or just dump it
-                                    usage = {
-                                        "total_tokens": chunk.response.usage.total_tokens
-                                    }
-                                    yield f"data: {json.dumps({'usage': usage})}\n\n"
-                    yield "data: [DONE]\n\n"
-                except Exception as e:
-                        print(f"Stream Error: {e}")
-                        yield f"data: {json.dumps({'error': str(e)})}\n\n"
-                        yield "data: [DONE]\n\n"
-
-            return StreamingResponse(stream_generator(), media_type="text/event-stream")
+    async def release_client(lease, ticket):
+        if ticket:
+            ticket.release()
+        if lease:
+            await lease.release()
+
+    async def stream_events():
+        client, lease, ticket = await acquire_client()
+        upstream = None
+        try:
+            active_model = model_id
+            if hedger and not tools and hedger.candidates(model_id):
+                # Start the same request on the next [HEDGE] model if the first delta is slow
+                active_model, upstream, prefix = await hedger.race(model_id, lambda m: call_upstream(client, True, m))
+                stream = hedge.replay(prefix, upstream)
+                if active_model != model_id:
+                    headers["X-Model"] = active_model
+            else:
+                stream = upstream = await call_upstream(client, stream=True)
+            UPSTREAM_LATENCY.observe(model_label, value=time.perf_counter() - started)
+            # Upstream accepted the request; chat() consumes this before responding
+            yield None
+
+            state = stream_pipeline.StreamState(keep_text=bool(key or conv_key or fuzzy_entry))
+            pipeline = request.app.state.pipeline
+            cancelled = False
+            first_token = True
+            ACTIVE_STREAMS.inc(model_label)
+            try:
+                print("Start streaming...")
+                async for chunk in stream:
+                    event = pipeline.process(state, chunk)
+                    if event is None:
+                        continue
+                    if first_token and state.deltas:
+                        TTFT.observe(model_label, value=time.perf_counter() - started)
+                        first_token = False
+                    yield event
+                if state.usage:
+                    record_usage(model_label, state.usage)
+                    if ticket:
+                        ticket.settle(state.usage["total_tokens"])
+                if state.completed and not state.failed:
+                    if conv_key and active_model == model_id:
+                        await chains.arecord(conv_key, model_id, responses_input, state.text, state.response_id)
+                    if key or fuzzy_entry:
+                        answer = {
+                            "content": state.text,
+                            "model": state.model,
+                            "response_id": state.response_id,
+                            "created": state.created,
+                            "usage": state.usage or usage_dict(None),
+                        }
+                        if key:
+                            await cache.aset(key, answer)
+                        if fuzzy_entry:
+                            fuzzy.set(*fuzzy_entry, answer)
+            except (asyncio.CancelledError, GeneratorExit):
+                # The client went away (directly, or as the last subscriber of a coalesced stream)
+                cancelled = True
+                raise
+            except Exception as e:
+                    print(f"Stream Error: {e}")
+                    ERRORS.inc(model_label, type(e).__name__)
+                    yield {'error': str(e)}
+            finally:
+                ACTIVE_STREAMS.dec(model_label)
+                STREAM_DURATION.observe(model_label, value=time.perf_counter() - started)
+                if state.search_calls:
+                    WEB_SEARCH_CALLS.inc(model_label, amount=state.search_calls)
+                for kind in state.errors:
+                    ERRORS.inc(model_label, kind)
+                if cancelled:
+                    print(f"Client disconnected after {state.deltas} deltas, closing upstream stream")
+                    CANCELLED_STREAMS.inc(model_label)
+                    CANCELLED_DELTAS.inc(model_label, amount=state.deltas)
+                    if ticket:
+                        ticket.settle(ticket.estimate + state.deltas)
+        finally:
+            # Closing the HTTP response is what makes the upstream stop generating
+            if upstream is not None:
+                await hedge.close_stream(upstream)
+            await release_client(lease, ticket)
+
+    async def complete():
+        client, lease, ticket = await acquire_client()
+        try:
+            resp = await call_upstream(client, stream=False)
+        finally:
+            await release_client(lease, ticket)
+        UPSTREAM_LATENCY.observe(model_label, value=time.perf_counter() - started)
+
+        result = ChatResponse(
+            content=extract_output_text(resp),
+            model=resp.model,
+            response_id=resp.id,
+            created=resp.created_at, # Note: created_at vs created
+            usage=usage_dict(resp.usage)
+        )
+        record_usage(model_label, result.usage)
+        if ticket:
+            ticket.settle(result.usage["total_tokens"])
+        WEB_SEARCH_CALLS.inc(model_label, amount=sum(1 for item in resp.output if getattr(item, "type", "") == "web_search_call"))
+        if conv_key:
+            await chains.arecord(conv_key, model_id, responses_input, result.content, resp.id)
+        if key:
+            await cache.aset(key, result.model_dump())
+        if fuzzy_entry:
+            fuzzy.set(*fuzzy_entry, result.model_dump())
+        return result
+
+    # Identical requests already in flight are joined instead of sent upstream again
+    flights = request.app.state.flights
+    flight_key = cache_key(key_id, model_id, responses_input, tools, bool(req.web_search)) if flights else None
+    joined = False
+    try:
+        if req.stream:
+            if flights:
+                events, joined = flights.stream(flight_key, stream_events)
+            else:
+                events = stream_events()
+            # Wait for the upstream to accept the request so failures still get an HTTP status
+            await events.__anext__()
+            if joined:
+                headers["X-Coalesced"] = "HIT"
+            resume = request.app.state.resume
+            if resume:
+                # Encoded in its own task so a dropped connection can pick the stream up again
+                stream = resume.open(events, window=COALESCE_WINDOW, max_bytes=COALESCE_BYTES)
+                headers["X-Stream-Id"] = stream.id
+                return StreamingResponse(stream.subscribe(), media_type="text/event-stream", headers=headers)
+            return sse_response(events, headers)
         else:
-            resp = client.responses.create(
-                model=model_id,
-                input=responses_input,
-                tools=tools
-            )
-            
-            content = ""
-            if hasattr(resp, "output"):
-                for item in resp.output:
-                    if getattr(item, "type", "") == "message":
-                        for c in getattr(item, "content", []):
-                            if getattr(c, "type", "") == "text":
-                                content += getattr(c, "text", "")
-            
-            return ChatResponse(
-                content=content,
-                model=resp.model,
-                response_id=resp.id,
-                created=resp.created_at, # Note: created_at vs created
-                usage={
-                    "prompt_tokens": resp.usage.input_tokens if resp.usage else 0,
-                    "completion_tokens": resp.usage.output_tokens if resp.usage else 0,
-                    "total_tokens": resp.usage.total_tokens if resp.usage else 0
-                }
-            )
+            if flights:
+                result, joined = await flights.call(flight_key, complete)
+            else:
+                result = await complete()
+            if joined:
+                headers["X-Coalesced"] = "HIT"
+            response.headers.update(headers)
+            return result
+    except HTTPException:
+        raise
+    except Overloaded as e:
+        ERRORS.inc(model_label, "overloaded")
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(math.ceil(e.retry_after))})
+    except CircuitOpen as e:
+        ERRORS.inc(model_label, "circuit_open")
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(math.ceil(e.retry_after))})
     except Exception as e:
+        ERRORS.inc(model_label, type(e).__name__)
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
@@ -1,41 +1,40 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 """
-Ark Demo 后端 API 服务
+Ark Demo 图片识别接口（Chat Completions）
+
+路由挂载在 ark_server.py 的网关应用上，与对话接口共用配置、客户端（API Key 池）、
+缓存、准入控制和图片预处理；`uvicorn backend:app` 仍可用，启动的就是同一个网关。
 """
 
-import os
-import configparser
-from fastapi import FastAPI, HTTPException
-from fastapi.middleware.cors import CORSMiddleware
+import json
+import math
+import time
+import asyncio
+from typing import List, Optional
+from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from volcenginesdkarkruntime import Ark
-
-# 加载配置文件
-config = configparser.ConfigParser()
-config.read('config.ini')
-
-api_key = os.getenv('ARK_API_KEY') or config.get('ARK', 'api_key', fallback=None)
-client = Ark(
-    base_url='https://ark.cn-beijing.volces.com/api/v3',
-    api_key=api_key,
-) if api_key else None
-
-# 创建 FastAPI 应用
-app = FastAPI(
-    title="Ark Demo API",
-    description="Ark 图片识别 Demo API",
-    version="1.0.0"
-)
-
-# 配置 CORS
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # 生产环境建议指定具体域名
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+from response_cache import cache_key
+from stream_pipeline import chat_usage_dict
+from admission import SERVER_KEY, Overloaded
+from image_preprocess import InvalidImage
+from resilience import CircuitOpen
+from settings import config, MODEL_ID
+
+# 批量接口的并发上限与单批最大条数
+BATCH_MAX_ITEMS = config.getint('BATCH', 'max_items', fallback=5000)
+BATCH_MAX_CONCURRENCY = config.getint('BATCH', 'max_concurrency', fallback=16)
+BATCH_DEFAULT_CONCURRENCY = config.getint('BATCH', 'default_concurrency', fallback=8)
+
+router = APIRouter()
+
+def __getattr__(name):
+    # 兼容旧的启动方式 uvicorn backend:app
+    if name == "app":
+        from ark_server import app
+        return app
+    raise AttributeError(name)
 
 # 请求模型
 class ImageRequest(BaseModel):
@@ -50,60 +49,175 @@ class ImageResponse(BaseModel):
     created: int
     usage: dict
 
-# 测试接口
-@app.get("/")
-def root():
-    return {"message": "Ark Demo API is running"}
+# 批量请求模型
+class BatchItem(BaseModel):
+    image_url: str
+    prompt: str
+    id: Optional[str] = None
+
+class BatchRequest(BaseModel):
+    items: List[BatchItem]
+    concurrency: Optional[int] = None
+
+def build_messages(prompt: str, image_url: str) -> list:
+    return [
+        {
+            "role": "user",
+            "content": [
+                {
+                    "type": "text",
+                    "text": prompt
+                },
+                {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": image_url
+                    }
+                }
+            ]
+        }
+    ]
+
+def to_image_response(response) -> ImageResponse:
+    return ImageResponse(
+        content=response.choices[0].message.content,
+        model=response.model,
+        response_id=response.id,
+        created=response.created,
+        usage=chat_usage_dict(response.usage)
+    )
 
 # 图片识别接口
-@app.post("/api/analyze-image", response_model=ImageResponse)
-def analyze_image(request: ImageRequest):
+@router.post("/api/analyze-image", response_model=ImageResponse)
+async def analyze_image(request: ImageRequest, http_request: Request, http_response: Response):
     """
     分析图片内容
     - **image_url**: 图片 URL
     - **prompt**: 提问内容
+    - 请求头 X-Priority: high / normal / low，排队时高优先级先执行
     """
+    state = http_request.app.state
+    if state.pool is None:
+        raise HTTPException(status_code=500, detail="Missing ARK_API_KEY or config.ini ARK.api_key")
+    cache = state.cache
+    if cache:
+        cached = await cache.aget(cache_key(MODEL_ID, request.image_url, request.prompt))
+        if cached:
+            http_response.headers["X-Cache"] = "HIT"
+            return ImageResponse(**cached)
+        http_response.headers["X-Cache"] = "MISS"
     try:
-        if client is None:
-            raise HTTPException(status_code=500, detail="Missing ARK_API_KEY or config.ini ARK.api_key")
-        # 调用 Ark API
-        response = client.chat.completions.create(
-            model="doubao-seed-1-8-251228",
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": request.prompt
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": request.image_url
-                            }
-                        }
-                    ]
-                }
-            ]
-        )
-        
-        # 构造响应
-        return ImageResponse(
-            content=response.choices[0].message.content,
-            model=response.model,
-            response_id=response.id,
-            created=response.created,
-            usage={
-                "prompt_tokens": response.usage.prompt_tokens,
-                "completion_tokens": response.usage.completion_tokens,
-                "total_tokens": response.usage.total_tokens
-            }
-        )
+        return await analyze_one(state, request, http_request.headers.get("x-priority", "normal"), check_cache=False)
+    except InvalidImage as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Overloaded as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(math.ceil(e.retry_after))})
+    except CircuitOpen as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(math.ceil(e.retry_after))})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-# 启动服务
+async def analyze_one(state, item, priority: str = "low", check_cache: bool = True) -> ImageResponse:
+    # check_cache=False：调用方已查过缓存（未命中已计数），不再重复查询
+    cache = state.cache
+    key = cache_key(MODEL_ID, item.image_url, item.prompt) if cache else None
+    if key and check_cache:
+        cached = await cache.aget(key)
+        if cached:
+            return ImageResponse(**cached)
+    image_url = item.image_url
+    if state.preprocessor is not None:
+        image_url = await state.preprocessor.process_data_url(image_url)
+    # 按文本长度粗估输入 token，图片按固定值计，完成后按实际用量结算
+    admission_control = state.admission
+    ticket = await admission_control.admit(SERVER_KEY, len(item.prompt) // 2 + 1000, priority) if admission_control else None
+
+    # 每次尝试都从 Key 池中挑选上游，失败重试可以换到别的 Key / 地域
+    async def attempt():
+        return await state.pool.call(lambda client: client.chat.completions.create(
+            model=MODEL_ID,
+            messages=build_messages(item.prompt, image_url)
+        ))
+
+    try:
+        if state.resilience:
+            response = await state.resilience.call(MODEL_ID, attempt)
+        else:
+            response = await attempt()
+    finally:
+        if ticket:
+            ticket.release()
+    result = to_image_response(response)
+    if ticket:
+        ticket.settle(result.usage["total_tokens"])
+    if key:
+        await cache.aset(key, result.model_dump())
+    return result
+
+# 批量图片识别接口
+@router.post("/api/analyze-image/batch")
+async def analyze_image_batch(request: BatchRequest, http_request: Request):
+    """
+    批量分析图片，按完成顺序以 NDJSON 逐行返回
+    - 每行一个结果：{"index", "id", "ok", ...}，单条失败只在该行返回 error
+    - 最后一行为汇总：{"summary": {"total", "succeeded", "failed", "usage", "elapsed"}}
+    """
+    state = http_request.app.state
+    if state.pool is None:
+        raise HTTPException(status_code=500, detail="Missing ARK_API_KEY or config.ini ARK.api_key")
+    if len(request.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_ITEMS} items per batch")
+    concurrency = max(1, min(request.concurrency or BATCH_DEFAULT_CONCURRENCY, BATCH_MAX_CONCURRENCY))
+    items = request.items
+
+    async def run():
+        started = time.perf_counter()
+        results: asyncio.Queue = asyncio.Queue()
+        next_index = iter(range(len(items)))
+
+        # 固定数量的 worker 依次领取任务，避免一次性创建上千个协程
+        async def worker():
+            for index in next_index:
+                item = items[index]
+                try:
+                    # 批量任务以低优先级排队，被拒绝时按 Retry-After 等待后重试，不挤占在线请求
+                    while True:
+                        try:
+                            result = await analyze_one(state, item)
+                            break
+                        except Overloaded as e:
+                            await asyncio.sleep(e.retry_after)
+                    await results.put({"index": index, "id": item.id, "ok": True, **result.model_dump()})
+                except Exception as e:
+                    await results.put({"index": index, "id": item.id, "ok": False, "error": str(e)})
+
+        workers = [asyncio.create_task(worker()) for _ in range(min(concurrency, len(items)))]
+        usage = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+        succeeded = 0
+        try:
+            for _ in range(len(items)):
+                line = await results.get()
+                if line["ok"]:
+                    succeeded += 1
+                    for k in usage:
+                        usage[k] += line["usage"].get(k, 0)
+                yield json.dumps(line, ensure_ascii=False) + "\n"
+            summary = {
+                "total": len(items),
+                "succeeded": succeeded,
+                "failed": len(items) - succeeded,
+                "usage": usage,
+                "elapsed": round(time.perf_counter() - started, 3),
+            }
+            yield json.dumps({"summary": summary}, ensure_ascii=False) + "\n"
+        finally:
+            # 客户端断开时停止剩余任务
+            for w in workers:
+                w.cancel()
+
+    return StreamingResponse(run(), media_type="application/x-ndjson")
+
+# 启动服务（与 python ark_server.py 相同）
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    uvicorn.run("ark_server:app", host="0.0.0.0", port=8000)
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Long-conversation benchmark: full-history replay vs previous_response_id chaining.
+
+Runs the same multi-turn conversation twice through /api/chat against
+mock_ark.py, once without and once with a conversation_id, and prints
+per-turn input tokens, cached tokens and time-to-first-token.
+
+    python bench_chaining.py --turns 20 --prefill 0.2
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+import uuid
+
+import httpx
+
+from bench_concurrency import spawn, wait_port
+
+USER_TURN = "请结合之前的讨论，继续详细分析这个问题的下一个方面，并给出具体例子。" * 8
+
+
+async def run_turn(client, url, messages, conversation_id):
+    body = {"messages": messages, "stream": True}
+    if conversation_id:
+        body["conversation_id"] = conversation_id
+    start = time.perf_counter()
+    ttft = None
+    content = ""
+    usage = {}
+    async with client.stream("POST", url, json=body) as resp:
+        chain = resp.headers.get("x-chain", "-")
+        async for line in resp.aiter_lines():
+            if not line.startswith("data: ") or line == "data: [DONE]":
+                continue
+            data = json.loads(line[6:])
+            if "content" in data:
+                if ttft is None:
+                    ttft = time.perf_counter() - start
+                content += data["content"]
+            if "usage" in data:
+                usage = data["usage"]
+    return content, usage, ttft, chain
+
+
+async def run_conversation(url, turns, chained):
+    conversation_id = uuid.uuid4().hex if chained else None
+    messages = []
+    rows = []
+    async with httpx.AsyncClient(timeout=120) as client:
+        for _ in range(turns):
+            messages.append({"role": "user", "content": USER_TURN})
+            content, usage, ttft, chain = await run_turn(client, url, messages, conversation_id)
+            messages.append({"role": "assistant", "content": content})
+            rows.append((usage.get("prompt_tokens", 0), usage.get("cached_tokens", 0), ttft, chain))
+    return rows
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--prefill", type=float, default=0.2, help="mock TTFT seconds per 1k uncached input tokens")
+    parser.add_argument("--mock-port", type=int, default=9110)
+    parser.add_argument("--port", type=int, default=9111)
+    args = parser.parse_args()
+
+    with tempfile.NamedTemporaryFile("w", suffix=".ini", delete=False) as f:
+        f.write("[CHAIN]\nenabled = true\n")
+        config_path = f.name
+    env = {
+        "ARK_BASE_URL": f"http://127.0.0.1:{args.mock_port}/api/v3",
+        "ARK_API_KEY": "bench",
+        "ARK_CONFIG": config_path,
+    }
+    procs = [
+        spawn(["mock_ark.py", "--port", str(args.mock_port), "--tokens", "40",
+               "--ttft", "0.1", "--token-delay", "0.005", "--prefill", str(args.prefill)]),
+        spawn(["-m", "uvicorn", "ark_server:app", "--port", str(args.port), "--log-level", "warning"], env),
+    ]
+    try:
+        await wait_port(f"http://127.0.0.1:{args.mock_port}/docs")
+        await wait_port(f"http://127.0.0.1:{args.port}/docs")
+        url = f"http://127.0.0.1:{args.port}/api/chat"
+        replay = await run_conversation(url, args.turns, chained=False)
+        chained = await run_conversation(url, args.turns, chained=True)
+    finally:
+        for p in procs:
+            p.terminate()
+            p.wait()
+        os.unlink(config_path)
+
+    print(f"{'turn':>4} | {'replay in':>9} {'ttft':>6} | {'chain in':>8} {'cached':>7} {'uncached':>8} {'ttft':>6} {'chain':>6}")
+    for i, (r, c) in enumerate(zip(replay, chained), 1):
+        print(f"{i:>4} | {r[0]:>9} {r[2]:>6.3f} | {c[0]:>8} {c[1]:>7} {c[0] - c[1]:>8} {c[2]:>6.3f} {c[3]:>6}")
+    uncached_replay = sum(r[0] - r[1] for r in replay)
+    uncached_chain = sum(c[0] - c[1] for c in chained)
+    print(f"\nuncached input tokens: replay {uncached_replay}, chained {uncached_chain} "
+          f"({100 * (1 - uncached_chain / max(uncached_replay, 1)):.1f}% less)")
+    print(f"mean ttft: replay {sum(r[2] for r in replay) / len(replay):.3f}s, "
+          f"chained {sum(c[2] for c in chained) / len(chained):.3f}s")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
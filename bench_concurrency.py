@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Concurrent SSE stream benchmark for /api/chat.
+
+Starts mock_ark.py as the upstream, starts the gateway against it and opens
+N streams at once, reporting time-to-first-token and completion time.
+
+    python bench_concurrency.py                 # current async ark_server
+    python bench_concurrency.py --legacy        # sync, client-per-request handler
+    python bench_concurrency.py -c 50,200,500
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+
+# Reproduction of the original handler: sync def, new Ark client per request,
+# upstream stream drained in Starlette's threadpool.
+legacy_app = FastAPI()
+
+
+@legacy_app.post("/api/chat")
+def legacy_chat(body: dict):
+    from volcenginesdkarkruntime import Ark
+    client = Ark(base_url=os.environ["ARK_BASE_URL"], api_key=os.environ["ARK_API_KEY"])
+    stream = client.responses.create(
+        model="mock-model",
+        input=[{"role": m["role"], "content": [{"type": "input_text", "text": m["content"]}]} for m in body["messages"]],
+        stream=True,
+    )
+
+    def stream_generator():
+        for chunk in stream:
+            if chunk.type == "response.output_text.delta":
+                yield f"data: {json.dumps({'content': chunk.delta})}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(stream_generator(), media_type="text/event-stream")
+
+
+def spawn(args, env=None):
+    proc = subprocess.Popen(
+        [sys.executable] + args,
+        env={**os.environ, **(env or {})},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    return proc
+
+
+async def wait_port(url, timeout=15.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                await client.get(url)
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+    raise RuntimeError(f"{url} did not come up")
+
+
+async def one_stream(client, url, n):
+    start = time.perf_counter()
+    ttft = None
+    # A distinct prompt per stream, or single-flight would coalesce them into one upstream call
+    body = {"messages": [{"role": "user", "content": f"hello {n}"}], "stream": True}
+    async with client.stream("POST", url, json=body) as resp:
+        if resp.status_code != 200:
+            raise RuntimeError(f"HTTP {resp.status_code}")
+        async for line in resp.aiter_lines():
+            if not line.startswith("data: "):
+                continue
+            if ttft is None and '"content"' in line:
+                ttft = time.perf_counter() - start
+            if line == "data: [DONE]":
+                break
+    return ttft, time.perf_counter() - start
+
+
+def pct(values, p):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def run_level(url, concurrency):
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=120) as client:
+        start = time.perf_counter()
+        results = await asyncio.gather(*(one_stream(client, url, n) for n in range(concurrency)), return_exceptions=True)
+        wall = time.perf_counter() - start
+    ok = [r for r in results if not isinstance(r, BaseException)]
+    ttfts = [r[0] for r in ok if r[0] is not None]
+    totals = [r[1] for r in ok]
+    return {
+        "concurrency": concurrency,
+        "ok": len(ok),
+        "errors": len(results) - len(ok),
+        "ttft_p50": pct(ttfts, 0.50),
+        "ttft_p95": pct(ttfts, 0.95),
+        "ttft_max": max(ttfts) if ttfts else float("nan"),
+        "total_p50": statistics.median(totals) if totals else float("nan"),
+        "wall": wall,
+        "streams_per_s": len(ok) / wall,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-c", "--concurrency", default="10,50,200")
+    parser.add_argument("--legacy", action="store_true", help="benchmark the sync client-per-request handler")
+    parser.add_argument("--mock-port", type=int, default=9100)
+    parser.add_argument("--port", type=int, default=9101)
+    parser.add_argument("--tokens", type=int, default=50)
+    parser.add_argument("--ttft", type=float, default=0.2)
+    parser.add_argument("--token-delay", type=float, default=0.02)
+    args = parser.parse_args()
+
+    env = {"ARK_BASE_URL": f"http://127.0.0.1:{args.mock_port}/api/v3", "ARK_API_KEY": "bench"}
+    app_path = "bench_concurrency:legacy_app" if args.legacy else "ark_server:app"
+    procs = [
+        spawn(["mock_ark.py", "--port", str(args.mock_port), "--tokens", str(args.tokens),
+               "--ttft", str(args.ttft), "--token-delay", str(args.token_delay)]),
+        spawn(["-m", "uvicorn", app_path, "--port", str(args.port), "--log-level", "warning"], env),
+    ]
+    try:
+        await wait_port(f"http://127.0.0.1:{args.mock_port}/docs")
+        await wait_port(f"http://127.0.0.1:{args.port}/docs")
+        url = f"http://127.0.0.1:{args.port}/api/chat"
+        ideal = args.ttft + args.tokens * args.token_delay
+        print(f"app={app_path} tokens={args.tokens} ttft={args.ttft}s token_delay={args.token_delay}s (ideal stream {ideal:.2f}s)")
+        print(f"{'conc':>6} {'ok':>5} {'err':>4} {'ttft p50':>9} {'ttft p95':>9} {'ttft max':>9} {'total p50':>10} {'wall':>7} {'streams/s':>10}")
+        for level in [int(c) for c in args.concurrency.split(",")]:
+            r = await run_level(url, level)
+            print(f"{r['concurrency']:>6} {r['ok']:>5} {r['errors']:>4} {r['ttft_p50']:>9.3f} {r['ttft_p95']:>9.3f} "
+                  f"{r['ttft_max']:>9.3f} {r['total_p50']:>10.3f} {r['wall']:>7.2f} {r['streams_per_s']:>10.1f}")
+    finally:
+        for p in procs:
+            p.terminate()
+            p.wait()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
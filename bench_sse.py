@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SSE encoding benchmark: one frame per delta vs coalesced frames.
+
+Runs the gateway against a fast mock_ark.py upstream with different
+[STREAM] coalesce_ms settings and reports frames/sec seen by clients and
+gateway CPU time per stream (from /proc).
+
+    python bench_sse.py --streams 50 --windows 0,20,50
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+import httpx
+
+from bench_concurrency import spawn, wait_port
+
+
+def cpu_seconds(pid: int) -> float:
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+async def one_stream(client, url, n):
+    frames = 0
+    text = 0
+    # A distinct prompt per stream, or single-flight would coalesce them into one upstream call
+    body = {"messages": [{"role": "user", "content": f"hello {n}"}], "stream": True}
+    async with client.stream("POST", url, json=body) as resp:
+        async for line in resp.aiter_lines():
+            if line.startswith("data: "):
+                frames += 1
+                text += len(line)
+    return frames, text
+
+
+async def run(args, window_ms):
+    with tempfile.NamedTemporaryFile("w", suffix=".ini", delete=False) as f:
+        f.write(f"[STREAM]\ncoalesce_ms = {window_ms}\n")
+        config_path = f.name
+    env = {
+        "ARK_BASE_URL": f"http://127.0.0.1:{args.mock_port}/api/v3",
+        "ARK_API_KEY": "bench",
+        "ARK_CONFIG": config_path,
+    }
+    server = spawn(["-m", "uvicorn", "ark_server:app", "--port", str(args.port), "--log-level", "warning"], env)
+    try:
+        await wait_port(f"http://127.0.0.1:{args.port}/docs")
+        url = f"http://127.0.0.1:{args.port}/api/chat"
+        limits = httpx.Limits(max_connections=args.streams)
+        async with httpx.AsyncClient(limits=limits, timeout=300) as client:
+            cpu_start = cpu_seconds(server.pid)
+            start = time.perf_counter()
+            results = await asyncio.gather(*(one_stream(client, url, n) for n in range(args.streams)))
+            wall = time.perf_counter() - start
+            cpu = cpu_seconds(server.pid) - cpu_start
+    finally:
+        server.terminate()
+        server.wait()
+        os.unlink(config_path)
+    frames = sum(r[0] for r in results)
+    return {
+        "window": window_ms,
+        "frames": frames,
+        "frames_per_stream": frames / args.streams,
+        "frames_per_s": frames / wall,
+        "cpu_ms_per_stream": 1000 * cpu / args.streams,
+        "wall": wall,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--streams", type=int, default=50)
+    parser.add_argument("--windows", default="0,20,50", help="coalesce_ms values to compare")
+    parser.add_argument("--tokens", type=int, default=400)
+    parser.add_argument("--token-delay", type=float, default=0.005)
+    parser.add_argument("--mock-port", type=int, default=9120)
+    parser.add_argument("--port", type=int, default=9121)
+    args = parser.parse_args()
+
+    mock = spawn(["mock_ark.py", "--port", str(args.mock_port), "--tokens", str(args.tokens),
+                  "--ttft", "0.05", "--token-delay", str(args.token_delay)])
+    try:
+        await wait_port(f"http://127.0.0.1:{args.mock_port}/docs")
+        print(f"{args.streams} streams x {args.tokens} deltas at {1 / args.token_delay:.0f} deltas/s per stream")
+        print(f"{'window':>7} {'frames':>8} {'frames/stream':>14} {'frames/s':>9} {'cpu ms/stream':>14} {'wall':>6}")
+        for window in [float(w) for w in args.windows.split(",")]:
+            r = await run(args, window)
+            print(f"{r['window']:>5.0f}ms {r['frames']:>8} {r['frames_per_stream']:>14.1f} {r['frames_per_s']:>9.0f} "
+                  f"{r['cpu_ms_per_stream']:>14.1f} {r['wall']:>6.2f}")
+    finally:
+        mock.terminate()
+        mock.wait()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Per-chunk overhead of stream event handling.
+
+Feeds a synthetic stream (SDK event objects: item added, N text deltas,
+text done, completed with usage) through the previous inline if/elif
+chain and through stream_pipeline.EventPipeline with and without the
+stage profiler and a transform, plus a Chat Completions chunk stream.
+No network; reports the best of several runs in ns per chunk.
+
+    python bench_stream_pipeline.py
+    python bench_stream_pipeline.py --deltas 2000 --repeat 20
+"""
+
+import argparse
+import re
+import time
+
+from volcenginesdkarkruntime.types.chat import ChatCompletionChunk
+from volcenginesdkarkruntime.types.chat.chat_completion_chunk import Choice, ChoiceDelta
+from volcenginesdkarkruntime.types.responses import (ResponseCompletedEvent, ResponseOutputItemAddedEvent,
+                                                     ResponseTextDeltaEvent, ResponseTextDoneEvent)
+
+from stream_pipeline import EventPipeline, StageProfiler, StreamState, usage_dict
+
+
+class Obj:
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def responses_stream(deltas: int) -> list:
+    usage = Obj(input_tokens=20, output_tokens=deltas, total_tokens=20 + deltas, input_tokens_details=Obj(cached_tokens=0))
+    response = Obj(id="resp_1", model="bench", created_at=0, usage=usage, error=None)
+    return (
+        [ResponseOutputItemAddedEvent.model_construct(type="response.output_item.added", item=Obj(type="message"), output_index=0)]
+        + [ResponseTextDeltaEvent.model_construct(type="response.output_text.delta", delta="tok ", item_id="m", output_index=0,
+                                                  content_index=0) for _ in range(deltas)]
+        + [ResponseTextDoneEvent.model_construct(type="response.output_text.done", text="", item_id="m", output_index=0, content_index=0),
+           ResponseCompletedEvent.model_construct(type="response.completed", response=response)]
+    )
+
+
+def chat_stream(deltas: int) -> list:
+    def chunk(**kwargs):
+        return ChatCompletionChunk.model_construct(id="chat_1", model="bench", created=0, object="chat.completion.chunk", **kwargs)
+    return (
+        [chunk(choices=[Choice.model_construct(index=0, delta=ChoiceDelta.model_construct(content="tok "), finish_reason=None)], usage=None)
+         for _ in range(deltas)]
+        + [chunk(choices=[Choice.model_construct(index=0, delta=ChoiceDelta.model_construct(content=""), finish_reason="stop")], usage=None),
+           chunk(choices=[], usage=Obj(prompt_tokens=20, completion_tokens=deltas, total_tokens=20 + deltas))]
+    )
+
+
+def legacy(chunks: list) -> int:
+    """The inline chain stream_events() used before the registry (metrics calls left out)."""
+    parts = []
+    failed = False
+    events = []
+    for chunk in chunks:
+        if hasattr(chunk, "type"):
+            if chunk.type == "response.output_text.delta":
+                parts.append(chunk.delta)
+                events.append({'content': chunk.delta})
+            elif chunk.type == "response.web_search_call.searching":
+                events.append({'type': 'searching', 'status': 'start'})
+            elif chunk.type == "response.web_search_call.completed":
+                events.append({'type': 'searching', 'status': 'end'})
+            elif chunk.type == "response.output_item.added":
+                if hasattr(chunk, "item") and hasattr(chunk.item, "type") and chunk.item.type == "web_search_call":
+                    if hasattr(chunk.item, "action") and chunk.item.action and hasattr(chunk.item.action, "query"):
+                        events.append({'type': 'searching', 'status': 'query', 'query': chunk.item.action.query})
+            elif chunk.type == "response.failed":
+                failed = True
+                events.append({'error': "failed"})
+            elif chunk.type == "error":
+                failed = True
+                events.append({'error': chunk.message})
+            elif chunk.type == "response.completed":
+                if hasattr(chunk.response, "usage") and chunk.response.usage:
+                    events.append({'usage': usage_dict(chunk.response.usage)})
+    return len(events)
+
+
+def run_pipeline(pipeline: EventPipeline):
+    def run(chunks: list) -> int:
+        state = StreamState(keep_text=True)
+        events = []
+        for chunk in chunks:
+            event = pipeline.process(state, chunk)
+            if event is not None:
+                events.append(event)
+        return len(events)
+    return run
+
+
+PHONE = re.compile(r"\d{11}")
+
+
+def mask_digits(state, event):
+    # A stand-in redaction transform
+    if 'content' in event:
+        event['content'] = PHONE.sub("***", event['content'])
+    return event
+
+
+def best_ns(fn, chunks: list, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter_ns()
+        fn(chunks)
+        best = min(best, time.perf_counter_ns() - started)
+    return best / len(chunks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--deltas", type=int, default=1000, help="text deltas per stream")
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    responses = responses_stream(args.deltas)
+    chat = chat_stream(args.deltas)
+    profiler = StageProfiler()
+    cases = [
+        ("legacy if/elif", legacy, responses),
+        ("registry", run_pipeline(EventPipeline()), responses),
+        ("registry + profiler", run_pipeline(EventPipeline(profiler=profiler)), responses),
+        ("registry + transform", run_pipeline(EventPipeline(transforms=[mask_digits])), responses),
+        ("registry, chat chunks", run_pipeline(EventPipeline()), chat),
+    ]
+    print(f"{len(responses)} chunks per stream, best of {args.repeat}")
+    print(f"{'case':<24} {'ns/chunk':>10}")
+    for name, fn, chunks in cases:
+        print(f"{name:<24} {best_ns(fn, chunks, args.repeat):>10.0f}")
+    print("\nprofiled stages:")
+    for stage, s in profiler.stats().items():
+        print(f"  {stage:<34} calls={s['calls']:<8} avg={s['avg_us']}us max={s['max_us']}us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Multi-worker benchmark: throughput and response-cache hit rate per worker count.
+
+For each worker count and [SHARED] backend, starts `uvicorn ark_server:app
+--workers N` against mock_ark.py with the response cache on, then sends a
+shuffled mix of repeated prompts. With the memory backend every worker
+has to miss once per prompt; with sqlite the workers share one cache.
+
+    python bench_workers.py
+    python bench_workers.py --workers 1,2,4,8 --prompts 100 --repeat 20 -c 64
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+import httpx
+
+from bench_concurrency import pct, spawn, wait_port
+
+
+async def run_load(url, prompts, repeat, concurrency):
+    bodies = [{"messages": [{"role": "user", "content": f"question {i}"}]} for i in range(prompts)] * repeat
+    random.Random(0).shuffle(bodies)
+    queue = asyncio.Queue()
+    for body in bodies:
+        queue.put_nowait(body)
+    latencies, outcomes = [], {"hit": 0, "coalesced": 0, "upstream": 0, "error": 0}
+
+    async def worker(client):
+        while not queue.empty():
+            body = queue.get_nowait()
+            start = time.perf_counter()
+            try:
+                resp = await client.post(url, json=body)
+            except httpx.HTTPError:
+                outcomes["error"] += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+            if resp.status_code != 200:
+                outcomes["error"] += 1
+            elif resp.headers.get("x-cache") == "HIT":
+                outcomes["hit"] += 1
+            elif resp.headers.get("x-coalesced") == "HIT":
+                outcomes["coalesced"] += 1
+            else:
+                outcomes["upstream"] += 1
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    # A new connection per request lets the kernel spread requests across the workers' shared socket
+    async with httpx.AsyncClient(limits=limits, timeout=60, headers={"Connection": "close"}) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        wall = time.perf_counter() - start
+    return len(bodies) / wall, pct(latencies, 0.5), pct(latencies, 0.95), outcomes
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", default="1,2,4")
+    parser.add_argument("--backends", default="memory,sqlite")
+    parser.add_argument("--prompts", type=int, default=50, help="distinct prompts")
+    parser.add_argument("--repeat", type=int, default=10, help="times each prompt is sent")
+    parser.add_argument("-c", "--concurrency", type=int, default=32)
+    parser.add_argument("--mock-port", type=int, default=9150)
+    parser.add_argument("--port", type=int, default=9151)
+    parser.add_argument("--ttft", type=float, default=0.05)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_workers_")
+    mock = spawn(["mock_ark.py", "--port", str(args.mock_port), "--tokens", "20", "--ttft", str(args.ttft), "--token-delay", "0"])
+    print(f"cpus={os.cpu_count()} requests={args.prompts * args.repeat} ({args.prompts} prompts x {args.repeat}) concurrency={args.concurrency}")
+    print(f"{'backend':>8} {'workers':>8} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'hits':>6} {'joined':>7} {'upstream':>9} {'errors':>7}")
+    try:
+        await wait_port(f"http://127.0.0.1:{args.mock_port}/docs")
+        for backend in args.backends.split(","):
+            for workers in [int(w) for w in args.workers.split(",")]:
+                config_path = os.path.join(workdir, f"{backend}-{workers}.ini")
+                with open(config_path, "w") as f:
+                    # Single-flight off: only the cache should turn repeated prompts into hits
+                    f.write(f"[CACHE]\nenabled = true\n[SINGLEFLIGHT]\nenabled = false\n"
+                            f"[SHARED]\nbackend = {backend}\npath = {os.path.join(workdir, f'{backend}-{workers}.db')}\n")
+                env = {"ARK_BASE_URL": f"http://127.0.0.1:{args.mock_port}/api/v3", "ARK_API_KEY": "bench", "ARK_CONFIG": config_path}
+                app = spawn(["-m", "uvicorn", "ark_server:app", "--port", str(args.port), "--workers", str(workers), "--log-level", "warning"], env)
+                try:
+                    await wait_port(f"http://127.0.0.1:{args.port}/docs", timeout=60)
+                    # Give every worker time to finish its lifespan startup
+                    await asyncio.sleep(1.0 + 0.5 * workers)
+                    rps, p50, p95, o = await run_load(f"http://127.0.0.1:{args.port}/api/chat", args.prompts, args.repeat, args.concurrency)
+                    print(f"{backend:>8} {workers:>8} {rps:>8.1f} {p50 * 1000:>8.1f} {p95 * 1000:>8.1f} "
+                          f"{o['hit']:>6} {o['coalesced']:>7} {o['upstream']:>9} {o['error']:>7}")
+                finally:
+                    app.terminate()
+                    app.wait()
+    finally:
+        mock.terminate()
+        mock.wait()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Server-side conversation chaining through previous_response_id.
+
+For each conversation we remember the last upstream response id together
+with a hash of the exact input prefix (history plus the generated reply)
+that response covers. When the next request starts with that same prefix
+only the new turn is sent upstream; anything else replays full history.
+Chains live in process memory, or in a shared_state.SharedState when
+several worker processes serve the same conversations.
+"""
+
+import json
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from response_cache import cache_key
+
+
+def assistant_item(text: str) -> dict:
+    """How the frontend echoes an assistant reply back in the next request."""
+    return {"role": "assistant", "content": [{"type": "input_text", "text": text}]}
+
+
+class ChainStore:
+    def __init__(self, max_size: int = 10000, ttl: float = 24 * 3600.0, shared=None):
+        """max_size bounds the in-process store; a shared store only expires chains by ttl."""
+        self.max_size = max_size
+        self.ttl = ttl
+        self._shared = shared
+        # conv_key -> (response_id, covered_items, prefix_hash, expires_at)
+        self._chains: "OrderedDict[str, Tuple[str, int, str, float]]" = OrderedDict()
+        self.chained = 0
+        self.replayed = 0
+        self.mismatches = 0
+        self.expired_upstream = 0
+
+    def match(self, conv_key: str, model_id: str, items: List[dict]) -> Optional[Tuple[str, List[dict]]]:
+        """Return (previous_response_id, new_items) if items extend the stored chain."""
+        entry = self._get(conv_key)
+        if entry is None or entry[3] < time.time():
+            self._pop(conv_key)
+            self.replayed += 1
+            return None
+        response_id, covered, prefix, _ = entry
+        if covered >= len(items) or cache_key(model_id, items[:covered]) != prefix:
+            self.mismatches += 1
+            self.replayed += 1
+            return None
+        if self._shared is None:
+            self._chains.move_to_end(conv_key)
+        self.chained += 1
+        return response_id, items[covered:]
+
+    def record(self, conv_key: str, model_id: str, items: List[dict], reply: str, response_id: str):
+        """Remember that response_id covers items plus the assistant reply."""
+        covered = items + [assistant_item(reply)]
+        entry = (response_id, len(covered), cache_key(model_id, covered), time.time() + self.ttl)
+        if self._shared is not None:
+            self._shared.set("chain", conv_key, json.dumps(entry), self.ttl)
+            return
+        self._chains[conv_key] = entry
+        self._chains.move_to_end(conv_key)
+        while len(self._chains) > self.max_size:
+            self._chains.popitem(last=False)
+
+    def drop(self, conv_key: str):
+        self._pop(conv_key)
+        self.expired_upstream += 1
+
+    # Async variants for the event loop: with a shared file the work runs on its threads
+
+    async def amatch(self, conv_key: str, model_id: str, items: List[dict]) -> Optional[Tuple[str, List[dict]]]:
+        if self._shared is None:
+            return self.match(conv_key, model_id, items)
+        return await self._shared.run(self.match, conv_key, model_id, items)
+
+    async def arecord(self, conv_key: str, model_id: str, items: List[dict], reply: str, response_id: str):
+        if self._shared is None:
+            return self.record(conv_key, model_id, items, reply, response_id)
+        await self._shared.run(self.record, conv_key, model_id, items, reply, response_id)
+
+    async def adrop(self, conv_key: str):
+        if self._shared is None:
+            return self.drop(conv_key)
+        await self._shared.run(self.drop, conv_key)
+
+    async def astats(self) -> Dict[str, int]:
+        if self._shared is None:
+            return self.stats()
+        return await self._shared.run(self.stats)
+
+    def _get(self, conv_key: str) -> Optional[Tuple[str, int, str, float]]:
+        if self._shared is not None:
+            raw = self._shared.get("chain", conv_key)
+            return tuple(json.loads(raw)) if raw else None
+        return self._chains.get(conv_key)
+
+    def _pop(self, conv_key: str):
+        if self._shared is not None:
+            self._shared.delete("chain", conv_key)
+        else:
+            self._chains.pop(conv_key, None)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "conversations": self._shared.usage("chain")[0] if self._shared is not None else len(self._chains),
+            "chained": self.chained,
+            "replayed": self.replayed,
+            "mismatches": self.mismatches,
+            "expired_upstream": self.expired_upstream,
+        }
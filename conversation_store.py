@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Server-side chat history for the web frontend.
+
+Conversations and their messages live in one SQLite file (WAL mode). A
+message is a row that is never rewritten as a whole: a streaming answer
+grows with `text = text || delta`, so saving costs the size of the
+change rather than the size of the history. Listing conversations and
+reading messages are paginated by cursor, newest first, so the frontend
+loads only what it shows.
+
+Every call is scoped to an owner (a fingerprint of the browser's client
+id); one owner cannot see or change another's conversations.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+Content = Union[str, List[Dict[str, Any]]]
+
+
+class ConversationStore:
+    def __init__(self, path: str, busy_timeout: float = 5.0, max_page: int = 200):
+        self.path = path
+        self.max_page = max_page
+        self._db = sqlite3.connect(path, timeout=busy_timeout, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("PRAGMA foreign_keys=ON")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS conversations ("
+            "pk INTEGER PRIMARY KEY, owner TEXT NOT NULL, id TEXT NOT NULL, title TEXT NOT NULL, "
+            "created INTEGER NOT NULL, updated INTEGER NOT NULL, UNIQUE (owner, id))"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS conversations_by_owner ON conversations (owner, pk)")
+        # text holds plain string content (and grows while streaming); parts holds multimodal content as JSON
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "conv INTEGER NOT NULL REFERENCES conversations (pk) ON DELETE CASCADE, "
+            "role TEXT NOT NULL, text TEXT, parts TEXT, status TEXT, created INTEGER NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS messages_by_conv ON messages (conv, id)")
+        # FastAPI runs the sync endpoints in a threadpool
+        self._lock = threading.Lock()
+        self.appends = 0
+        self.append_bytes = 0
+
+    def _pk(self, owner: str, conv_id: str) -> Optional[int]:
+        row = self._db.execute("SELECT pk FROM conversations WHERE owner = ? AND id = ?", (owner, conv_id)).fetchone()
+        return row[0] if row else None
+
+    def _touch(self, pk: int, now: int):
+        self._db.execute("UPDATE conversations SET updated = ? WHERE pk = ?", (now, pk))
+
+    # Conversations
+
+    def list(self, owner: str, limit: int = 50, before: Optional[int] = None) -> Tuple[List[dict], Optional[int]]:
+        """Newest conversations first; pass the returned cursor as `before` for the next page."""
+        limit = max(1, min(limit, self.max_page))
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT c.pk, c.id, c.title, c.created, c.updated, (SELECT COUNT(*) FROM messages m WHERE m.conv = c.pk) "
+                "FROM conversations c WHERE c.owner = ? AND c.pk < ? ORDER BY c.pk DESC LIMIT ?",
+                (owner, before if before is not None else 2 ** 63 - 1, limit + 1),
+            ).fetchall()
+        cursor = rows[limit - 1][0] if len(rows) > limit else None
+        items = [{"id": r[1], "title": r[2], "created": r[3], "updated": r[4], "message_count": r[5]} for r in rows[:limit]]
+        return items, cursor
+
+    def create(self, owner: str, conv_id: str, title: str, created: Optional[int] = None,
+               messages: Optional[List[dict]] = None) -> bool:
+        """Create a conversation, optionally with its messages (importing history); False if the id exists."""
+        now = int(time.time() * 1000)
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                cursor = self._db.execute(
+                    "INSERT OR IGNORE INTO conversations (owner, id, title, created, updated) VALUES (?, ?, ?, ?, ?)",
+                    (owner, conv_id, title, created or now, now),
+                )
+                if cursor.rowcount == 0:
+                    self._db.execute("ROLLBACK")
+                    return False
+                pk = cursor.lastrowid
+                for m in messages or ():
+                    self._insert(pk, m.get("role", "user"), m.get("content", ""), m.get("statusText"), m.get("created") or now)
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return True
+
+    def rename(self, owner: str, conv_id: str, title: str) -> bool:
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE conversations SET title = ?, updated = ? WHERE owner = ? AND id = ?",
+                (title, int(time.time() * 1000), owner, conv_id),
+            )
+        return cursor.rowcount > 0
+
+    def delete(self, owner: str, conv_id: str) -> bool:
+        with self._lock:
+            cursor = self._db.execute("DELETE FROM conversations WHERE owner = ? AND id = ?", (owner, conv_id))
+        return cursor.rowcount > 0
+
+    # Messages
+
+    def messages(self, owner: str, conv_id: str, limit: int = 50, before: Optional[int] = None) -> Optional[Tuple[List[dict], bool]]:
+        """
+        The latest `limit` messages older than message id `before`, oldest first, and whether
+        there are older ones. None if the conversation does not exist.
+        """
+        limit = max(1, min(limit, self.max_page))
+        with self._lock:
+            pk = self._pk(owner, conv_id)
+            if pk is None:
+                return None
+            rows = self._db.execute(
+                "SELECT id, role, text, parts, status, created FROM messages WHERE conv = ? AND id < ? ORDER BY id DESC LIMIT ?",
+                (pk, before if before is not None else 2 ** 63 - 1, limit + 1),
+            ).fetchall()
+        has_more = len(rows) > limit
+        items = []
+        for message_id, role, text, parts, status, created in reversed(rows[:limit]):
+            item = {"id": message_id, "role": role, "content": json.loads(parts) if parts is not None else text, "created": created}
+            if status:
+                item["statusText"] = status
+            items.append(item)
+        return items, has_more
+
+    def append(self, owner: str, conv_id: str, role: str, content: Content, status: Optional[str] = None,
+               created: Optional[int] = None) -> Optional[int]:
+        """Add a message; returns its id, or None if the conversation does not exist."""
+        now = int(time.time() * 1000)
+        with self._lock:
+            pk = self._pk(owner, conv_id)
+            if pk is None:
+                return None
+            message_id = self._insert(pk, role, content, status, created or now)
+            self._touch(pk, now)
+        return message_id
+
+    def _insert(self, pk: int, role: str, content: Content, status: Optional[str], created: int) -> int:
+        # Called with the lock held
+        if isinstance(content, str):
+            text, parts = content, None
+        else:
+            text, parts = None, json.dumps(content, ensure_ascii=False, separators=(",", ":"))
+        cursor = self._db.execute(
+            "INSERT INTO messages (conv, role, text, parts, status, created) VALUES (?, ?, ?, ?, ?, ?)",
+            (pk, role, text, parts, status, created),
+        )
+        return cursor.lastrowid
+
+    def update(self, owner: str, conv_id: str, message_id: int, append: Optional[str] = None,
+               status: Optional[str] = None) -> bool:
+        """Append text to a message (a streaming delta) and/or set its status line."""
+        now = int(time.time() * 1000)
+        with self._lock:
+            pk = self._pk(owner, conv_id)
+            if pk is None:
+                return False
+            cursor = self._db.execute(
+                "UPDATE messages SET text = COALESCE(text, '') || ?, status = COALESCE(?, status) "
+                "WHERE id = ? AND conv = ? AND parts IS NULL",
+                (append or "", status, message_id, pk),
+            )
+            if cursor.rowcount == 0:
+                return False
+            self._touch(pk, now)
+            if append:
+                self.appends += 1
+                self.append_bytes += len(append.encode("utf-8"))
+        return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            conversations = self._db.execute("SELECT COUNT(*) FROM conversations").fetchone()[0]
+            messages = self._db.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+        return {
+            "conversations": conversations,
+            "messages": messages,
+            "appends": self.appends,
+            "append_bytes": self.append_bytes,
+        }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def from_config(config) -> Optional[ConversationStore]:
+    """Open the store from the [CONVERSATIONS] section, or None to leave history in the browser."""
+    if not config.getboolean("CONVERSATIONS", "enabled", fallback=True):
+        return None
+    return ConversationStore(
+        config.get("CONVERSATIONS", "path", fallback="ark_conversations.db"),
+        busy_timeout=config.getfloat("CONVERSATIONS", "busy_timeout", fallback=5.0),
+        max_page=config.getint("CONVERSATIONS", "max_page", fallback=200),
+    )
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Approximate answer cache for near-duplicate prompts.
+
+The final user turn is normalized (NFKC, lower case, whitespace removed;
+punctuation and operators are kept), split into character n-grams and
+summarized as a MinHash signature. Locality-sensitive hashing over bands
+of the signature finds candidate entries in constant time; a candidate
+is served when its estimated Jaccard similarity reaches the threshold
+and its numbers, operators and negations match the prompt's exactly, so
+"7 + 3" never gets the answer for "7 - 3" however similar the rest is. Long prompts are sampled: only the max_shingles n-grams with
+the smallest hashes enter the signature (a bottom-k sample, consistent
+between texts because equal n-grams hash equally), so the cost of a
+lookup stays flat however long the prompt is. Everything that precedes the final turn (model, web_search,
+earlier history) must match exactly: it is folded into a partition key.
+Runs locally with no embedding service; bounded by entry count with
+LRU eviction and a TTL.
+"""
+
+import heapq
+import random
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+# Modulus of the universal hash family used to simulate permutations
+PRIME = (1 << 61) - 1
+MASK = (1 << 64) - 1
+
+
+# Tokens that change the meaning of a prompt no matter how similar the rest is
+GUARD_TOKENS = re.compile(
+    r"\d+(?:[.,]\d+)*"
+    r"|[-+*/×÷=<>≤≥≠%^]"
+    r"|n't\b|\b(?:not|no|never|none|nor|neither|without|cannot)\b"
+    r"|[不没无非别勿未否]"
+)
+
+
+def normalize(text: str) -> str:
+    text = unicodedata.normalize("NFKC", text).lower()
+    return "".join(ch for ch in text if unicodedata.category(ch)[0] not in "ZC" and not ch.isspace())
+
+
+def guard(text: str) -> Tuple[str, ...]:
+    """Numbers, operators and negations in order; a near-duplicate must match them exactly."""
+    return tuple(GUARD_TOKENS.findall(unicodedata.normalize("NFKC", text).lower()))
+
+
+class _Entry:
+    __slots__ = ("partition", "text", "guard", "signature", "bands", "value", "expires_at")
+
+    def __init__(self, partition, text, guard, signature, bands, value, expires_at):
+        self.partition = partition
+        self.text = text
+        self.guard = guard
+        self.signature = signature
+        self.bands = bands
+        self.value = value
+        self.expires_at = expires_at
+
+
+class FuzzyCache:
+    def __init__(self, threshold: float = 0.8, ngram: int = 3, num_perm: int = 64, bands: int = 16,
+                 max_entries: int = 10000, ttl: float = 3600.0, min_chars: int = 8, max_shingles: int = 256,
+                 seed: int = 1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.threshold = threshold
+        self.ngram = ngram
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.min_chars = min_chars
+        self.max_shingles = max_shingles
+        rng = random.Random(seed)
+        self._perms = [(rng.randrange(1, PRIME), rng.randrange(0, PRIME)) for _ in range(num_perm)]
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._buckets: Dict[int, Set[int]] = {}  # hash of (partition, band, rows) -> entry ids
+        self._exact: Dict[Tuple[str, str, Tuple[str, ...]], int] = {}  # (partition, normalized text, guard) -> entry id
+        self._next_id = 0
+        self.lookups = 0
+        self.skipped = 0
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.candidates = 0
+        self.rejected_candidates = 0
+        self.false_positives = 0
+        self.evictions = 0
+        self.lookup_seconds = 0.0
+
+    def _signature(self, text: str) -> Tuple[int, ...]:
+        n = self.ngram
+        # The cache lives in one process, so the per-process salt of hash() does not matter
+        hashes = {hash(text[i:i + n]) & MASK for i in range(max(1, len(text) - n + 1))}
+        if len(hashes) > self.max_shingles:
+            hashes = heapq.nsmallest(self.max_shingles, hashes)
+        return tuple(min((a * h + b) % PRIME for h in hashes) for a, b in self._perms)
+
+    def _band_keys(self, partition: str, signature: Tuple[int, ...]) -> List[int]:
+        r = self.rows
+        return [hash((partition, i, signature[i * r:(i + 1) * r])) for i in range(self.bands)]
+
+    def similarity(self, a: Tuple[int, ...], b: Tuple[int, ...]) -> float:
+        """Estimated Jaccard similarity of the two n-gram sets."""
+        return sum(x == y for x, y in zip(a, b)) / self.num_perm
+
+    def get(self, partition: str, text: str) -> Optional[Tuple[Dict[str, Any], float]]:
+        """Return (stored value, similarity) for the closest entry above the threshold."""
+        norm = normalize(text)
+        if len(norm) < self.min_chars:
+            self.skipped += 1
+            return None
+        started = time.perf_counter()
+        self.lookups += 1
+        tokens = guard(text)
+        try:
+            exact = self._exact.get((partition, norm, tokens))
+            if exact is not None and self._live(exact):
+                self._entries.move_to_end(exact)
+                self.hits += 1
+                return self._entries[exact].value, 1.0
+            signature = self._signature(norm)
+            ids: Set[int] = set()
+            for key in self._band_keys(partition, signature):
+                ids.update(self._buckets.get(key, ()))
+            best, best_sim = None, 0.0
+            for entry_id in list(ids):
+                if not self._live(entry_id):
+                    continue
+                self.candidates += 1
+                sim = self.similarity(signature, self._entries[entry_id].signature)
+                if sim < self.threshold:
+                    # Shared a band but is not similar enough (an LSH collision, nothing was served)
+                    self.rejected_candidates += 1
+                elif self._entries[entry_id].guard != tokens:
+                    # Similar enough to be served, but a number, operator or negation differs
+                    self.false_positives += 1
+                elif sim > best_sim:
+                    best, best_sim = entry_id, sim
+            if best is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best)
+            self.hits += 1
+            self.near_hits += 1
+            return self._entries[best].value, best_sim
+        finally:
+            self.lookup_seconds += time.perf_counter() - started
+
+    def set(self, partition: str, text: str, value: Dict[str, Any]):
+        norm = normalize(text)
+        if len(norm) < self.min_chars:
+            return
+        tokens = guard(text)
+        existing = self._exact.get((partition, norm, tokens))
+        if existing is not None:
+            self._remove(existing)
+        signature = self._signature(norm)
+        entry_id = self._next_id
+        self._next_id += 1
+        entry = _Entry(partition, norm, tokens, signature, self._band_keys(partition, signature), value,
+                       time.time() + self.ttl)
+        self._entries[entry_id] = entry
+        self._exact[(partition, norm, tokens)] = entry_id
+        for key in entry.bands:
+            self._buckets.setdefault(key, set()).add(entry_id)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _live(self, entry_id: int) -> bool:
+        entry = self._entries.get(entry_id)
+        if entry is None:
+            return False
+        if entry.expires_at <= time.time():
+            self._remove(entry_id)
+            return False
+        return True
+
+    def _remove(self, entry_id: int):
+        entry = self._entries.pop(entry_id)
+        self._exact.pop((entry.partition, entry.text, entry.guard), None)
+        for key in entry.bands:
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self._buckets[key]
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "buckets": len(self._buckets),
+            "lookups": self.lookups,
+            "skipped_short": self.skipped,
+            "hits": self.hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / self.lookups, 4) if self.lookups else 0.0,
+            "candidates": self.candidates,
+            "rejected_candidates": self.rejected_candidates,
+            "false_positives": self.false_positives,
+            "evictions": self.evictions,
+            "avg_lookup_ms": round(self.lookup_seconds * 1000 / self.lookups, 3) if self.lookups else 0.0,
+        }
+
+
+def from_config(config) -> Optional[FuzzyCache]:
+    """Build the cache from the [FUZZY_CACHE] section, or None when it is not enabled."""
+    if not config.getboolean("FUZZY_CACHE", "enabled", fallback=False):
+        return None
+    return FuzzyCache(
+        threshold=config.getfloat("FUZZY_CACHE", "threshold", fallback=0.8),
+        ngram=config.getint("FUZZY_CACHE", "ngram", fallback=3),
+        num_perm=config.getint("FUZZY_CACHE", "num_perm", fallback=64),
+        bands=config.getint("FUZZY_CACHE", "bands", fallback=16),
+        max_entries=config.getint("FUZZY_CACHE", "max_entries", fallback=10000),
+        ttl=config.getfloat("FUZZY_CACHE", "ttl", fallback=3600.0),
+        min_chars=config.getint("FUZZY_CACHE", "min_chars", fallback=8),
+        max_shingles=config.getint("FUZZY_CACHE", "max_shingles", fallback=256),
+    )
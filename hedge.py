@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Hedged streaming requests across an ordered model fallback list.
+
+The request starts on its own model. If no text delta has arrived after
+the hedge delay (fixed, or the model's learned p95 time-to-first-token),
+the same request is started on the next model in the list; a failure
+starts the next one straight away. The first stream to produce a delta
+wins and every other stream is closed so it stops generating tokens.
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import AsyncIterator, Awaitable, Callable, Deque, Dict, Iterable, List, Optional, Tuple
+
+# Stream events after which no text delta can follow
+TERMINAL_EVENTS = {"response.completed", "response.failed", "response.incomplete", "error"}
+
+
+async def close_stream(stream):
+    response = getattr(stream, "response", None)
+    if response is not None:
+        await response.aclose()
+
+
+async def replay(prefix: list, stream) -> AsyncIterator:
+    """The events consumed while racing, then the rest of the winning stream."""
+    for chunk in prefix:
+        yield chunk
+    if prefix and getattr(prefix[-1], "type", "") in TERMINAL_EVENTS:
+        return
+    async for chunk in stream:
+        yield chunk
+
+
+class Hedger:
+    def __init__(self, models: List[str], delay: Optional[float] = None, min_delay: float = 0.5,
+                 max_hedges: int = 1, window: int = 200, min_samples: int = 20,
+                 tracked: Iterable[str] = ()):
+        """
+        delay=None hedges after the model's recent p95 TTFT (never below min_delay).
+        TTFT is learned only for the fallback models and `tracked` (the other
+        configured models); any other model hedges after min_delay.
+        """
+        self.models = models
+        self.tracked = set(models) | set(tracked)
+        self.delay = delay
+        self.min_delay = min_delay
+        self.max_hedges = max_hedges
+        self.min_samples = min_samples
+        self._window = window
+        self._ttft: Dict[str, Deque[float]] = {}
+        self.races = 0
+        self.hedged = 0
+        self.primary_wins = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+
+    def candidates(self, model: str) -> List[str]:
+        return [m for m in self.models if m != model][:self.max_hedges]
+
+    def observe(self, model: str, seconds: float):
+        if model not in self.tracked:
+            # Client-supplied model names must not grow the table
+            return
+        samples = self._ttft.get(model)
+        if samples is None:
+            samples = self._ttft[model] = deque(maxlen=self._window)
+        samples.append(seconds)
+
+    def p95(self, model: str) -> Optional[float]:
+        samples = self._ttft.get(model)
+        if not samples or len(samples) < self.min_samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    def delay_for(self, model: str) -> float:
+        if self.delay is not None:
+            return self.delay
+        return max(self.min_delay, self.p95(model) or 0.0)
+
+    async def _attempt(self, model: str, open_stream: Callable[[str], Awaitable]) -> Tuple[str, object, list]:
+        started = time.monotonic()
+        try:
+            stream = await open_stream(model)
+        except asyncio.CancelledError:
+            self._censored(model, started)
+            raise
+        prefix = []
+        try:
+            async for chunk in stream:
+                prefix.append(chunk)
+                kind = getattr(chunk, "type", "")
+                if kind == "response.output_text.delta":
+                    self.observe(model, time.monotonic() - started)
+                    break
+                if kind in TERMINAL_EVENTS:
+                    break
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError):
+                self._censored(model, started)
+            await close_stream(stream)
+            raise
+        return model, stream, prefix
+
+    def _censored(self, model: str, started: float):
+        # Cancelled before its first delta (usually a slow primary the hedge beat): the elapsed
+        # time is a lower bound on its TTFT. Dropping it would keep only the fast samples and
+        # pull the learned p95, and with it the hedge delay, down toward min_delay.
+        self.observe(model, time.monotonic() - started)
+
+    async def race(self, model: str, open_stream: Callable[[str], Awaitable]) -> Tuple[str, object, list]:
+        """Return (winning model, its stream, events already read from it)."""
+        self.races += 1
+        backups = iter(self.candidates(model))
+        pending = {asyncio.create_task(self._attempt(model, open_stream))}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, timeout=self.delay_for(model), return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        winner = task.result()
+                        if winner[0] == model:
+                            self.primary_wins += 1
+                        else:
+                            self.hedge_wins += 1
+                        # Another attempt may have finished in the same instant
+                        for other in done - {task}:
+                            if other.exception() is None:
+                                await close_stream(other.result()[1])
+                        return winner
+                    error = task.exception()
+                # Slow (timeout) or failed: bring in the next model, if any
+                backup = next(backups, None)
+                if backup is not None:
+                    if done:
+                        self.failovers += 1
+                    else:
+                        self.hedged += 1
+                    pending.add(asyncio.create_task(self._attempt(backup, open_stream)))
+                elif done and not pending:
+                    break
+            raise error
+        finally:
+            # Cancel the losers so they stop generating (and billing) tokens
+            for task in pending:
+                task.cancel()
+            for task in pending:
+                try:
+                    _, stream, _ = await task
+                except BaseException:
+                    continue
+                await close_stream(stream)
+
+    def stats(self) -> dict:
+        return {
+            "races": self.races,
+            "hedged": self.hedged,
+            "hedge_rate": round(self.hedged / self.races, 4) if self.races else 0.0,
+            "primary_wins": self.primary_wins,
+            "hedge_wins": self.hedge_wins,
+            "failovers": self.failovers,
+            "p95_ttft": {m: round(v, 3) for m in self._ttft if (v := self.p95(m)) is not None},
+        }
+
+
+def from_config(config, tracked: Iterable[str] = ()) -> Optional[Hedger]:
+    """Build the hedger from the [HEDGE] section, or None when disabled."""
+    if not config.getboolean("HEDGE", "enabled", fallback=False):
+        return None
+    models = [m.strip() for m in config.get("HEDGE", "models", fallback="").split(",") if m.strip()]
+    if len(models) < 2:
+        return None
+    delay = config.get("HEDGE", "delay", fallback="auto").strip()
+    return Hedger(
+        models,
+        delay=None if delay == "auto" else float(delay),
+        min_delay=config.getfloat("HEDGE", "min_delay", fallback=0.5),
+        max_hedges=config.getint("HEDGE", "max_hedges", fallback=1),
+        tracked=tracked,
+    )
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Optional downscaling of user images before they are sent upstream.
+
+Full-resolution photos are decoded, scaled down to a maximum edge,
+re-encoded (JPEG at a target quality, PNG when there is transparency) and
+stripped of metadata. The work runs in a bounded process pool so neither
+the event loop nor request threads are held up, and results are cached
+by the SHA-256 of the original bytes. Needs Pillow; without it the stage
+stays disabled.
+"""
+
+import asyncio
+import base64
+import binascii
+import hashlib
+import io
+import multiprocessing
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # pragma: no cover - optional dependency
+    Image = None
+
+
+def _shrink(data: bytes, max_edge: int, quality: int) -> Tuple[Optional[bytes], Optional[str]]:
+    """Runs in a worker process. Returns (None, None) when the image should be left alone."""
+    with Image.open(io.BytesIO(data)) as img:
+        if getattr(img, "is_animated", False):
+            return None, None
+        # Apply the EXIF orientation before the metadata is dropped
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((max_edge, max_edge))
+        out = io.BytesIO()
+        if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+            img.save(out, "PNG", optimize=True)
+            return out.getvalue(), "image/png"
+        img.convert("RGB").save(out, "JPEG", quality=quality, optimize=True)
+        return out.getvalue(), "image/jpeg"
+
+
+class InvalidImage(ValueError):
+    """A client-supplied image that cannot be decoded."""
+
+
+def parse_data_url(url: str) -> Optional[Tuple[str, bytes]]:
+    """(mime, bytes) for a base64 image data URL, or None for anything else. Raises InvalidImage on bad base64."""
+    if not url.startswith("data:image/"):
+        return None
+    header, _, payload = url.partition(",")
+    if not header.endswith(";base64"):
+        return None
+    try:
+        return header[5:-7], base64.b64decode(payload)
+    except (binascii.Error, ValueError) as e:
+        raise InvalidImage(f"Invalid base64 in image data URL: {e}") from None
+
+
+class ImagePreprocessor:
+    def __init__(self, max_edge: int = 2048, quality: int = 85, workers: int = 2, max_pending: int = 16,
+                 min_bytes: int = 200 * 1024, cache_items: int = 256):
+        self.max_edge = max_edge
+        self.quality = quality
+        self.min_bytes = min_bytes
+        self.cache_items = cache_items
+        # spawn, not fork: forked workers would inherit the server's listening socket
+        self._pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        # Bounds work queued on the pool; further callers wait here without blocking the loop
+        self._slots = asyncio.Semaphore(max_pending)
+        self._cache: "OrderedDict[str, Tuple[bytes, str]]" = OrderedDict()
+        self.processed = 0
+        self.cache_hits = 0
+        self.failures = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.seconds = 0.0
+
+    async def process(self, data: bytes, mime: str) -> Tuple[bytes, str]:
+        """Return (bytes, mime) to send upstream; the original if shrinking does not help."""
+        if len(data) < self.min_bytes:
+            return data, mime
+        digest = hashlib.sha256(data).hexdigest()
+        cached = self._cache.get(digest)
+        if cached is not None:
+            self._cache.move_to_end(digest)
+            self.cache_hits += 1
+            return cached
+        started = time.perf_counter()
+        try:
+            async with self._slots:
+                out, out_mime = await asyncio.get_running_loop().run_in_executor(
+                    self._pool, _shrink, data, self.max_edge, self.quality)
+        except Exception as e:
+            self.failures += 1
+            print(f"Image preprocessing failed, sending original: {e}")
+            return data, mime
+        elapsed = time.perf_counter() - started
+        if out is None or len(out) >= len(data):
+            out, out_mime = data, mime
+        self.processed += 1
+        self.bytes_in += len(data)
+        self.bytes_out += len(out)
+        self.seconds += elapsed
+        print(f"Image preprocessed: {len(data)} -> {len(out)} bytes "
+              f"(saved {100 * (1 - len(out) / len(data)):.0f}%), +{elapsed * 1000:.0f} ms")
+        self._cache[digest] = (out, out_mime)
+        while len(self._cache) > self.cache_items:
+            self._cache.popitem(last=False)
+        return out, out_mime
+
+    async def process_data_url(self, url: str) -> str:
+        parsed = parse_data_url(url)
+        if parsed is None:
+            return url
+        mime, data = parsed
+        if len(data) < self.min_bytes:
+            return url
+        out, out_mime = await self.process(data, mime)
+        if out is data:
+            return url
+        return f"data:{out_mime};base64,{base64.b64encode(out).decode('ascii')}"
+
+    def stats(self) -> dict:
+        return {
+            "processed": self.processed,
+            "cache_hits": self.cache_hits,
+            "failures": self.failures,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "bytes_saved": self.bytes_in - self.bytes_out,
+            "seconds": round(self.seconds, 3),
+        }
+
+    def close(self):
+        self._pool.shutdown(wait=True, cancel_futures=True)
+
+
+def from_config(config) -> Optional[ImagePreprocessor]:
+    """Build the preprocessor from the [PREPROCESS] section, or None when disabled."""
+    if not config.getboolean("PREPROCESS", "enabled", fallback=False):
+        return None
+    if Image is None:
+        print("PREPROCESS.enabled is set but Pillow is not installed (pip install pillow); sending images unchanged")
+        return None
+    return ImagePreprocessor(
+        max_edge=config.getint("PREPROCESS", "max_edge", fallback=2048),
+        quality=config.getint("PREPROCESS", "quality", fallback=85),
+        workers=config.getint("PREPROCESS", "workers", fallback=2),
+        max_pending=config.getint("PREPROCESS", "max_pending", fallback=16),
+        min_bytes=config.getint("PREPROCESS", "min_kb", fallback=200) * 1024,
+        cache_items=config.getint("PREPROCESS", "cache_items", fallback=256),
+    )
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Content-addressed store for uploaded chat images.
+
+Images are uploaded once and referenced by the SHA-256 of their bytes, so
+the browser no longer sends the same base64 payload with every turn. The
+store is bounded by total bytes and evicts least recently used images.
+With a shared_state.SharedState (several worker processes), images are
+kept in the shared file instead; they expire ttl seconds after upload and
+the oldest are deleted once the file holds more than max_bytes of images.
+"""
+
+import base64
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+
+class ImageStore:
+    def __init__(self, max_bytes: int = 512 * 1024 * 1024, max_image_bytes: int = 10 * 1024 * 1024,
+                 shared=None, ttl: float = 24 * 3600.0):
+        self.max_bytes = max_bytes
+        self.max_image_bytes = max_image_bytes
+        self._shared = shared
+        self.ttl = ttl
+        self._images: "OrderedDict[str, Tuple[str, bytes]]" = OrderedDict()  # id -> (mime, data)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.uploads = 0
+        self.dedup_hits = 0
+        self.evictions = 0
+
+    def put(self, data: bytes, mime: str) -> Tuple[str, bool]:
+        """Store image bytes, returning (image_id, already_present)."""
+        if len(data) > self.max_image_bytes:
+            raise ValueError(f"Image exceeds {self.max_image_bytes} bytes")
+        image_id = hashlib.sha256(data).hexdigest()
+        if self._shared is not None:
+            # Stored as mime, NUL, bytes
+            added = self._shared.add("image", image_id, mime.encode("utf-8") + b"\0" + data, self.ttl)
+            evicted = self._shared.trim("image", self.max_bytes) if added else 0
+            with self._lock:
+                self.uploads += 1
+                self.dedup_hits += not added
+                self.evictions += evicted
+            return image_id, not added
+        with self._lock:
+            self.uploads += 1
+            if image_id in self._images:
+                self._images.move_to_end(image_id)
+                self.dedup_hits += 1
+                return image_id, True
+            self._images[image_id] = (mime, data)
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes:
+                _, (_, old) = self._images.popitem(last=False)
+                self._bytes -= len(old)
+                self.evictions += 1
+        return image_id, False
+
+    async def aput(self, data: bytes, mime: str) -> Tuple[str, bool]:
+        """put() for the event loop: hashing and the shared-file write run off the loop."""
+        if self._shared is None:
+            return self.put(data, mime)
+        return await self._shared.run(self.put, data, mime)
+
+    async def adata_url(self, image_id: str) -> Optional[str]:
+        if self._shared is None:
+            return self.data_url(image_id)
+        return await self._shared.run(self.data_url, image_id)
+
+    async def astats(self) -> Dict[str, int]:
+        if self._shared is None:
+            return self.stats()
+        return await self._shared.run(self.stats)
+
+    def get(self, image_id: str) -> Optional[Tuple[str, bytes]]:
+        if self._shared is not None:
+            raw = self._shared.get("image", image_id)
+            if raw is None:
+                return None
+            mime, _, data = raw.partition(b"\0")
+            return mime.decode("utf-8"), data
+        with self._lock:
+            item = self._images.get(image_id)
+            if item is not None:
+                self._images.move_to_end(image_id)
+            return item
+
+    def data_url(self, image_id: str) -> Optional[str]:
+        item = self.get(image_id)
+        if item is None:
+            return None
+        mime, data = item
+        return f"data:{mime};base64,{base64.b64encode(data).decode('ascii')}"
+
+    def stats(self) -> Dict[str, int]:
+        images, size = self._shared.usage("image") if self._shared is not None else (len(self._images), self._bytes)
+        return {
+            "images": images,
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+            "uploads": self.uploads,
+            "dedup_hits": self.dedup_hits,
+            "evictions": self.evictions,
+        }
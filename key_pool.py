@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Weighted routing of server-key traffic across several Ark API keys and endpoints.
+
+Each [UPSTREAM:<name>] config section adds a key (api_key, base_url,
+weight). Every call picks an upstream at random with probability
+proportional to weight / recent latency, scaled down by the recent error
+rate, so a slow region or a failing key gets less traffic without being
+starved: each upstream keeps at least min_share of the best score so its
+statistics stay current. A key that answers 429 (quota exhausted) sits
+out for its Retry-After while others are available. Latency is tracked
+per call kind: a stream returns at its response headers, a full call only
+after the whole answer, so the two are never averaged together.
+"""
+
+import hashlib
+import math
+import random
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from ark_clients import fingerprint
+from resilience import is_retryable, server_retry_after
+
+# Call kinds, timed separately
+STREAM = "stream"  # until the response headers of a streamed answer
+FULL = "full"  # until the whole answer (non-streaming chat, image analysis, probes)
+
+
+class Upstream:
+    def __init__(self, name: str, client, base_url: str, api_key: str, weight: float = 1.0):
+        self.name = name
+        self.client = client
+        self.base_url = base_url
+        self.key_id = fingerprint(api_key)
+        self.weight = weight
+        self.latency: Dict[str, float] = {}  # call kind -> EWMA seconds until the upstream call returned
+        self.error_rate = 0.0  # EWMA of failed calls
+        self.inflight = 0
+        self.requests = 0
+        self.failures = 0
+        self.cooldown_until = 0.0
+
+
+class KeyPool:
+    def __init__(self, upstreams: List[Upstream], alpha: float = 0.2, min_share: float = 0.05, cooldown: float = 5.0):
+        self.upstreams = upstreams
+        self.alpha = alpha
+        self.min_share = min_share
+        self.cooldown = cooldown
+
+    def score(self, upstream: Upstream, kind: str = FULL) -> float:
+        # Upstreams without samples yet are scored at the pool's best latency so they get tried
+        known = [u.latency[kind] for u in self.upstreams if kind in u.latency]
+        latency = upstream.latency.get(kind, min(known) if known else 1.0)
+        return upstream.weight * (1.0 - upstream.error_rate) ** 2 / max(latency, 0.001)
+
+    def pick(self, affinity: Optional[str] = None, kind: str = FULL) -> Upstream:
+        """Choose an upstream; affinity pins a key (e.g. a conversation) to one upstream while it is available."""
+        if len(self.upstreams) == 1:
+            return self.upstreams[0]
+        now = time.monotonic()
+        live = [u for u in self.upstreams if u.cooldown_until <= now] or self.upstreams
+        if affinity is not None:
+            # Weighted rendezvous hashing: stable per key, and only keys on a removed upstream move
+            def rank(u: Upstream) -> float:
+                h = int.from_bytes(hashlib.sha256(f"{affinity}:{u.name}".encode("utf-8")).digest()[:8], "big")
+                return -u.weight / math.log((h + 0.5) / 2.0 ** 64)
+            return max(live, key=rank)
+        scores = [self.score(u, kind) for u in live]
+        floor = max(scores) * self.min_share
+        return random.choices(live, weights=[max(s, floor) for s in scores])[0]
+
+    async def call(self, fn: Callable[[object], Awaitable], affinity: Optional[str] = None, kind: str = FULL):
+        """Run fn(client) on a picked upstream and feed the outcome back into its score for this call kind."""
+        upstream = self.pick(affinity, kind)
+        upstream.inflight += 1
+        upstream.requests += 1
+        started = time.monotonic()
+        try:
+            result = await fn(upstream.client)
+        except Exception as e:
+            self.record(upstream, time.monotonic() - started, e, kind)
+            raise
+        finally:
+            upstream.inflight -= 1
+        self.record(upstream, time.monotonic() - started, kind=kind)
+        return result
+
+    def record(self, upstream: Upstream, seconds: float, error: Optional[BaseException] = None, kind: str = FULL):
+        # Non-retryable errors (e.g. 400) are the request's fault, not the upstream's
+        if error is not None and is_retryable(error):
+            upstream.failures += 1
+            upstream.error_rate += self.alpha * (1.0 - upstream.error_rate)
+            if getattr(error, "status_code", None) == 429:
+                upstream.cooldown_until = time.monotonic() + (server_retry_after(error) or self.cooldown)
+                print(f"Upstream {upstream.name} rate limited, routing around it")
+            return
+        upstream.error_rate -= self.alpha * upstream.error_rate
+        latency = upstream.latency.get(kind)
+        upstream.latency[kind] = seconds if latency is None else latency + self.alpha * (seconds - latency)
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        kinds = (STREAM, FULL)
+        totals = {kind: sum(self.score(u, kind) for u in self.upstreams) or 1.0 for kind in kinds}
+        return {
+            u.name: {
+                "key": u.key_id[:12],  # shortened for display only
+                "base_url": u.base_url,
+                "weight": u.weight,
+                "share": {kind: round(self.score(u, kind) / totals[kind], 3) for kind in kinds},
+                "latency": {kind: round(seconds, 3) for kind, seconds in u.latency.items()},
+                "error_rate": round(u.error_rate, 3),
+                "inflight": u.inflight,
+                "requests": u.requests,
+                "failures": u.failures,
+                "cooling_down": u.cooldown_until > now,
+            }
+            for u in self.upstreams
+        }
+
+
+def from_config(config, make_client: Callable[[str, str], object], api_key: Optional[str], base_url: str) -> Optional[KeyPool]:
+    """
+    Build the pool from [UPSTREAM:<name>] sections, falling back to the single [ARK] key.
+    Returns None when no key is configured at all.
+    """
+    upstreams = []
+    for section in config.sections():
+        if not section.startswith("UPSTREAM:"):
+            continue
+        key = config.get(section, "api_key", fallback=None)
+        if not key:
+            continue
+        url = config.get(section, "base_url", fallback=base_url)
+        upstreams.append(Upstream(section.split(":", 1)[1], make_client(key, url), url, key,
+                                  weight=config.getfloat(section, "weight", fallback=1.0)))
+    if not upstreams and api_key:
+        upstreams.append(Upstream("default", make_client(api_key, base_url), base_url, api_key))
+    if not upstreams:
+        return None
+    return KeyPool(
+        upstreams,
+        alpha=config.getfloat("ROUTING", "ewma_alpha", fallback=0.2),
+        min_share=config.getfloat("ROUTING", "min_share", fallback=0.05),
+        cooldown=config.getfloat("ROUTING", "cooldown", fallback=5.0),
+    )
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Load generator for the gateway's /api/chat (streaming) and
+/api/analyze-image routes.
+
+Each concurrency level runs closed-loop workers for a fixed duration and
+reports p50/p95/p99 time-to-first-token, inter-token latency, end-to-end
+latency, throughput and error rate. With --spawn it starts mock_ark.py and
+the target app itself, so no network access or API key is needed:
+
+    python loadtest.py --spawn --target ark -c 10,50,100 --duration 15
+    python loadtest.py --spawn --target backend -c 10,50 --mock-args="--fail-rate 0.02"
+    python loadtest.py --url http://127.0.0.1:8000 --target ark --json results.json
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import shlex
+import time
+
+import httpx
+
+from bench_concurrency import spawn, wait_port
+
+TARGETS = {
+    "ark": ("ark_server:app", "/api/chat"),
+    "backend": ("ark_server:app", "/api/analyze-image"),
+}
+
+# Numbers the chat prompts so single-flight (on by default) does not coalesce identical requests
+REQUEST_IDS = itertools.count()
+
+SAMPLE_IMAGE = "https://ark-project.tos-cn-beijing.volces.com/doc_image/ark_demo_img_1.png"
+
+
+def pct(values, p):
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+class Recorder:
+    def __init__(self):
+        self.ttft = []
+        self.itl = []
+        self.latency = []
+        self.tokens = 0
+        self.ok = 0
+        self.errors = {}
+
+    def error(self, kind: str):
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+
+async def chat_request(client, url, args, rec: Recorder):
+    prompt = f"{args.prompt} #{next(REQUEST_IDS)}"
+    body = {"messages": [{"role": "user", "content": prompt}], "stream": True, "web_search": args.web_search}
+    start = time.perf_counter()
+    last = None
+    failed = False
+    async with client.stream("POST", url, json=body) as resp:
+        if resp.status_code != 200:
+            await resp.aread()
+            rec.error(f"http_{resp.status_code}")
+            return
+        async for line in resp.aiter_lines():
+            if not line.startswith("data: ") or line == "data: [DONE]":
+                continue
+            data = json.loads(line[6:])
+            now = time.perf_counter()
+            if "content" in data:
+                if last is None:
+                    rec.ttft.append(now - start)
+                else:
+                    rec.itl.append(now - last)
+                last = now
+            if "usage" in data:
+                rec.tokens += data["usage"].get("completion_tokens", 0)
+            if "error" in data:
+                failed = True
+    if failed:
+        rec.error("stream_error")
+        return
+    rec.latency.append(time.perf_counter() - start)
+    rec.ok += 1
+
+
+async def image_request(client, url, args, rec: Recorder):
+    start = time.perf_counter()
+    resp = await client.post(url, json={"image_url": SAMPLE_IMAGE, "prompt": args.prompt})
+    elapsed = time.perf_counter() - start
+    if resp.status_code != 200:
+        rec.error(f"http_{resp.status_code}")
+        return
+    # Non-streaming: the first token arrives with the whole answer
+    rec.ttft.append(elapsed)
+    rec.latency.append(elapsed)
+    rec.tokens += resp.json()["usage"].get("completion_tokens", 0)
+    rec.ok += 1
+
+
+async def run_level(url, args, concurrency):
+    rec = Recorder()
+    request = chat_request if args.target == "ark" else image_request
+    deadline = time.perf_counter() + args.duration
+
+    async def worker(client):
+        while time.perf_counter() < deadline:
+            try:
+                await request(client, url, args, rec)
+            except httpx.TimeoutException:
+                rec.error("timeout")
+            except httpx.TransportError:
+                rec.error("connection")
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=args.timeout) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        wall = time.perf_counter() - start
+
+    total = rec.ok + sum(rec.errors.values())
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "ok": rec.ok,
+        "errors": rec.errors,
+        "error_rate": (total - rec.ok) / total if total else 0.0,
+        "rps": rec.ok / wall,
+        "tokens_per_s": rec.tokens / wall,
+        **{f"ttft_p{p}": pct(rec.ttft, p / 100) for p in (50, 95, 99)},
+        **{f"itl_p{p}": pct(rec.itl, p / 100) for p in (50, 95, 99)},
+        **{f"latency_p{p}": pct(rec.latency, p / 100) for p in (50, 95, 99)},
+    }
+
+
+def print_row(r):
+    ms = lambda v: f"{v * 1000:8.1f}"
+    print(f"{r['concurrency']:>5} {r['requests']:>6} {100 * r['error_rate']:>6.2f}% {r['rps']:>7.1f} {r['tokens_per_s']:>8.0f} "
+          f"{ms(r['ttft_p50'])} {ms(r['ttft_p95'])} {ms(r['ttft_p99'])} "
+          f"{ms(r['itl_p50'])} {ms(r['itl_p95'])} {ms(r['itl_p99'])} "
+          f"{ms(r['latency_p50'])} {ms(r['latency_p99'])}  {r['errors'] or ''}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", choices=sorted(TARGETS), default="ark")
+    parser.add_argument("-c", "--concurrency", default="1,10,50")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per concurrency level")
+    parser.add_argument("--url", help="base URL of an already running server (skips --spawn)")
+    parser.add_argument("--spawn", action="store_true", help="start mock_ark.py and the target app locally")
+    parser.add_argument("--mock-args", default="--tps 50 --tokens 50 --ttft 0.2", help="extra mock_ark.py arguments")
+    parser.add_argument("--mock-port", type=int, default=9130)
+    parser.add_argument("--port", type=int, default=9131)
+    parser.add_argument("--prompt", default="你好，请介绍一下你自己。")
+    parser.add_argument("--web-search", action="store_true")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    app_path, path = TARGETS[args.target]
+    procs = []
+    if not args.url:
+        if not args.spawn:
+            parser.error("pass --url or --spawn")
+        env = {"ARK_BASE_URL": f"http://127.0.0.1:{args.mock_port}/api/v3", "ARK_API_KEY": "loadtest"}
+        procs.append(spawn(["mock_ark.py", "--port", str(args.mock_port)] + shlex.split(args.mock_args)))
+        procs.append(spawn(["-m", "uvicorn", app_path, "--port", str(args.port), "--log-level", "warning"], env))
+        args.url = f"http://127.0.0.1:{args.port}"
+    results = []
+    try:
+        if procs:
+            await wait_port(f"http://127.0.0.1:{args.mock_port}/docs")
+            await wait_port(f"{args.url}/docs")
+        print(f"target={args.target} url={args.url}{path} duration={args.duration}s/level")
+        print(f"{'conc':>5} {'reqs':>6} {'err':>7} {'rps':>7} {'tok/s':>8} "
+              f"{'ttft50':>8} {'ttft95':>8} {'ttft99':>8} {'itl50':>8} {'itl95':>8} {'itl99':>8} "
+              f"{'lat50':>8} {'lat99':>8}  (ms)")
+        for level in [int(c) for c in args.concurrency.split(",")]:
+            r = await run_level(args.url + path, args, level)
+            results.append(r)
+            print_row(r)
+    finally:
+        for p in procs:
+            p.terminate()
+            p.wait()
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"target": args.target, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
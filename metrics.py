@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Minimal Prometheus-style metrics, rendered in the text exposition format.
+
+Recording a sample is a dict lookup plus an add (and a bisect for
+histograms), so instrumentation can stay on for every request without
+pulling in prometheus_client.
+"""
+
+import inspect
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        return self.header() + [
+            f"{self.name}{_labels(self.label_names, k)} {_number(v)}" for k, v in self._values.items()
+        ]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels, value: float):
+        self._values[labels] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts..., +Inf count, sum]
+        self._values: Dict[Tuple, List[float]] = {}
+
+    def observe(self, *labels, value: float):
+        series = self._values.get(labels)
+        if series is None:
+            series = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for labels, series in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {series[-1]}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], List[str]]] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labels=()) -> Counter:
+        return self.register(Counter(name, documentation, labels))
+
+    def gauge(self, name, documentation, labels=()) -> Gauge:
+        return self.register(Gauge(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def add_collector(self, collector: Callable[[], List[str]]):
+        """Register a callable producing extra exposition lines (or an awaitable of them) at scrape time."""
+        self._collectors.append(collector)
+
+    async def render(self) -> str:
+        # Runs on the event loop, so collectors read component state between its mutations
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            collected = collector()
+            if inspect.isawaitable(collected):
+                collected = await collected
+            lines.extend(collected)
+        return "\n".join(lines) + "\n"
+
+
+def _stat_lines(prefix: str, stats: Optional[Dict[str, float]], documentation: str) -> List[str]:
+    if not stats:
+        return []
+    lines = []
+    for key, value in stats.items():
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        name = f"{prefix}_{key}"
+        lines += [f"# HELP {name} {documentation} ({key})", f"# TYPE {name} gauge", f"{name} {value}"]
+    return lines
+
+
+def stats_collector(prefix: str, source: Callable[[], Dict[str, float]], documentation: str) -> Callable[[], List[str]]:
+    """
+    Expose a component's stats() dict as gauges named <prefix>_<key>. The
+    source may return an awaitable (an astats() that reads shared state off
+    the loop); the collector then returns one too.
+    """
+    def collect():
+        stats = source()
+        if inspect.isawaitable(stats):
+            async def later():
+                return _stat_lines(prefix, await stats, documentation)
+            return later()
+        return _stat_lines(prefix, stats, documentation)
+    return collect
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Local stand-in for the Ark Responses and Chat Completions APIs.
+
+Used by the benchmark and load-test scripts so they can run without
+network access or a real API key. It emits the same streaming event
+sequences as the real service (text deltas, web_search events,
+response.completed with usage, failures) with configurable latency,
+tokens/sec, jitter and failure rates. Point a gateway at it with
+ARK_BASE_URL:
+
+    python mock_ark.py --port 9000 --tps 50 --fail-rate 0.01
+    ARK_BASE_URL=http://127.0.0.1:9000/api/v3 python ark_server.py
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# Tunables, overridable from the command line
+settings = {
+    "tokens": 50,           # deltas per reply
+    "ttft": 0.2,            # seconds before the first delta
+    "token_delay": 0.02,    # seconds between deltas (1 / tokens per second)
+    "jitter": 0.0,          # +/- fraction applied to every delay
+    "prefill": 0.0,         # extra seconds of TTFT per 1k uncached input tokens
+    "search_delay": 0.3,    # seconds spent "searching" when web_search is on
+    "fail_rate": 0.0,       # share of requests rejected with HTTP 500
+    "rate_limit_rate": 0.0, # share of requests rejected with HTTP 429
+    "stream_fail_rate": 0.0,  # share of streams ending in response.failed
+    "model_ttft": {},       # per-model ttft overrides, for hedging tests
+}
+
+app = FastAPI(title="Mock Ark API")
+
+# response id -> context tokens it covers, for previous_response_id chaining
+stored_responses = {}
+
+# Connection counters, read by tests that check upstream cancellation
+stats = {"open_streams": 0, "completed_streams": 0, "aborted_streams": 0}
+
+TOKEN = "tok "
+
+
+def delay(seconds: float) -> float:
+    if settings["jitter"]:
+        seconds *= 1 + random.uniform(-settings["jitter"], settings["jitter"])
+    return max(0.0, seconds)
+
+
+def sse(event: str, data: dict) -> str:
+    data["type"] = event
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def error_response(status: int, code: str, message: str) -> JSONResponse:
+    return JSONResponse(status_code=status, content={"error": {"code": code, "message": message, "type": code}})
+
+
+def injected_failure():
+    """Randomly reject a request according to fail_rate / rate_limit_rate."""
+    roll = random.random()
+    if roll < settings["rate_limit_rate"]:
+        return error_response(429, "RateLimitExceeded", "mock rate limit")
+    if roll < settings["rate_limit_rate"] + settings["fail_rate"]:
+        return error_response(500, "InternalServiceError", "mock upstream failure")
+    return None
+
+
+def count_tokens(items) -> int:
+    """Rough token estimate: one token per 4 characters of text."""
+    if isinstance(items, str):
+        return len(items) // 4 + 1
+    total = 0
+    for item in items:
+        content = item.get("content", [])
+        if isinstance(content, str):
+            total += len(content) // 4 + 1
+            continue
+        for c in content:
+            total += len(c.get("text") or "") // 4 + 1
+    return total
+
+
+def usage(input_tokens: int, cached_tokens: int, n_tokens: int) -> dict:
+    return {
+        "input_tokens": input_tokens,
+        "input_tokens_details": {"cached_tokens": cached_tokens},
+        "output_tokens": n_tokens,
+        "output_tokens_details": {"reasoning_tokens": 0},
+        "total_tokens": input_tokens + n_tokens,
+    }
+
+
+async def tracked(generator):
+    """Count open/finished/aborted upstream streams."""
+    stats["open_streams"] += 1
+    finished = False
+    try:
+        async for item in generator:
+            yield item
+        finished = True
+    finally:
+        stats["open_streams"] -= 1
+        stats["completed_streams" if finished else "aborted_streams"] += 1
+
+
+@app.get("/stats")
+def get_stats():
+    return stats
+
+
+@app.post("/api/v3/responses")
+async def responses(request: Request):
+    body = await request.json()
+    failure = injected_failure()
+    if failure is not None:
+        return failure
+
+    model = body.get("model", "mock-model")
+    response_id = f"resp_{uuid.uuid4().hex}"
+    tokens = settings["tokens"]
+    web_search = any(t.get("type") == "web_search" for t in body.get("tools") or [])
+
+    cached_tokens = 0
+    previous = body.get("previous_response_id")
+    if previous:
+        if previous not in stored_responses:
+            return error_response(404, "NotFound", f"previous response {previous} not found")
+        cached_tokens = stored_responses[previous]
+    input_tokens = cached_tokens + count_tokens(body.get("input", []))
+    if body.get("store"):
+        stored_responses[response_id] = input_tokens + tokens
+    ttft = settings["model_ttft"].get(model, settings["ttft"]) + settings["prefill"] * (input_tokens - cached_tokens) / 1000
+
+    message = {
+        "id": f"msg_{response_id}",
+        "type": "message",
+        "role": "assistant",
+        "status": "completed",
+        "content": [{"type": "output_text", "text": TOKEN * tokens, "annotations": []}],
+    }
+    search_item = {
+        "id": f"ws_{response_id}",
+        "type": "web_search_call",
+        "status": "completed",
+        "action": {"type": "search", "query": "mock search query"},
+    }
+    response_obj = {
+        "id": response_id,
+        "object": "response",
+        "created_at": int(time.time()),
+        "model": model,
+        "status": "completed",
+        "tools": body.get("tools") or [],
+        "output": ([search_item] if web_search else []) + [message],
+        "usage": usage(input_tokens, cached_tokens, tokens),
+    }
+
+    if not body.get("stream"):
+        await asyncio.sleep(delay(ttft + (settings["search_delay"] if web_search else 0) + settings["token_delay"] * tokens))
+        return response_obj
+
+    fail_stream = random.random() < settings["stream_fail_rate"]
+
+    async def generate():
+        yield sse("response.created", {"response": {**response_obj, "status": "in_progress", "output": []}})
+        if web_search:
+            yield sse("response.output_item.added", {"output_index": 0, "item": {**search_item, "status": "in_progress"}})
+            yield sse("response.web_search_call.in_progress", {"output_index": 0, "item_id": search_item["id"]})
+            yield sse("response.web_search_call.searching", {"output_index": 0, "item_id": search_item["id"]})
+            await asyncio.sleep(delay(settings["search_delay"]))
+            yield sse("response.web_search_call.completed", {"output_index": 0, "item_id": search_item["id"]})
+            yield sse("response.output_item.done", {"output_index": 0, "item": search_item})
+        await asyncio.sleep(delay(ttft))
+        output_index = 1 if web_search else 0
+        for i in range(tokens):
+            if fail_stream and i == tokens // 2:
+                failed = {**response_obj, "status": "failed",
+                          "error": {"code": "server_error", "message": "mock generation failure"}}
+                yield sse("response.failed", {"response": failed})
+                return
+            yield sse("response.output_text.delta", {
+                "item_id": message["id"],
+                "output_index": output_index,
+                "content_index": 0,
+                "delta": TOKEN,
+            })
+            await asyncio.sleep(delay(settings["token_delay"]))
+        yield sse("response.output_text.done", {
+            "item_id": message["id"], "output_index": output_index, "content_index": 0, "text": TOKEN * tokens,
+        })
+        yield sse("response.completed", {"response": response_obj})
+
+    return StreamingResponse(tracked(generate()), media_type="text/event-stream")
+
+
+@app.post("/api/v3/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    failure = injected_failure()
+    if failure is not None:
+        return failure
+
+    model = body.get("model", "mock-model")
+    completion_id = f"chatcmpl_{uuid.uuid4().hex}"
+    created = int(time.time())
+    tokens = settings["tokens"]
+    input_tokens = count_tokens(body.get("messages", []))
+    usage_obj = {"prompt_tokens": input_tokens, "completion_tokens": tokens, "total_tokens": input_tokens + tokens}
+
+    if not body.get("stream"):
+        await asyncio.sleep(delay(settings["ttft"] + settings["token_delay"] * tokens))
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": TOKEN * tokens},
+            }],
+            "usage": usage_obj,
+        }
+
+    def chunk(delta: dict, finish_reason=None, usage_data=None) -> str:
+        data = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+        if usage_data:
+            data["usage"] = usage_data
+        return f"data: {json.dumps(data)}\n\n"
+
+    async def generate():
+        await asyncio.sleep(delay(settings["ttft"]))
+        yield chunk({"role": "assistant", "content": ""})
+        for _ in range(tokens):
+            yield chunk({"content": TOKEN})
+            await asyncio.sleep(delay(settings["token_delay"]))
+        yield chunk({}, finish_reason="stop", usage_data=usage_obj)
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(tracked(generate()), media_type="text/event-stream")
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Mock Ark Responses / Chat Completions API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--tokens", type=int, default=settings["tokens"])
+    parser.add_argument("--ttft", type=float, default=settings["ttft"])
+    parser.add_argument("--token-delay", type=float, default=settings["token_delay"])
+    parser.add_argument("--tps", type=float, help="tokens per second per stream (overrides --token-delay)")
+    parser.add_argument("--jitter", type=float, default=settings["jitter"])
+    parser.add_argument("--prefill", type=float, default=settings["prefill"])
+    parser.add_argument("--search-delay", type=float, default=settings["search_delay"])
+    parser.add_argument("--fail-rate", type=float, default=settings["fail_rate"])
+    parser.add_argument("--rate-limit-rate", type=float, default=settings["rate_limit_rate"])
+    parser.add_argument("--stream-fail-rate", type=float, default=settings["stream_fail_rate"])
+    parser.add_argument("--model-ttft", action="append", default=[], metavar="MODEL=SECONDS",
+                        help="ttft for one model (repeatable)")
+    args = parser.parse_args()
+    settings.update(
+        tokens=args.tokens,
+        ttft=args.ttft,
+        token_delay=1 / args.tps if args.tps else args.token_delay,
+        jitter=args.jitter,
+        prefill=args.prefill,
+        search_delay=args.search_delay,
+        fail_rate=args.fail_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        stream_fail_rate=args.stream_fail_rate,
+        model_ttft={m: float(t) for m, t in (item.split("=", 1) for item in args.model_ttft)},
+    )
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Token bucket for request and token rate limits.
+
+acquire() waits until the bucket can cover a cost; charge() debits usage
+after the fact (the bucket may go into debt), which is how estimated
+token costs are settled against the real usage reported upstream.
+SharedTokenBucket keeps the level in a shared_state.SharedState so every
+worker process draws from the same bucket; from the event loop use
+atry_acquire(), and its charges are written in the background.
+"""
+
+import asyncio
+import time
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float = None):
+        """rate: units per second; capacity: burst size (defaults to one second of rate)."""
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, cost: float = 1.0) -> bool:
+        self._refill()
+        # A cost larger than the burst size is admitted once the bucket is full
+        if self.tokens >= min(cost, self.capacity):
+            self.tokens -= cost
+            return True
+        return False
+
+    async def atry_acquire(self, cost: float = 1.0) -> bool:
+        return self.try_acquire(cost)
+
+    def retry_after(self, cost: float = 1.0) -> float:
+        """Seconds until try_acquire(cost) could succeed."""
+        self._refill()
+        missing = min(cost, self.capacity) - self.tokens
+        return max(0.0, missing / self.rate)
+
+    async def acquire(self, cost: float = 1.0):
+        while not self.try_acquire(cost):
+            await asyncio.sleep(max(self.retry_after(cost), 0.001))
+
+    def charge(self, cost: float):
+        """Debit (or refund, if negative) without waiting."""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - cost)
+
+    def available(self) -> float:
+        self._refill()
+        return self.tokens
+
+
+class SharedTokenBucket:
+    """TokenBucket whose level lives in a SharedState, so all workers draw from one bucket."""
+
+    def __init__(self, state, name: str, rate: float, capacity: float = None):
+        self.state = state
+        self.name = name
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        # Level seen by the last take, so retry_after() needs no second round trip
+        self.level = self.capacity
+
+    def try_acquire(self, cost: float = 1.0) -> bool:
+        taken, self.level = self.state.take(self.name, cost, self.rate, self.capacity)
+        return taken
+
+    async def atry_acquire(self, cost: float = 1.0) -> bool:
+        """try_acquire() on the store's threads: BEGIN IMMEDIATE may wait for another worker."""
+        return await self.state.run(self.try_acquire, cost)
+
+    def retry_after(self, cost: float = 1.0) -> float:
+        missing = min(cost, self.capacity) - self.level
+        return max(0.0, missing / self.rate)
+
+    async def acquire(self, cost: float = 1.0):
+        while not await self.atry_acquire(cost):
+            await asyncio.sleep(max(self.retry_after(cost), 0.001))
+
+    def charge(self, cost: float):
+        # Settling never changes a decision already made, so nothing waits for the write
+        self.state.submit(self.state.take, self.name, cost, self.rate, self.capacity, True)
+
+    def available(self) -> float:
+        # A zero-cost take refills and reports the level without debiting
+        return self.state.take(self.name, 0.0, self.rate, self.capacity)[1]
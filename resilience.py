@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Retries and circuit breaking around upstream Ark calls.
+
+Errors are classified as retryable (timeouts, connection failures, 408,
+409, 429, 5xx) or fatal. Retryable failures are retried with full-jitter
+exponential backoff; callers only wrap calls that happen before anything
+has been sent to the client. A per-model circuit breaker opens after a run
+of upstream failures, fails fast while open, and probes recovery in the
+background (or lets a single trial request through when no probe is set).
+"""
+
+import asyncio
+import random
+import time
+from typing import Awaitable, Callable, Dict, Iterable, Optional
+
+import httpx
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+RETRYABLE_STATUS = {408, 409, 429}
+
+
+class CircuitOpen(Exception):
+    def __init__(self, model: str, retry_after: float):
+        super().__init__(f"Upstream for {model} is unavailable, circuit breaker open")
+        self.retry_after = retry_after
+
+
+def is_retryable(e: BaseException) -> bool:
+    status = getattr(e, "status_code", None)
+    if status is not None:
+        return status in RETRYABLE_STATUS or status >= 500
+    if isinstance(e, (httpx.TimeoutException, httpx.TransportError, asyncio.TimeoutError, ConnectionError)):
+        return True
+    # The SDK wraps transport failures in its own (private) exception classes
+    return any(cls.__name__ == "ArkAPIConnectionError" for cls in type(e).__mro__)
+
+
+def server_retry_after(e: BaseException) -> Optional[float]:
+    response = getattr(e, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
+class CircuitBreaker:
+    def __init__(self, model: str, failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 probe: Optional[Callable[[], Awaitable]] = None):
+        self.model = model
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.probe = probe
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.opened_total = 0
+        self.rejected = 0
+        self._trial = False
+        self._probe_task: Optional[asyncio.Task] = None
+
+    def check(self) -> bool:
+        """
+        Raise CircuitOpen unless a call may go upstream now. Returns True when
+        the call is the half-open trial; the caller must end_trial() however it ends.
+        """
+        if self.state == CLOSED:
+            return False
+        if self.state == OPEN and self.probe is None and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = HALF_OPEN
+        if self.state == HALF_OPEN and not self._trial:
+            self._trial = True
+            return True
+        self.rejected += 1
+        raise CircuitOpen(self.model, max(1.0, self.opened_at + self.reset_timeout - time.monotonic()))
+
+    def end_trial(self):
+        # A trial that was cancelled (or rate limited) decided nothing: let the next call try
+        self._trial = False
+
+    def record_success(self):
+        self.failures = 0
+        self._trial = False
+        if self.state != CLOSED:
+            print(f"Circuit breaker for {self.model} closed")
+        self.state = CLOSED
+
+    def record_failure(self):
+        self.failures += 1
+        self._trial = False
+        if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+            self._open()
+
+    def _open(self):
+        if self.state != OPEN:
+            print(f"Circuit breaker for {self.model} opened after {self.failures} failures")
+            self.opened_total += 1
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        if self.probe is not None and (self._probe_task is None or self._probe_task.done()):
+            self._probe_task = asyncio.create_task(self._probe_loop())
+
+    async def _probe_loop(self):
+        delay = self.reset_timeout
+        while self.state == OPEN:
+            await asyncio.sleep(delay)
+            try:
+                await self.probe()
+            except Exception as e:
+                print(f"Circuit breaker probe for {self.model} failed: {e}")
+                self.opened_at = time.monotonic()
+                delay = min(delay * 2, self.reset_timeout * 8)
+                continue
+            self.record_success()
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "opened_total": self.opened_total,
+            "rejected": self.rejected,
+            "open_for": round(time.monotonic() - self.opened_at, 1) if self.state != CLOSED else 0,
+        }
+
+    def close(self):
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+
+
+# Breaker shared by every model that is not configured
+OTHER_MODELS = "other"
+
+
+class Resilience:
+    """
+    Retry policy plus one circuit breaker per configured model. Models a
+    client names that are not configured share one breaker (without a
+    probe), so arbitrary model names cannot grow the breaker table.
+    """
+
+    def __init__(self, attempts: int = 3, base_delay: float = 0.2, max_delay: float = 5.0,
+                 failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 probe_factory: Optional[Callable[[str], Callable[[], Awaitable]]] = None,
+                 models: Optional[Iterable[str]] = None):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.probe_factory = probe_factory
+        self.models = set(models) if models is not None else None
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.retries = 0
+
+    def breaker(self, model: str) -> CircuitBreaker:
+        if self.models is not None and model not in self.models:
+            model = OTHER_MODELS
+        breaker = self.breakers.get(model)
+        if breaker is None:
+            probe = self.probe_factory(model) if self.probe_factory and model != OTHER_MODELS else None
+            breaker = self.breakers[model] = CircuitBreaker(model, self.failure_threshold, self.reset_timeout, probe)
+        return breaker
+
+    def backoff(self, attempt: int, e: BaseException) -> float:
+        hinted = server_retry_after(e)
+        if hinted is not None:
+            return min(hinted, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def call(self, model: str, fn: Callable[[], Awaitable]):
+        """Run fn() with retries, failing fast while the model's breaker is open."""
+        breaker = self.breaker(model)
+        for attempt in range(self.attempts):
+            trial = breaker.check()
+            try:
+                result = await fn()
+            except Exception as e:
+                retryable = is_retryable(e)
+                # Rate limiting means busy, not broken: retry it but leave the breaker alone
+                if getattr(e, "status_code", None) == 429:
+                    pass
+                elif retryable:
+                    breaker.record_failure()
+                else:
+                    # The upstream answered (e.g. 400), so it is reachable
+                    breaker.record_success()
+                if not retryable or attempt == self.attempts - 1:
+                    raise
+                self.retries += 1
+                delay = self.backoff(attempt, e)
+                print(f"Upstream call for {model} failed ({type(e).__name__}), retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+                continue
+            finally:
+                # CancelledError (hedge loser, client gone) is not an Exception and records nothing
+                if trial:
+                    breaker.end_trial()
+            breaker.record_success()
+            return result
+
+    def stats(self) -> dict:
+        return {
+            "retries": self.retries,
+            "breakers": {model: breaker.stats() for model, breaker in self.breakers.items()},
+        }
+
+    def close(self):
+        for breaker in self.breakers.values():
+            breaker.close()
+
+
+def from_config(config, probe_factory=None, models: Optional[Iterable[str]] = None) -> Optional[Resilience]:
+    """Build the retry/breaker layer from the [RESILIENCE] section, or None when disabled."""
+    if not config.getboolean("RESILIENCE", "enabled", fallback=True):
+        return None
+    return Resilience(
+        attempts=config.getint("RESILIENCE", "attempts", fallback=3),
+        base_delay=config.getfloat("RESILIENCE", "base_delay", fallback=0.2),
+        max_delay=config.getfloat("RESILIENCE", "max_delay", fallback=5.0),
+        failure_threshold=config.getint("RESILIENCE", "failure_threshold", fallback=5),
+        reset_timeout=config.getfloat("RESILIENCE", "reset_timeout", fallback=30.0),
+        probe_factory=probe_factory if config.getboolean("RESILIENCE", "probe", fallback=True) else None,
+        models=models,
+    )
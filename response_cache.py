@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Opt-in cache for finished chat answers.
+
+Entries are keyed by a canonical hash of everything that determines the
+upstream generation (model id, normalized input, tools, web_search). The
+in-memory layer is bounded by size and evicts by LRU/TTL; an optional
+SQLite file (shared_state.SharedState) keeps entries across restarts and
+shares them between worker processes.
+"""
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from shared_state import SharedState
+
+
+def cache_key(*parts: Any) -> str:
+    """Canonical SHA-256 of JSON-serializable request parts."""
+    canonical = json.dumps(parts, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, ttl: float = 3600.0, db_path: Optional[str] = None,
+                 shared: Optional[SharedState] = None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (expires_at, size, value)
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # backend.py calls in from threadpool workers
+        self._lock = threading.Lock()
+        self._shared = shared if shared is not None else (SharedState(db_path) if db_path else None)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._get(key)
+
+    def _get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, size, value = entry
+            if expires_at > time.time():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            self._remove(key)
+
+        if self._shared is not None:
+            # Written by an earlier run or by another worker process
+            entry = self._shared.get_entry("cache", key)
+            if entry:
+                encoded, expires_at = entry
+                value = json.loads(encoded)
+                self._store(key, value, expires_at, len(encoded))
+                self.hits += 1
+                return value
+
+        self.misses += 1
+        return None
+
+    async def aget(self, key: str) -> Optional[Dict[str, Any]]:
+        """get() for the event loop: with a shared file the lookup runs on its threads."""
+        if self._shared is None:
+            return self.get(key)
+        return await self._shared.run(self.get, key)
+
+    async def aset(self, key: str, value: Dict[str, Any]):
+        if self._shared is None:
+            return self.set(key, value)
+        await self._shared.run(self.set, key, value)
+
+    def set(self, key: str, value: Dict[str, Any]):
+        encoded = json.dumps(value, ensure_ascii=False)
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._set(key, value, encoded, expires_at)
+
+    def _set(self, key: str, value: Dict[str, Any], encoded: str, expires_at: float):
+        self._store(key, value, expires_at, len(encoded))
+        if self._shared is not None:
+            self._shared.set("cache", key, encoded, expires_at - time.time())
+
+    def _store(self, key: str, value: Dict[str, Any], expires_at: float, size: int):
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (expires_at, size, value)
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key: str):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+def from_config(config, shared: Optional[SharedState] = None) -> Optional[ResponseCache]:
+    """Build the cache from the [CACHE] section, or None when it is not enabled."""
+    if not config.getboolean("CACHE", "enabled", fallback=False):
+        return None
+    return ResponseCache(
+        max_bytes=config.getint("CACHE", "max_mb", fallback=64) * 1024 * 1024,
+        ttl=config.getfloat("CACHE", "ttl", fallback=3600.0),
+        db_path=config.get("CACHE", "db_path", fallback=None) or None,
+        shared=shared,
+    )
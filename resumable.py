@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Resumable SSE streams.
+
+A streamed answer is encoded in its own task instead of inside the HTTP
+response, and every frame gets an id `<stream>:<seq>` with seq counting
+up from 1. The frames are kept in a bounded ring buffer per stream, so a
+client whose connection drops can reconnect with `Last-Event-ID` and get
+the frames it missed followed by the live tail, without a new upstream
+call. After the last reader goes away the stream keeps running for
+`linger` seconds waiting for a reconnect, then the upstream work is
+cancelled; a finished stream stays resumable for `retain` seconds.
+"""
+
+import asyncio
+import secrets
+import time
+from collections import OrderedDict, deque
+from typing import AsyncIterator, Dict, Optional, Tuple
+
+import sse
+
+
+class ResumableStream:
+    """One encoded stream with a replay buffer of its latest frames."""
+
+    def __init__(self, stream_id: str, max_frames: int, linger: float):
+        self.id = stream_id
+        self.frames = deque(maxlen=max_frames)  # (seq, encoded frame)
+        self.last_seq = 0
+        self.finished = False
+        self.finished_at = None
+        self.error = None
+        self.subscribers = 0
+        self.abandoned = False
+        self.linger = linger
+        self._changed = asyncio.Event()
+        self._linger_timer = None
+        self._task = None
+
+    def frame(self, event: Dict) -> str:
+        # Called by sse.encode for every frame it writes
+        self.last_seq += 1
+        text = f"id: {self.id}:{self.last_seq}\ndata: {sse.dumps(event)}\n\n"
+        self.frames.append((self.last_seq, text))
+        self._wake()
+        return text
+
+    def start(self, events: AsyncIterator[Dict], window: float, max_bytes: int):
+        self._task = asyncio.create_task(self._pump(events, window, max_bytes))
+
+    async def _pump(self, events: AsyncIterator[Dict], window: float, max_bytes: int):
+        try:
+            # The encoded chunks are only needed for their side effect on the buffer
+            async for _ in sse.encode(events, window=window, max_bytes=max_bytes, frame=self.frame):
+                pass
+        except Exception as e:
+            # Re-raised in every reader once the buffered frames are out
+            self.error = e
+        finally:
+            self.finished = True
+            self.finished_at = time.monotonic()
+            self._wake()
+
+    def _wake(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def can_resume(self, after: int) -> bool:
+        """Whether every frame after seq `after` is still buffered."""
+        if after > self.last_seq:
+            return False
+        first = self.frames[0][0] if self.frames else self.last_seq + 1
+        return after + 1 >= first
+
+    async def subscribe(self, after: int = 0) -> AsyncIterator[str]:
+        """Frames after seq `after`, then the live tail, then [DONE]."""
+        self.subscribers += 1
+        if self._linger_timer is not None:
+            self._linger_timer.cancel()
+            self._linger_timer = None
+        try:
+            while True:
+                if self.frames and self.frames[-1][0] > after:
+                    # Everything pending goes out as one write, collected from the newest end
+                    pending = []
+                    for seq, text in reversed(self.frames):
+                        if seq <= after:
+                            break
+                        pending.append(text)
+                    after = self.frames[-1][0]
+                    yield "".join(reversed(pending))
+                    continue
+                if self.finished:
+                    if self.error is not None:
+                        raise self.error
+                    yield sse.DONE
+                    return
+                await self._changed.wait()
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self.finished:
+                # Give the client a chance to reconnect before dropping the upstream work
+                self._linger_timer = asyncio.get_running_loop().call_later(self.linger, self._abandon)
+
+    def _abandon(self):
+        self._linger_timer = None
+        if self.subscribers == 0 and not self.finished:
+            self.abandoned = True
+            self._task.cancel()
+
+
+def parse_event_id(value: str) -> Optional[Tuple[str, int]]:
+    """`<stream>:<seq>` -> (stream, seq), or None if malformed."""
+    stream_id, _, seq = value.strip().rpartition(":")
+    if not stream_id or not seq.isdigit():
+        return None
+    return stream_id, int(seq)
+
+
+class ResumeRegistry:
+    def __init__(self, max_streams: int = 1000, max_frames: int = 4096, linger: float = 30.0,
+                 retain: float = 120.0):
+        self.max_streams = max_streams
+        self.max_frames = max_frames
+        self.linger = linger
+        self.retain = retain
+        self._streams: "OrderedDict[str, ResumableStream]" = OrderedDict()
+        self.started = 0
+        self.resumed = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def open(self, events: AsyncIterator[Dict], window: float = 0.0, max_bytes: int = 2048) -> ResumableStream:
+        """Start encoding `events` into a new resumable stream."""
+        self._purge()
+        stream = ResumableStream(secrets.token_urlsafe(12), self.max_frames, self.linger)
+        stream.start(events, window, max_bytes)
+        self._streams[stream.id] = stream
+        self.started += 1
+        return stream
+
+    def resume(self, last_event_id: str) -> Optional[AsyncIterator[str]]:
+        """Frames after Last-Event-ID and the live tail, or None if they can no longer be replayed."""
+        self._purge()
+        parsed = parse_event_id(last_event_id)
+        stream = self._streams.get(parsed[0]) if parsed else None
+        if stream is None or stream.abandoned or not stream.can_resume(parsed[1]):
+            self.expired += 1
+            return None
+        self.resumed += 1
+        return stream.subscribe(parsed[1])
+
+    def _purge(self):
+        now = time.monotonic()
+        for stream_id, stream in list(self._streams.items()):
+            if stream.abandoned or (stream.finished and now - stream.finished_at > self.retain):
+                del self._streams[stream_id]
+        # Over the bound the oldest streams stop being resumable (readers still attached keep reading)
+        while len(self._streams) > self.max_streams:
+            self._streams.popitem(last=False)
+            self.evicted += 1
+
+    def stats(self) -> dict:
+        return {
+            "streams": len(self._streams),
+            "live": sum(1 for s in self._streams.values() if not s.finished),
+            "buffered_frames": sum(len(s.frames) for s in self._streams.values()),
+            "started": self.started,
+            "resumed": self.resumed,
+            "expired": self.expired,
+            "evicted": self.evicted,
+        }
+
+
+def from_config(config) -> Optional[ResumeRegistry]:
+    """Build the registry from the [RESUME] section, or None to stream without event ids."""
+    if not config.getboolean("RESUME", "enabled", fallback=False):
+        return None
+    return ResumeRegistry(
+        max_streams=config.getint("RESUME", "max_streams", fallback=1000),
+        max_frames=config.getint("RESUME", "max_frames", fallback=4096),
+        linger=config.getfloat("RESUME", "linger", fallback=30.0),
+        retain=config.getfloat("RESUME", "retain", fallback=120.0),
+    )
@@ -0,0 +1,16 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Configuration shared by the gateway modules: config.ini (or the file named
+by $ARK_CONFIG) plus the ARK_API_KEY / ARK_BASE_URL environment overrides.
+"""
+
+import configparser
+import os
+
+config = configparser.ConfigParser()
+config.read(os.getenv("ARK_CONFIG", "config.ini"))
+
+api_key = os.getenv("ARK_API_KEY") or config.get("ARK", "api_key", fallback=None)
+base_url = os.getenv("ARK_BASE_URL") or config.get("ARK", "base_url", fallback="https://ark.cn-beijing.volces.com/api/v3")
+MODEL_ID = config.get("ARK", "model_id", fallback="doubao-seed-1-8-251228")
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+State shared by all worker processes on one machine.
+
+With `uvicorn --workers N` every process has its own memory, so caches,
+conversation chains, uploaded images and rate-limit buckets would split N
+ways. SharedState keeps them in one SQLite file in WAL mode instead:
+readers never block, writers serialize on a short lock, and no external
+service is needed. Components take an optional `shared` argument and keep
+their in-process structures when it is None.
+
+Values are stored as given (str or bytes); callers do their own encoding.
+A lock wait (busy_timeout) or a multi-MB image write must not stall the
+event loop, so async callers go through run(), which executes the call on
+a small thread pool owned by the store.
+"""
+
+import asyncio
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Optional, Tuple, Union
+
+Value = Union[str, bytes]
+
+# Expired rows are deleted every this many writes
+PURGE_EVERY = 1000
+
+
+class SharedState:
+    def __init__(self, path: str, busy_timeout: float = 5.0, threads: int = 4):
+        self.path = path
+        # isolation_level=None: autocommit, explicit BEGIN IMMEDIATE where read-modify-write must be atomic
+        self._db = sqlite3.connect(path, timeout=busy_timeout, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS kv ("
+            "ns TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL, expires_at REAL NOT NULL, "
+            "PRIMARY KEY (ns, key)) WITHOUT ROWID"
+        )
+        self._db.execute("CREATE TABLE IF NOT EXISTS buckets (name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)")
+        # One connection per process, used from the event loop and from threadpool workers
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="shared-state")
+        self._writes = 0
+        self.purge()
+
+    async def run(self, fn: Callable, *args):
+        """Await fn(*args) (a call that touches the file) on the store's threads."""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def submit(self, fn: Callable, *args) -> Future:
+        """Run fn(*args) on the store's threads without waiting for it."""
+        return self._executor.submit(fn, *args)
+
+    # Key/value entries with expiry
+
+    def get(self, ns: str, key: str) -> Optional[Value]:
+        entry = self.get_entry(ns, key)
+        return entry[0] if entry else None
+
+    def get_entry(self, ns: str, key: str) -> Optional[Tuple[Value, float]]:
+        """(value, expires_at) of a live entry."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value, expires_at FROM kv WHERE ns = ? AND key = ? AND expires_at > ?", (ns, key, time.time())
+            ).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def set(self, ns: str, key: str, value: Value, ttl: float):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO kv (ns, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                (ns, key, value, time.time() + ttl),
+            )
+            self._wrote()
+
+    def add(self, ns: str, key: str, value: Value, ttl: float) -> bool:
+        """Store value unless a live entry exists; True if it was stored."""
+        now = time.time()
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO kv (ns, key, value, expires_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (ns, key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at "
+                "WHERE kv.expires_at <= ?",
+                (ns, key, value, now + ttl, now),
+            )
+            self._wrote()
+            return cursor.rowcount > 0
+
+    def delete(self, ns: str, key: str):
+        with self._lock:
+            self._db.execute("DELETE FROM kv WHERE ns = ? AND key = ?", (ns, key))
+
+    def usage(self, ns: str) -> Tuple[int, int]:
+        """(live entries, bytes) in a namespace."""
+        with self._lock:
+            count, size = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(value)), 0) FROM kv WHERE ns = ? AND expires_at > ?", (ns, time.time())
+            ).fetchone()
+        return count, size
+
+    def trim(self, ns: str, max_bytes: int) -> int:
+        """Delete the oldest entries of a namespace until it fits in max_bytes; returns how many went."""
+        with self._lock:
+            cursor = self._db.execute(
+                "DELETE FROM kv WHERE ns = ? AND key IN ("
+                "SELECT key FROM (SELECT key, SUM(LENGTH(value)) OVER (ORDER BY expires_at DESC, key) AS total "
+                "FROM kv WHERE ns = ?) WHERE total > ?)",
+                (ns, ns, max_bytes),
+            )
+        return cursor.rowcount
+
+    def purge(self):
+        with self._lock:
+            self._db.execute("DELETE FROM kv WHERE expires_at <= ?", (time.time(),))
+
+    def _wrote(self):
+        # Called with the lock held
+        self._writes += 1
+        if self._writes % PURGE_EVERY == 0:
+            self._db.execute("DELETE FROM kv WHERE expires_at <= ?", (time.time(),))
+
+    # Token buckets (see rate_limit.SharedTokenBucket)
+
+    def take(self, name: str, cost: float, rate: float, capacity: float, force: bool = False) -> Tuple[bool, float]:
+        """
+        Atomically refill the bucket and debit cost if it covers min(cost, capacity).
+        Returns (taken, tokens left). force=True always debits, letting the bucket go into debt
+        (a negative cost refunds).
+        """
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                row = self._db.execute("SELECT tokens, updated FROM buckets WHERE name = ?", (name,)).fetchone()
+                tokens = capacity if row is None else min(capacity, row[0] + max(0.0, now - row[1]) * rate)
+                taken = force or tokens >= min(cost, capacity)
+                if taken:
+                    tokens = min(capacity, tokens - cost)
+                self._db.execute("INSERT OR REPLACE INTO buckets (name, tokens, updated) VALUES (?, ?, ?)", (name, tokens, now))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return taken, tokens
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            self._db.close()
+
+
+def from_config(config) -> Optional[SharedState]:
+    """Open the shared store from the [SHARED] section, or None to keep state per process."""
+    backend = config.get("SHARED", "backend", fallback="memory").strip().lower()
+    if backend == "memory":
+        return None
+    if backend != "sqlite":
+        raise ValueError(f"Unknown SHARED.backend {backend!r} (expected memory or sqlite)")
+    return SharedState(
+        config.get("SHARED", "path", fallback="ark_state.db"),
+        busy_timeout=config.getfloat("SHARED", "busy_timeout", fallback=5.0),
+        threads=config.getint("SHARED", "threads", fallback=4),
+    )
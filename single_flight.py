@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Single-flight coalescing of identical in-flight requests.
+
+The first request for a key starts the upstream work; identical requests
+arriving while it runs attach to it instead of starting their own. Streams
+go through a Broadcast that buffers every event, so a late joiner first
+replays what was already produced and then follows the live tail.
+"""
+
+import asyncio
+from typing import AsyncIterator, Awaitable, Callable, Dict, Tuple
+
+
+class Broadcast:
+    """Runs one event source in its own task and fans it out to subscribers."""
+
+    def __init__(self, source: AsyncIterator, on_done: Callable[[], None]):
+        self.buffer = []
+        self.finished = False
+        self.error = None
+        self.subscribers = 0
+        self._changed = asyncio.Event()
+        self._on_done = on_done
+        self._task = asyncio.create_task(self._pump(source))
+
+    async def _pump(self, source: AsyncIterator):
+        try:
+            async for event in source:
+                self.buffer.append(event)
+                self._wake()
+        except Exception as e:
+            # Re-raised in every subscriber once the buffered events are out
+            self.error = e
+        finally:
+            self.finished = True
+            self._on_done()
+            self._wake()
+
+    def _wake(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def subscribe(self):
+        self.subscribers += 1
+        sent = 0
+        try:
+            while True:
+                while sent < len(self.buffer):
+                    yield self.buffer[sent]
+                    sent += 1
+                if self.finished:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                await self._changed.wait()
+        finally:
+            self.subscribers -= 1
+            # Nobody is listening any more: stop the upstream work
+            if self.subscribers == 0 and not self.finished:
+                self._task.cancel()
+
+
+class SingleFlight:
+    def __init__(self):
+        self._streams: Dict[str, Broadcast] = {}
+        self._calls: Dict[str, asyncio.Task] = {}
+        self.leaders = 0
+        self.joined = 0
+
+    def stream(self, key: str, factory: Callable[[], AsyncIterator]) -> Tuple[AsyncIterator, bool]:
+        """Subscribe to the stream for key, starting factory() if none is in flight.
+
+        Returns (events, joined); joined is False for the request that started it.
+        """
+        flight = self._streams.get(key)
+        joined = flight is not None
+        if joined:
+            self.joined += 1
+        else:
+            self.leaders += 1
+            flight = Broadcast(factory(), lambda: self._streams.pop(key, None))
+            self._streams[key] = flight
+        return flight.subscribe(), joined
+
+    async def call(self, key: str, factory: Callable[[], Awaitable]) -> Tuple[object, bool]:
+        """Await the shared result for key, starting factory() if none is in flight."""
+        task = self._calls.get(key)
+        joined = task is not None
+        if joined:
+            self.joined += 1
+        else:
+            self.leaders += 1
+            task = asyncio.create_task(factory())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._calls.pop(key) if self._calls.get(key) is t else None)
+        # A caller going away must not cancel the work others are waiting on
+        return await asyncio.shield(task), joined
+
+    def stats(self) -> dict:
+        return {
+            "in_flight_streams": len(self._streams),
+            "in_flight_calls": len(self._calls),
+            "leaders": self.leaders,
+            "joined": self.joined,
+        }
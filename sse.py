@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SSE framing for /api/chat.
+
+Events are plain dicts (``{'content': ...}``, ``{'usage': ...}``,
+``{'error': ...}``, ``{'type': 'searching', ...}``). ``encode()`` turns a
+stream of them into ``data: ...`` frames terminated by ``data: [DONE]``,
+optionally merging consecutive content deltas that arrive within a short
+window so a reply is not written one token at a time.
+"""
+
+import asyncio
+import json
+from typing import AsyncIterator, Callable, Dict, List
+
+try:
+    import orjson
+
+    def dumps(obj) -> str:
+        return orjson.dumps(obj).decode("utf-8")
+except ImportError:  # pragma: no cover - optional speedup
+    def dumps(obj) -> str:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+DONE = "data: [DONE]\n\n"
+
+
+def frame(event: Dict) -> str:
+    return f"data: {dumps(event)}\n\n"
+
+
+def _merge(events: List[Dict], frame: Callable[[Dict], str] = frame) -> str:
+    """Encode buffered events, joining runs of content deltas into one frame."""
+    out = []
+    text = []
+    for event in events:
+        if len(event) == 1 and "content" in event:
+            text.append(event["content"])
+            continue
+        if text:
+            out.append(frame({"content": "".join(text)}))
+            text = []
+        out.append(frame(event))
+    if text:
+        out.append(frame({"content": "".join(text)}))
+    return "".join(out)
+
+
+async def encode(events: AsyncIterator[Dict], window: float = 0.0, max_bytes: int = 2048,
+                 frame: Callable[[Dict], str] = frame) -> AsyncIterator[str]:
+    """
+    Encode events as SSE frames.
+
+    With window > 0, deltas are buffered and flushed every ``window``
+    seconds or once ``max_bytes`` of text is pending. The first content
+    delta is always sent immediately so time-to-first-token is unchanged,
+    and other event types keep their position relative to the text.
+    ``frame`` formats one event (resumable.py uses it to attach ids).
+    """
+    if window <= 0:
+        async for event in events:
+            yield frame(event)
+        yield DONE
+        return
+
+    buffer: List[Dict] = []
+    state = {"bytes": 0, "finished": False, "error": None}
+    ready = asyncio.Event()
+    urgent = asyncio.Event()
+    first_sent = asyncio.Event()
+
+    async def produce():
+        try:
+            async for event in events:
+                buffer.append(event)
+                content = event.get("content")
+                if content is None or not first_sent.is_set():
+                    urgent.set()
+                else:
+                    state["bytes"] += len(content)
+                    if state["bytes"] >= max_bytes:
+                        urgent.set()
+                ready.set()
+        except Exception as e:
+            state["error"] = e
+        finally:
+            state["finished"] = True
+            urgent.set()
+            ready.set()
+
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            await ready.wait()
+            if not urgent.is_set():
+                try:
+                    await asyncio.wait_for(urgent.wait(), timeout=window)
+                except asyncio.TimeoutError:
+                    pass
+            ready.clear()
+            urgent.clear()
+            pending = buffer[:]
+            del buffer[:]
+            state["bytes"] = 0
+            if pending:
+                if any("content" in e for e in pending):
+                    first_sent.set()
+                yield _merge(pending, frame)
+            if state["finished"] and not buffer:
+                break
+        if state["error"] is not None:
+            raise state["error"]
+        yield DONE
+    finally:
+        producer.cancel()
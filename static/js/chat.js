@@ -1,8 +1,14 @@
+const API_BASE = "http://localhost:8000";
 const LS_KEY = "ark_chat_conversations";
 const LS_SETTINGS_KEY = "ark_chat_settings";
+const LS_CLIENT_KEY = "ark_chat_client_id";
+const PAGE_SIZE = 50;
+// true when the server keeps the history (/api/conversations); otherwise it stays in localStorage
+let serverStore = false;
+let conversationsCursor = null;
 let conversations = [];
 let currentId = null;
-let pendingImages = []; // Store base64 images
+let pendingImages = []; // { url, id } — id is set once the image is uploaded to the server store
 let settings = { systemPrompt: "", apiKey: "", modelId: "" };
 let webSearchEnabled = false;
 
@@ -41,16 +47,132 @@ function saveSettings() {
 function uid() {
   return Math.random().toString(36).slice(2) + Date.now().toString(36);
 }
-function loadConversations() {
+function clientId() {
+  let id = localStorage.getItem(LS_CLIENT_KEY);
+  if (!id) {
+    id = uid() + uid();
+    localStorage.setItem(LS_CLIENT_KEY, id);
+  }
+  return id;
+}
+async function api(path, options = {}) {
+  const resp = await fetch(`${API_BASE}${path}`, {
+    ...options,
+    headers: { "Content-Type": "application/json", "X-Client-Id": clientId() }
+  });
+  if (!resp.ok) throw new Error("HTTP " + resp.status);
+  return resp.status === 204 ? null : resp.json();
+}
+function readLocalConversations() {
   try {
-    conversations = JSON.parse(localStorage.getItem(LS_KEY) || "[]");
+    return JSON.parse(localStorage.getItem(LS_KEY) || "[]");
   } catch {
-    conversations = [];
+    return [];
+  }
+}
+async function loadConversations() {
+  try {
+    await migrateLocalConversations();
+    const page = await api(`/api/conversations?limit=${PAGE_SIZE}`);
+    serverStore = true;
+    conversationsCursor = page.next;
+    // Messages are fetched when a conversation is opened
+    conversations = page.items.map(c => ({ ...c, messages: null, hasMore: true }));
+  } catch {
+    serverStore = false;
+    conversations = readLocalConversations();
+  }
+}
+async function loadMoreConversations() {
+  if (!conversationsCursor) return;
+  const page = await api(`/api/conversations?limit=${PAGE_SIZE}&before=${conversationsCursor}`);
+  conversationsCursor = page.next;
+  conversations.push(...page.items.map(c => ({ ...c, messages: null, hasMore: true })));
+  renderConversationList();
+}
+// One-time move of the history that used to live in localStorage
+async function migrateLocalConversations() {
+  const local = readLocalConversations();
+  if (!local.length) return;
+  // Oldest first so the server lists them in the same order
+  for (const c of local.slice().reverse()) {
+    const created = c.messages.length ? c.messages[0].created : Date.now();
+    try {
+      await api("/api/conversations", {
+        method: "POST",
+        body: JSON.stringify({ id: c.id, title: c.title, created, messages: c.messages })
+      });
+    } catch (e) {
+      // 409: imported by an earlier, interrupted migration
+      if (e.message !== "HTTP 409") throw e;
+    }
   }
+  localStorage.removeItem(LS_KEY);
+}
+// Prepend the previous page of messages; concurrent callers share the request in flight
+function loadOlderMessages(c, limit = PAGE_SIZE) {
+  if (c.loading) return c.loading;
+  if (c.messages && !c.hasMore) return Promise.resolve(false);
+  const before = c.messages && c.messages.length ? `&before=${c.messages[0].id}` : "";
+  c.loading = api(`/api/conversations/${encodeURIComponent(c.id)}/messages?limit=${limit}${before}`)
+    .then(page => {
+      c.messages = page.items.concat(c.messages || []);
+      c.hasMore = page.has_more;
+      return page.items.length > 0;
+    })
+    .finally(() => { c.loading = null; });
+  return c.loading;
 }
 function saveConversations() {
   localStorage.setItem(LS_KEY, JSON.stringify(conversations));
 }
+// Persistence: with the server store every change is one small request, queued per conversation
+// so they arrive in order; without it the whole list is written to localStorage.
+function enqueue(c, task) {
+  c.saving = (c.saving || Promise.resolve()).then(task).catch(e => console.warn("保存会话失败", e));
+}
+function persistConversation(c) {
+  if (!serverStore) return saveConversations();
+  enqueue(c, () => api("/api/conversations", {
+    method: "POST",
+    body: JSON.stringify({ id: c.id, title: c.title, created: c.created })
+  }));
+}
+function persistTitle(c) {
+  if (!serverStore) return saveConversations();
+  enqueue(c, () => api(`/api/conversations/${encodeURIComponent(c.id)}`, {
+    method: "PATCH",
+    body: JSON.stringify({ title: c.title })
+  }));
+}
+function persistDelete(c) {
+  if (!serverStore) return saveConversations();
+  enqueue(c, () => api(`/api/conversations/${encodeURIComponent(c.id)}`, { method: "DELETE" }));
+}
+function persistMessage(c, m) {
+  if (!serverStore) return saveConversations();
+  m.savedLength = typeof m.content === "string" ? m.content.length : 0;
+  const body = JSON.stringify({ role: m.role, content: m.content, statusText: m.statusText, created: m.created });
+  enqueue(c, async () => {
+    m.id = (await api(`/api/conversations/${encodeURIComponent(c.id)}/messages`, { method: "POST", body })).id;
+  });
+}
+// Save the part of a streaming answer received since the last call
+function persistText(c, m, text) {
+  if (!serverStore) return saveConversations();
+  const delta = text.slice(m.savedLength || 0);
+  if (!delta) return;
+  m.savedLength = text.length;
+  enqueue(c, () => api(`/api/conversations/${encodeURIComponent(c.id)}/messages/${m.id}`, {
+    method: "PATCH",
+    body: JSON.stringify({ append: delta })
+  }));
+}
+function persistStatus(c, m) {
+  if (!serverStore) return saveConversations();
+  const body = JSON.stringify({ statusText: m.statusText });
+  enqueue(c, () => api(`/api/conversations/${encodeURIComponent(c.id)}/messages/${m.id}`, { method: "PATCH", body }));
+}
 function renderConversationList() {
   const list = document.getElementById("conv-list");
   list.innerHTML = "";
@@ -62,6 +184,13 @@ function renderConversationList() {
     item.onclick = () => selectConversation(c.id);
     list.appendChild(item);
   });
+  if (conversationsCursor) {
+    const more = document.createElement("button");
+    more.className = "w-full text-left px-3 py-2 rounded-lg text-xs text-gray-500 hover:bg-gray-200/50 transition-colors mb-0.5";
+    more.textContent = "加载更多会话…";
+    more.onclick = () => loadMoreConversations().catch(e => setStatus("错误：" + e.message));
+    list.appendChild(more);
+  }
 }
 function selectConversation(id) {
   currentId = id;
@@ -69,10 +198,26 @@ function selectConversation(id) {
   document.getElementById("conv-title").textContent = c ? c.title : "未选择会话";
   renderConversationList();
   renderMessages();
+  // Server store: fetch the latest page of messages the first time the conversation is opened
+  if (c && c.messages === null) {
+    loadOlderMessages(c)
+      .then(() => { if (currentId === c.id) renderMessages(); })
+      .catch(e => setStatus("错误：" + e.message));
+  }
   
   // Mobile: Close sidebar after selection
   document.body.classList.remove('sidebar-open');
 }
+// Scrolled to the top: prepend the previous page and keep the view where it was
+async function loadEarlierMessages() {
+  const c = conversations.find(x => x.id === currentId);
+  if (!serverStore || !c || !c.messages || !c.hasMore || c.loading) return;
+  if (!(await loadOlderMessages(c)) || currentId !== c.id) return;
+  const box = document.getElementById("messages");
+  const fromBottom = box.scrollHeight - box.scrollTop;
+  renderMessages(true);
+  box.scrollTop = box.scrollHeight - fromBottom;
+}
 function renderMessages(checkUserScroll = false) {
   const box = document.getElementById("messages");
   
@@ -83,7 +228,7 @@ function renderMessages(checkUserScroll = false) {
 
   box.innerHTML = "";
   const c = conversations.find(x => x.id === currentId);
-  if (!c) return;
+  if (!c || !c.messages) return;
   c.messages.forEach(m => {
     const row = document.createElement("div");
     row.className = "flex w-full max-w-3xl mx-auto mb-6";
@@ -178,6 +323,9 @@ msgBox.addEventListener('scroll', () => {
     const distToBottom = msgBox.scrollHeight - msgBox.scrollTop - msgBox.clientHeight;
     // Threshold to 20px to avoid precision issues
     userScrolledUp = distToBottom > 20; 
+    if (msgBox.scrollTop < 50) {
+        loadEarlierMessages().catch(e => setStatus("错误：" + e.message));
+    }
 });
 
 function scrollToBottom() {
@@ -240,9 +388,9 @@ function updateLastMessage(content, statusText) {
 
 function createConversation() {
   const id = uid();
-  const conv = { id, title: "新会话", messages: [] };
+  const conv = { id, title: "新会话", messages: [], created: Date.now(), hasMore: false };
   conversations.unshift(conv);
-  saveConversations();
+  persistConversation(conv);
   selectConversation(id);
   
   // Enable input if it was disabled (e.g., previous chat was stuck)
@@ -256,8 +404,9 @@ function createConversation() {
 }
 function deleteConversation() {
   if (!currentId) return;
+  const removed = conversations.find(x => x.id === currentId);
   conversations = conversations.filter(x => x.id !== currentId);
-  saveConversations();
+  persistDelete(removed);
   currentId = conversations.length ? conversations[0].id : null;
   renderConversationList();
   selectConversation(currentId);
@@ -268,7 +417,7 @@ function renameConversation() {
   const t = prompt("输入新标题", c.title || "");
   if (t === null) return;
   c.title = t || "未命名会话";
-  saveConversations();
+  persistTitle(c);
   renderConversationList();
   document.getElementById("conv-title").textContent = c.title;
 }
@@ -298,13 +447,33 @@ function removeLoading() {
 }
 
 // Image Handling
+// Upload raw bytes once; later turns only reference the returned content hash.
+async function uploadImage(file) {
+  const resp = await fetch(`${API_BASE}/api/images`, {
+    method: "POST",
+    headers: { "Content-Type": file.type },
+    body: file
+  });
+  if (!resp.ok) throw new Error("HTTP " + resp.status);
+  return resp.json();
+}
+
 function handleFiles(files) {
   Array.from(files).forEach(file => {
     if (!file.type.startsWith('image/')) return;
     const reader = new FileReader();
-    reader.onload = e => {
-      pendingImages.push(e.target.result);
+    reader.onload = async e => {
+      const img = { url: e.target.result, id: null };
+      pendingImages.push(img);
       renderPreview();
+      try {
+        const uploaded = await uploadImage(file);
+        img.id = uploaded.id;
+        img.url = API_BASE + uploaded.url;
+      } catch (err) {
+        // Fall back to sending the data URL inline
+        console.warn("图片上传失败，改为内联发送", err);
+      }
     };
     reader.readAsDataURL(file);
   });
@@ -313,11 +482,11 @@ function handleFiles(files) {
 function renderPreview() {
   const container = document.getElementById("image-preview");
   container.innerHTML = "";
-  pendingImages.forEach((src, idx) => {
+  pendingImages.forEach((img, idx) => {
     const wrap = document.createElement("div");
     wrap.className = "relative flex-shrink-0";
     wrap.innerHTML = `
-      <img src="${src}" class="h-16 w-16 object-cover rounded border">
+      <img src="${img.url}" class="h-16 w-16 object-cover rounded border">
       <button class="absolute -top-1 -right-1 bg-red-500 text-white rounded-full p-0.5 w-4 h-4 flex items-center justify-center text-xs"
         onclick="removeImage(${idx})">×</button>
     `;
@@ -330,6 +499,27 @@ window.removeImage = function(idx) {
   renderPreview();
 }
 
+// Reconnect to a dropped stream with Last-Event-ID; the server replays what was missed
+async function resumeStream(req, lastEventId, cause) {
+  for (let attempt = 1; attempt <= 3; attempt++) {
+    setStatus(`连接中断，正在恢复 (${attempt}/3)...`);
+    await new Promise(r => setTimeout(r, 1000 * attempt));
+    try {
+      const resp = await fetch(`${API_BASE}/api/chat`, {
+        method: "POST",
+        headers: { "Content-Type": "application/json", "Last-Event-ID": lastEventId },
+        body: JSON.stringify(req)
+      });
+      // 410: the server no longer has the frames, so the reply cannot be continued
+      if (resp.status === 410) break;
+      if (resp.ok) return resp.body.getReader();
+    } catch (e) {
+      // Still offline, try again
+    }
+  }
+  throw cause;
+}
+
 async function sendMessage() {
   const el = document.getElementById("input");
   const btn = document.getElementById("send-btn");
@@ -356,6 +546,19 @@ async function sendMessage() {
       createConversation();
       c = conversations.find(x => x.id === currentId);
   }
+  // The request carries the whole history, so fetch any pages not loaded yet
+  try {
+    while (serverStore && (c.messages === null || c.hasMore)) {
+      if (!(await loadOlderMessages(c, 200))) break;
+    }
+  } catch (e) {
+    setStatus("错误：" + e.message);
+    el.disabled = false;
+    btn.disabled = false;
+    document.getElementById("upload-btn").disabled = false;
+    btn.classList.remove("opacity-50", "cursor-not-allowed");
+    return;
+  }
 
   // Construct Message Content
   let userContent;
@@ -363,13 +566,15 @@ async function sendMessage() {
     userContent = [];
     if (text) userContent.push({ type: "text", text: text });
     pendingImages.forEach(img => {
-      userContent.push({ type: "image_url", image_url: { url: img } });
+      const imageUrl = img.id ? { url: img.url, image_id: img.id } : { url: img.url };
+      userContent.push({ type: "image_url", image_url: imageUrl });
     });
   } else {
     userContent = text;
   }
 
-  c.messages.push({ role: "user", content: userContent, created: Date.now() });
+  const userMsg = { role: "user", content: userContent, created: Date.now() };
+  c.messages.push(userMsg);
   
   // Clear inputs
   pendingImages = [];
@@ -377,7 +582,7 @@ async function sendMessage() {
   el.value = "";
   el.style.height = 'auto'; 
   
-  saveConversations();
+  persistMessage(c, userMsg);
   renderMessages();
   
   setStatus("发送中...");
@@ -394,9 +599,10 @@ async function sendMessage() {
       stream: true,
       web_search: webSearchEnabled,
       api_key: settings.apiKey || undefined,
-      model: settings.modelId || undefined
+      model: settings.modelId || undefined,
+      conversation_id: c.id
     };
-    const resp = await fetch("http://localhost:8000/api/chat", {
+    const resp = await fetch(`${API_BASE}/api/chat`, {
       method: "POST",
       headers: { "Content-Type": "application/json" },
       body: JSON.stringify(req)
@@ -409,7 +615,7 @@ async function sendMessage() {
     // 创建空的 assistant 消息
     const assistantMsg = { role: "assistant", content: "", created: Date.now() };
     c.messages.push(assistantMsg);
-    saveConversations();
+    persistMessage(c, assistantMsg);
     
     // Reset scroll state before starting stream
     userScrolledUp = false;
@@ -417,12 +623,16 @@ async function sendMessage() {
     // IMPORTANT: Render the empty bubble FIRST so updateLastMessage has a target
     renderMessages();
 
-    const reader = resp.body.getReader();
+    let reader = resp.body.getReader();
     const decoder = new TextDecoder();
     let buffer = "";
+    // Set when the server keeps a replay buffer for this stream (resumable.py)
+    const streamId = resp.headers.get("X-Stream-Id");
+    let lastEventId = null;
 
     // Typewriter Effect Queue
     let streamBuffer = ""; // Full content from backend
+    let lastSave = Date.now();
     let isStreamActive = true;
     let typeWriterLoop = null;
     
@@ -435,26 +645,41 @@ async function sendMessage() {
                 
                 assistantMsg.content += streamBuffer.slice(assistantMsg.content.length, assistantMsg.content.length + step);
                 updateLastMessage(assistantMsg.content);
-                saveConversations(); // Optional: save less frequently if needed
             } else if (!isStreamActive) {
                 // Stream finished and buffer cleared
                 clearInterval(typeWriterLoop);
+                if (!serverStore) saveConversations();
                 renderMessages();
                 setStatus("完成");
             }
         }, 16); // ~60fps
 
         while (true) {
-          const { done, value } = await reader.read();
+          let chunk;
+          try {
+            chunk = await reader.read();
+          } catch (err) {
+            // Connection dropped mid-reply: pick the stream up where it stopped instead of regenerating
+            if (!streamId || !lastEventId) throw err;
+            reader = await resumeStream(req, lastEventId, err);
+            buffer = ""; // a partial frame is sent again after lastEventId
+            setStatus("已恢复连接");
+            continue;
+          }
+          const { done, value } = chunk;
           if (done) break;
           buffer += decoder.decode(value, { stream: true });
           
           let lines = buffer.split("\n\n");
           buffer = lines.pop(); 
 
-          for (const line of lines) {
-            if (line.startsWith("data: ")) {
-              const dataStr = line.slice(6);
+          for (const block of lines) {
+            let dataStr = null;
+            for (const line of block.split("\n")) {
+              if (line.startsWith("id: ")) lastEventId = line.slice(4);
+              else if (line.startsWith("data: ")) dataStr = line.slice(6);
+            }
+            if (dataStr !== null) {
               if (dataStr === "[DONE]") break;
               try {
                 const data = JSON.parse(dataStr);
@@ -464,15 +689,15 @@ async function sendMessage() {
                    // Status updates happen immediately, bypassing typewriter
                    if (data.status === 'start') {
                       assistantMsg.statusText = "正在分析请求，准备调用搜索工具...";
-                      saveConversations();
+                      persistStatus(c, assistantMsg);
                       updateLastMessage(undefined, assistantMsg.statusText);
                    } else if (data.status === 'query') {
                       assistantMsg.statusText = `正在搜索: "${data.query}"`;
-                      saveConversations();
+                      persistStatus(c, assistantMsg);
                       updateLastMessage(undefined, assistantMsg.statusText);
                    } else if (data.status === 'end') {
                       assistantMsg.statusText = "搜索完成，正在生成回答...";
-                      saveConversations();
+                      persistStatus(c, assistantMsg);
                       updateLastMessage(undefined, assistantMsg.statusText);
                    }
                 }
@@ -488,6 +713,11 @@ async function sendMessage() {
                   streamBuffer += `\n\n❌ Error: ${data.error}`;
                   setStatus("Error");
                 }
+                // Save what arrived since the last save about once a second, not the whole history
+                if (Date.now() - lastSave > 1000) {
+                  lastSave = Date.now();
+                  persistText(c, assistantMsg, streamBuffer);
+                }
               } catch (e) {
                 console.error("解析流数据失败", e);
               }
@@ -495,6 +725,7 @@ async function sendMessage() {
           }
         }
         isStreamActive = false; // Signal loop to finish up
+        persistText(c, assistantMsg, streamBuffer);
     } catch (e) {
         if (typeWriterLoop) clearInterval(typeWriterLoop);
         isStreamActive = false;
@@ -502,12 +733,13 @@ async function sendMessage() {
         removeLoading();
         setStatus("错误：" + e.message);
         // Show error in chat
-        c.messages.push({ 
+        const errorMsg = {
           role: "assistant", 
           content: `❌ 发送失败: ${e.message}`, 
           created: Date.now() 
-        });
-        saveConversations();
+        };
+        c.messages.push(errorMsg);
+        persistMessage(c, errorMsg);
         renderMessages();
     } finally {
     // 恢复输入和按钮
@@ -603,8 +835,9 @@ document.addEventListener('DOMContentLoaded', () => {
     window.saveSettings = saveSettings;
 
     loadSettings();
-    loadConversations();
-    renderConversationList();
-    selectConversation(conversations.length ? conversations[0].id : null);
     initSidebar();
+    loadConversations().then(() => {
+      renderConversationList();
+      selectConversation(conversations.length ? conversations[0].id : null);
+    });
 });
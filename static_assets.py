@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Fingerprinted, precompressed static assets, built in memory at startup.
+
+Every file under static/ is read once and also published under a
+content-hashed name (/static/js/chat.3f9a1c2b7e.js). References in
+chat.html and in stylesheets are rewritten to the hashed URLs, so those
+can be cached by browsers forever (immutable): a deploy changes the URL
+instead of relying on revalidation. Text assets are compressed once with
+gzip (and brotli when the `brotli` package is installed), so serving one
+is a dict lookup. The page itself and the unhashed paths are served with
+a strong ETag and `Cache-Control: no-cache`, answering If-None-Match
+with 304.
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+from typing import Dict, Mapping, Optional, Tuple
+
+from starlette.responses import Response
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+COMPRESSIBLE = ("text/", "application/javascript", "application/json", "image/svg+xml")
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+# Preferred first when the client accepts both
+ENCODINGS = ("br", "gzip")
+
+# Files whose references to other assets are rewritten (after those assets are hashed)
+REWRITE = (".css",)
+
+
+class Asset:
+    __slots__ = ("mime", "digest", "variants")
+
+    def __init__(self, body: bytes, mime: str, min_size: int = 512, gzip_level: int = 9):
+        self.mime = mime
+        self.digest = hashlib.sha256(body).hexdigest()
+        self.variants: Dict[str, bytes] = {"identity": body}  # content-coding -> bytes
+        if len(body) >= min_size and mime.startswith(COMPRESSIBLE):
+            if brotli is not None:
+                compressed = brotli.compress(body, quality=11)
+                if len(compressed) < len(body):
+                    self.variants["br"] = compressed
+            compressed = gzip.compress(body, compresslevel=gzip_level, mtime=0)
+            if len(compressed) < len(body):
+                self.variants["gzip"] = compressed
+
+    def etag(self, encoding: str) -> str:
+        # Each representation gets its own strong validator
+        suffix = "" if encoding == "identity" else f"-{encoding}"
+        return f'"{self.digest[:20]}{suffix}"'
+
+
+def accepted_encoding(header: str, available) -> str:
+    """Best content-coding from an Accept-Encoding header among those available."""
+    accepted = {}
+    for item in header.split(","):
+        name, _, params = item.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    for encoding in ENCODINGS:
+        if encoding in available and accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return "identity"
+
+
+class AssetBundle:
+    def __init__(self, root: str = "static", page: str = "chat.html", prefix: str = "/static",
+                 min_size: int = 512, gzip_level: int = 9):
+        self.root = root
+        self.prefix = prefix
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.assets: Dict[str, Tuple[Asset, bool]] = {}  # path under prefix -> (asset, immutable)
+        self.urls: Dict[str, str] = {}  # original URL -> hashed URL
+        self.hits = 0
+        self.not_modified = 0
+        self.compressed = 0
+
+        paths = sorted(
+            os.path.relpath(os.path.join(d, f), root).replace(os.sep, "/")
+            for d, _, files in os.walk(root) for f in files
+        )
+        for path in sorted(paths, key=lambda p: p.endswith(REWRITE)):
+            with open(os.path.join(root, path), "rb") as f:
+                data = f.read()
+            if path.endswith(REWRITE):
+                data = self.rewrite(data)
+            self._add(path, data)
+        with open(page, "rb") as f:
+            self.page = self._asset(self.rewrite(f.read()), page)
+
+    def _asset(self, data: bytes, path: str) -> Asset:
+        mime = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        return Asset(data, mime, self.min_size, self.gzip_level)
+
+    def _add(self, path: str, data: bytes):
+        asset = self._asset(data, path)
+        stem, ext = os.path.splitext(path)
+        hashed = f"{stem}.{asset.digest[:10]}{ext}"
+        self.assets[path] = (asset, False)
+        self.assets[hashed] = (asset, True)
+        self.urls[f"{self.prefix}/{path}"] = f"{self.prefix}/{hashed}"
+
+    def rewrite(self, data: bytes) -> bytes:
+        """Point references to known assets at their hashed URLs."""
+        if not self.urls:
+            return data
+        # Longest first, and only whole URLs (chat.js must not match inside chat.jsx)
+        pattern = re.compile("|".join(re.escape(u) for u in sorted(self.urls, key=len, reverse=True)) + r"(?=[\"'\s)?#]|$)")
+        return pattern.sub(lambda m: self.urls[m.group(0)], data.decode("utf-8")).encode("utf-8")
+
+    def get(self, path: str) -> Optional[Tuple[Asset, bool]]:
+        return self.assets.get(path)
+
+    def response(self, asset: Asset, immutable: bool, headers: Mapping[str, str]) -> Response:
+        encoding = accepted_encoding(headers.get("accept-encoding", ""), asset.variants)
+        etag = asset.etag(encoding)
+        response_headers = {"ETag": etag, "Cache-Control": IMMUTABLE if immutable else REVALIDATE}
+        if len(asset.variants) > 1:
+            response_headers["Vary"] = "Accept-Encoding"
+        self.hits += 1
+        if_none_match = headers.get("if-none-match")
+        if if_none_match and (if_none_match.strip() == "*" or etag in [t.strip() for t in if_none_match.split(",")]):
+            self.not_modified += 1
+            return Response(status_code=304, headers=response_headers)
+        if encoding != "identity":
+            response_headers["Content-Encoding"] = encoding
+            self.compressed += 1
+        return Response(asset.variants[encoding], media_type=asset.mime, headers=response_headers)
+
+    def stats(self) -> dict:
+        files = {id(a): a for a, _ in self.assets.values()}.values()
+        return {
+            "files": len(files),
+            "bytes": sum(len(a.variants["identity"]) for a in files),
+            "compressed_bytes": sum(min(len(v) for v in a.variants.values()) for a in files),
+            "hits": self.hits,
+            "not_modified": self.not_modified,
+            "compressed_responses": self.compressed,
+        }
+
+
+def from_config(config) -> Optional[AssetBundle]:
+    """Build the bundle from the [STATIC] section, or None to serve files from disk as they are."""
+    if not config.getboolean("STATIC", "fingerprint", fallback=True):
+        return None
+    return AssetBundle(
+        min_size=config.getint("STATIC", "min_compress_bytes", fallback=512),
+        gzip_level=config.getint("STATIC", "gzip_level", fallback=9),
+    )
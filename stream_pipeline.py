@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Table-driven handling of upstream stream events.
+
+Every upstream chunk is dispatched on its event type (`chunk.type` for the
+Responses API, `chunk.object` for Chat Completions chunks) to a handler
+that updates the stream's StreamState and returns at most one client event
+({'content'}, {'usage'}, {'type': 'searching'} or {'error'}). The event
+then passes through the pipeline's transforms in order (redaction,
+citation extraction, ...); a transform returns the event, a replacement,
+or None to drop it. Event types without a handler are ignored.
+
+An optional profiler(stage, seconds) is called around every handler and
+transform. Without one, dispatch is a dict lookup and a call per chunk.
+"""
+
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+Handler = Callable[["StreamState", Any], Optional[dict]]
+Transform = Callable[["StreamState", dict], Optional[dict]]
+
+
+class StreamState:
+    """What the handlers have learned about one stream."""
+
+    __slots__ = ("keep_text", "parts", "deltas", "failed", "errors", "search_calls",
+                 "completed", "usage", "response_id", "model", "created")
+
+    def __init__(self, keep_text: bool = False):
+        self.keep_text = keep_text  # collect the text deltas (for the cache or conversation chaining)
+        self.parts: List[str] = []
+        self.deltas = 0
+        self.failed = False
+        self.errors: List[str] = []  # error kinds, for metrics
+        self.search_calls = 0
+        self.completed = False
+        self.usage: Optional[dict] = None
+        self.response_id: Optional[str] = None
+        self.model: Optional[str] = None
+        self.created: Optional[int] = None
+
+    @property
+    def text(self) -> str:
+        return "".join(self.parts)
+
+
+def usage_dict(usage) -> dict:
+    """Usage of a Responses API response in the shape the frontend expects."""
+    details = getattr(usage, "input_tokens_details", None)
+    return {
+        "prompt_tokens": usage.input_tokens if usage else 0,
+        "completion_tokens": usage.output_tokens if usage else 0,
+        "total_tokens": usage.total_tokens if usage else 0,
+        "cached_tokens": getattr(details, "cached_tokens", 0) or 0
+    }
+
+
+def chat_usage_dict(usage) -> dict:
+    """Usage of a Chat Completions response."""
+    return {
+        "prompt_tokens": usage.prompt_tokens,
+        "completion_tokens": usage.completion_tokens,
+        "total_tokens": usage.total_tokens
+    }
+
+
+# Responses API events
+
+def on_text_delta(state: StreamState, chunk) -> dict:
+    state.deltas += 1
+    if state.keep_text:
+        state.parts.append(chunk.delta)
+    return {'content': chunk.delta}
+
+
+def on_search_started(state: StreamState, chunk) -> dict:
+    state.search_calls += 1
+    return {'type': 'searching', 'status': 'start'}
+
+
+def on_search_completed(state: StreamState, chunk) -> dict:
+    return {'type': 'searching', 'status': 'end'}
+
+
+def on_item_added(state: StreamState, chunk) -> Optional[dict]:
+    # Surface the query of a web_search call as soon as the item appears
+    item = getattr(chunk, "item", None)
+    if getattr(item, "type", None) != "web_search_call":
+        return None
+    action = getattr(item, "action", None)
+    if not action or not hasattr(action, "query"):
+        return None
+    return {'type': 'searching', 'status': 'query', 'query': action.query}
+
+
+def on_failed(state: StreamState, chunk) -> dict:
+    state.failed = True
+    state.errors.append("response_failed")
+    response = getattr(chunk, "response", None)
+    error = getattr(chunk, "error", None)
+    if response and getattr(response, "error", None):
+        message = response.error.message
+    elif error:
+        message = error.message if hasattr(error, "message") else str(error)
+    else:
+        message = "Unknown response failure"
+    return {'error': message}
+
+
+def on_error(state: StreamState, chunk) -> dict:
+    state.failed = True
+    state.errors.append("stream_error_event")
+    return {'error': chunk.message if hasattr(chunk, "message") else "Unknown stream error"}
+
+
+def on_completed(state: StreamState, chunk) -> Optional[dict]:
+    response = chunk.response
+    state.completed = True
+    state.response_id = response.id
+    state.model = response.model
+    state.created = response.created_at
+    usage = getattr(response, "usage", None)
+    if not usage:
+        return None
+    state.usage = usage_dict(usage)
+    return {'usage': state.usage}
+
+
+# Chat Completions chunks
+
+def on_chat_chunk(state: StreamState, chunk) -> Optional[dict]:
+    if state.response_id is None:
+        state.response_id, state.model, state.created = chunk.id, chunk.model, chunk.created
+    usage = getattr(chunk, "usage", None)
+    if usage:
+        # stream_options.include_usage: a final chunk without choices
+        state.completed = True
+        state.usage = chat_usage_dict(usage)
+        return {'usage': state.usage}
+    if not chunk.choices:
+        return None
+    choice = chunk.choices[0]
+    if choice.finish_reason:
+        state.completed = True
+    text = choice.delta.content if choice.delta else None
+    if not text:
+        return None
+    state.deltas += 1
+    if state.keep_text:
+        state.parts.append(text)
+    return {'content': text}
+
+
+HANDLERS: Dict[str, Handler] = {
+    "response.output_text.delta": on_text_delta,
+    "response.web_search_call.searching": on_search_started,
+    "response.web_search_call.completed": on_search_completed,
+    "response.output_item.added": on_item_added,
+    "response.failed": on_failed,
+    "error": on_error,
+    "response.completed": on_completed,
+    "chat.completion.chunk": on_chat_chunk,
+}
+
+
+class EventPipeline:
+    def __init__(self, handlers: Optional[Dict[str, Handler]] = None, transforms: Iterable[Transform] = (),
+                 profiler: Optional[Callable[[str, float], None]] = None):
+        self.handlers = dict(HANDLERS if handlers is None else handlers)
+        self.transforms = list(transforms)
+        self.profiler = profiler
+        self._kind_fields: Dict[type, str] = {}  # chunk class -> attribute holding its event type
+
+    def on(self, event_type: str, handler: Handler):
+        """Register (or replace) the handler for an event type."""
+        self.handlers[event_type] = handler
+
+    def add_transform(self, transform: Transform):
+        self.transforms.append(transform)
+
+    def process(self, state: StreamState, chunk) -> Optional[dict]:
+        """Client event for one upstream chunk, or None."""
+        cls = chunk.__class__
+        field = self._kind_fields.get(cls)
+        if field is None:
+            # Probing a missing attribute on an SDK model raises internally, so look it up once per class
+            field = self._kind_fields[cls] = "type" if hasattr(chunk, "type") else "object"
+        kind = getattr(chunk, field, None)
+        handler = self.handlers.get(kind)
+        if handler is None:
+            return None
+        if self.profiler is not None:
+            return self._process_profiled(kind, handler, state, chunk)
+        event = handler(state, chunk)
+        for transform in self.transforms:
+            if event is None:
+                break
+            event = transform(state, event)
+        return event
+
+    def _process_profiled(self, kind: str, handler: Handler, state: StreamState, chunk) -> Optional[dict]:
+        started = time.perf_counter()
+        event = handler(state, chunk)
+        now = time.perf_counter()
+        self.profiler(kind, now - started)
+        for transform in self.transforms:
+            if event is None:
+                break
+            started = now
+            event = transform(state, event)
+            now = time.perf_counter()
+            self.profiler(getattr(transform, "__name__", type(transform).__name__), now - started)
+        return event
+
+
+class StageProfiler:
+    """Accumulates calls and time per pipeline stage."""
+
+    def __init__(self):
+        self.stages: Dict[str, List[float]] = {}  # stage -> [calls, seconds, max seconds]
+
+    def __call__(self, stage: str, seconds: float):
+        entry = self.stages.get(stage)
+        if entry is None:
+            entry = self.stages[stage] = [0, 0.0, 0.0]
+        entry[0] += 1
+        entry[1] += seconds
+        if seconds > entry[2]:
+            entry[2] = seconds
+
+    def stats(self) -> dict:
+        return {
+            stage: {
+                "calls": calls,
+                "seconds": round(seconds, 6),
+                "avg_us": round(seconds * 1e6 / calls, 2) if calls else 0.0,
+                "max_us": round(longest * 1e6, 2),
+            }
+            for stage, (calls, seconds, longest) in self.stages.items()
+        }
+
+
+def from_config(config) -> EventPipeline:
+    """The default pipeline; [STREAM] profile = true times every stage."""
+    profiler = StageProfiler() if config.getboolean("STREAM", "profile", fallback=False) else None
+    return EventPipeline(profiler=profiler)
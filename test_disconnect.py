@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Check that ark_server.py closes the upstream stream when the SSE client leaves.
+
+Starts mock_ark.py with long replies plus the gateway (once with default
+settings, once with single-flight and delta coalescing off), disconnects
+clients mid-stream and polls the mock's /stats until its upstream stream
+is gone. Fails if that takes longer than --bound seconds.
+
+    python test_disconnect.py
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+import httpx
+
+from bench_concurrency import spawn, wait_port
+
+BODY = {"messages": [{"role": "user", "content": "tell me a long story"}], "stream": True}
+
+
+async def read_deltas(client, url, n):
+    """Open a stream, read n content frames, then return with the connection closed."""
+    async with client.stream("POST", url, json=BODY) as resp:
+        assert resp.status_code == 200, resp.status_code
+        seen = 0
+        async for line in resp.aiter_lines():
+            if line.startswith("data: {") and '"content"' in line:
+                seen += 1
+                if seen >= n:
+                    return
+
+
+async def wait_stats(mock, predicate, bound):
+    started = time.perf_counter()
+    while time.perf_counter() - started < bound:
+        stats = (await mock.get("/stats")).json()
+        if predicate(stats):
+            return time.perf_counter() - started, stats
+        await asyncio.sleep(0.02)
+    return None, (await mock.get("/stats")).json()
+
+
+async def run_case(name, url, mock, bound):
+    failures = []
+    async with httpx.AsyncClient(timeout=30) as client:
+        # One client leaves: the upstream stream must be closed
+        before = (await mock.get("/stats")).json()
+        await read_deltas(client, url, 3)
+        elapsed, stats = await wait_stats(
+            mock, lambda s: s["open_streams"] == 0 and s["aborted_streams"] > before["aborted_streams"], bound)
+        if elapsed is None:
+            failures.append(f"single client: upstream still open after {bound}s ({stats})")
+        else:
+            print(f"[{name}] single client: upstream closed {elapsed * 1000:.0f} ms after disconnect")
+
+        # Two clients on one coalesced stream: only the last one leaving may close it
+        first = asyncio.create_task(read_deltas(client, url, 3))
+        await asyncio.sleep(0.05)
+        second = asyncio.create_task(read_deltas(client, url, 50))
+        await first
+        await asyncio.sleep(0.2)
+        if (await mock.get("/stats")).json()["open_streams"] == 0:
+            failures.append("upstream closed while a subscriber was still reading")
+        await second
+        elapsed, stats = await wait_stats(mock, lambda s: s["open_streams"] == 0, bound)
+        if elapsed is None:
+            failures.append(f"last subscriber: upstream still open after {bound}s ({stats})")
+        else:
+            print(f"[{name}] last subscriber: upstream closed {elapsed * 1000:.0f} ms after disconnect")
+    return [f"[{name}] {f}" for f in failures]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mock-port", type=int, default=9140)
+    parser.add_argument("--port", type=int, default=9141)
+    parser.add_argument("--bound", type=float, default=2.0, help="max seconds until the upstream is closed")
+    args = parser.parse_args()
+
+    plain = tempfile.NamedTemporaryFile("w", suffix=".ini", delete=False)
+    plain.write("[SINGLEFLIGHT]\nenabled = false\n[STREAM]\ncoalesce_ms = 0\n")
+    plain.close()
+    cases = [("default", os.devnull), ("no-coalescing", plain.name)]
+
+    mock = spawn(["mock_ark.py", "--port", str(args.mock_port), "--tokens", "2000", "--ttft", "0.05", "--token-delay", "0.01"])
+    failures = []
+    try:
+        await wait_port(f"http://127.0.0.1:{args.mock_port}/docs")
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.mock_port}") as mock_client:
+            for name, config_path in cases:
+                env = {
+                    "ARK_BASE_URL": f"http://127.0.0.1:{args.mock_port}/api/v3",
+                    "ARK_API_KEY": "test",
+                    "ARK_CONFIG": config_path,
+                }
+                app = spawn(["-m", "uvicorn", "ark_server:app", "--port", str(args.port), "--log-level", "warning"], env)
+                try:
+                    await wait_port(f"http://127.0.0.1:{args.port}/docs")
+                    failures += await run_case(name, f"http://127.0.0.1:{args.port}/api/chat", mock_client, args.bound)
+                finally:
+                    app.terminate()
+                    app.wait()
+    finally:
+        mock.terminate()
+        mock.wait()
+        os.unlink(plain.name)
+
+    for f in failures:
+        print("FAIL", f)
+    print("PASS" if not failures else f"{len(failures)} failure(s)")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
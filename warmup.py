@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Startup warm-up and readiness for the Ark gateway.
+
+Records how long each startup step takes (SDK import, client setup), then
+opens keep-alive connections to the upstream in the background so DNS,
+TCP and TLS are paid before the first user request, and optionally sends
+a one-token probe request. /ready reports not-ready until this finishes.
+"""
+
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+
+class Warmup:
+    def __init__(self, connections: int = 4, probe: bool = False, timeout: float = 15.0):
+        self.connections = connections
+        self.probe = probe
+        self.timeout = timeout
+        self.ready = False
+        self.steps: Dict[str, float] = {}  # step -> seconds, in the order they ran
+        self.errors: Dict[str, str] = {}
+        self._started = time.perf_counter()
+        self._task: Optional[asyncio.Task] = None
+
+    def step(self, name: str, started: float):
+        """Record a step that began at started (a time.perf_counter() value)."""
+        self.steps[name] = time.perf_counter() - started
+
+    def start(self, http_client: httpx.AsyncClient, urls: List[str], probe: Optional[Callable[[], Awaitable]] = None):
+        """Warm up connections to each upstream URL in the background; the app already serves requests meanwhile."""
+        self._task = asyncio.create_task(self._run(http_client, urls, probe if self.probe else None))
+
+    async def _run(self, http_client, urls, probe):
+        try:
+            await asyncio.wait_for(self._warm(http_client, urls, probe), self.timeout)
+        except asyncio.TimeoutError:
+            self.errors["timeout"] = f"warm-up took longer than {self.timeout}s"
+        finally:
+            # Warm-up is best effort: a slow or unreachable upstream should not keep the instance out of rotation
+            self.steps["total"] = time.perf_counter() - self._started
+            self.ready = True
+            breakdown = ", ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in self.steps.items())
+            print(f"Startup: {breakdown}" + (f" (errors: {self.errors})" if self.errors else ""))
+
+    async def _warm(self, http_client, urls, probe):
+        if self.connections:
+            started = time.perf_counter()
+            # Concurrent requests each need their own connection, which then stays in the keep-alive pool.
+            # The status does not matter (the base URL itself is usually a 404).
+            results = await asyncio.gather(*(http_client.head(url) for url in urls for _ in range(self.connections)),
+                                           return_exceptions=True)
+            self.step("connections", started)
+            failed = [r for r in results if isinstance(r, Exception)]
+            if failed:
+                self.errors["connections"] = f"{len(failed)}/{len(results)} failed: {failed[0]!r}"
+        if probe is not None:
+            started = time.perf_counter()
+            try:
+                await probe()
+            except Exception as e:
+                self.errors["probe"] = repr(e)
+            self.step("probe", started)
+
+    def stats(self) -> dict:
+        stats = {"ready": int(self.ready)}
+        stats.update({f"{name}_seconds": round(seconds, 3) for name, seconds in self.steps.items()})
+        return stats
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+
+
+def from_config(config) -> Warmup:
+    """Build the warm-up from the [WARMUP] section; when disabled only step timings are kept."""
+    enabled = config.getboolean("WARMUP", "enabled", fallback=True)
+    return Warmup(
+        connections=config.getint("WARMUP", "connections", fallback=4) if enabled else 0,
+        probe=enabled and config.getboolean("WARMUP", "probe", fallback=False),
+        timeout=config.getfloat("WARMUP", "timeout", fallback=15.0),
+    )